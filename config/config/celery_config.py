@@ -10,6 +10,13 @@ app.config_from_object('django.conf:settings', namespace='CELERY')
 app.conf.task_queues = [
     Queue('tasks', Exchange('tasks', type='direct'), routing_key='tasks')
 ]
+# صف‌های پارتیشن‌شده فرمان‌های کیف پول (wallet_id % N)، هر صف با یک worker تک‌نخی
+WALLET_COMMAND_PARTITIONS = int(os.environ.get('WALLET_COMMAND_PARTITIONS', 4))
+app.conf.task_queues += [
+    Queue(f'wallet_commands_{partition}', Exchange('wallet_commands', type='direct'),
+          routing_key=f'wallet_commands_{partition}')
+    for partition in range(WALLET_COMMAND_PARTITIONS)
+]
 app.conf.broker_transport_options = {
     'priority_steps': list(range(10))  
 }
@@ -22,6 +29,46 @@ app.conf.worker_prefetch_multiplier= 1
 app.conf.worker_concurrency =1
 app.conf.task_reject_on_worker_lost = True
 app.conf.task_acks_on_failure_or_timeout = True
+
+# تسک‌های دوره‌ای (celery beat)
+app.conf.beat_schedule = {
+    'flush-wallet-limits': {
+        'task': 'flush_wallet_limits_task',
+        'schedule': 60.0,
+    },
+    'merge-wallet-shards': {
+        'task': 'merge_wallet_shards_task',
+        'schedule': 300.0,
+    },
+    'create-balance-checkpoints': {
+        'task': 'create_balance_checkpoints_task',
+        'schedule': 3600.0,
+    },
+    'seal-audit-log-batches': {
+        'task': 'seal_audit_log_batches_task',
+        'schedule': 60.0,
+    },
+    'archive-audit-logs': {
+        'task': 'archive_audit_logs_task',
+        'schedule': 86400.0,
+    },
+    'expire-payment-codes': {
+        'task': 'expire_payment_codes_task',
+        'schedule': 60.0,
+    },
+    'refill-id-pools': {
+        'task': 'refill_id_pools_task',
+        'schedule': 60.0,
+    },
+    'purge-wallet-commands': {
+        'task': 'purge_wallet_commands_task',
+        'schedule': 3600.0,
+    },
+    'purge-idempotency-keys': {
+        'task': 'purge_idempotency_keys_task',
+        'schedule': 3600.0,
+    },
+}
 app.autodiscover_tasks(['config.celery_tasks'])
 
 base_dir = os.getcwd()
@@ -0,0 +1,19 @@
+from config.celery_config import app
+
+
+@app.task(queue='tasks', name='seal_audit_log_batches_task')
+def seal_audit_log_batches_task():
+    """
+    مهروموم لاگ‌های امنیتی جدید در batchهای دقیقه‌ای زنجیره Merkle
+    """
+    from users.core.audit_chain import seal_batches
+    return seal_batches()
+
+
+@app.task(queue='tasks', name='archive_audit_logs_task')
+def archive_audit_logs_task():
+    """
+    بایگانی ماه‌های قدیمی‌تر از AUDIT_LOG_RETENTION_MONTHS و حذف آن‌ها از audit_logs
+    """
+    from users.core.audit_archive import archive_expired
+    return [archive.month.isoformat() for archive in archive_expired()]
@@ -0,0 +1,76 @@
+from config.celery_config import app
+
+
+@app.task(queue='tasks', name='flush_wallet_limits_task')
+def flush_wallet_limits_task():
+    """
+    انتقال شمارنده‌های محدودیت روزانه از Redis به جدول wallet_limits (برای گزارش)
+    و برگرداندن رزرو انتقال‌هایی که commit نشدند
+    """
+    from wallet.limits import flush_to_database, release_abandoned
+    return {'flushed': flush_to_database(), 'released': release_abandoned()}
+
+
+@app.task(queue='tasks', name='merge_wallet_shards_task')
+def merge_wallet_shards_task():
+    """
+    ادغام دوره‌ای شاردهای موجودی ورودی با موجودی اصلی کیف پول‌ها
+    """
+    from wallet.ledger import merge_shards
+    return merge_shards()
+
+
+@app.task(queue='tasks', name='create_balance_checkpoints_task')
+def create_balance_checkpoints_task():
+    """
+    ثبت checkpoint موجودی برای کیف پول‌هایی که تراکنش جدید دارند
+    """
+    from wallet.checkpoints import create_checkpoints
+    return create_checkpoints()
+
+
+@app.task(queue='tasks', name='expire_payment_codes_task')
+def expire_payment_codes_task():
+    """
+    منقضی کردن QRها و لینک‌های پرداخت سررسیده و حذف ردیف‌های غیرفعال قدیمی
+    """
+    from wallet.expiry import expire_due, prune_old
+    return {'expired': expire_due(), 'pruned': prune_old()}
+
+
+@app.task(queue='tasks', name='refill_id_pools_task')
+def refill_id_pools_task():
+    """
+    پر کردن استخر شناسه‌های یکتا (آدرس کیف پول، QR، لینک پرداخت، کد اختصاصی)
+    """
+    from wallet.id_pool import refill
+    return refill()
+
+
+@app.task(queue='tasks', name='apply_wallet_command_task')
+def apply_wallet_command_task(command, payload):
+    """
+    اجرای فرمان کیف پول در صف پارتیشن آن (wallet_commands_<n>)
+
+    صف در زمان ارسال مشخص می‌شود (wallet.command_queue)؛ queue بالا فقط پیش‌فرض است.
+    """
+    from wallet.command_queue import apply_command
+    return apply_command(command, payload)
+
+
+@app.task(queue='tasks', name='purge_wallet_commands_task')
+def purge_wallet_commands_task():
+    """
+    حذف شناسه فرمان‌های کیف پول قدیمی‌تر از بازه تکرار درخواست
+    """
+    from wallet.command_queue import purge_processed_commands
+    return purge_processed_commands()
+
+
+@app.task(queue='tasks', name='purge_idempotency_keys_task')
+def purge_idempotency_keys_task():
+    """
+    حذف کلیدهای Idempotency-Key منقضی‌شده
+    """
+    from wallet.idempotency import purge_expired_keys
+    return purge_expired_keys()
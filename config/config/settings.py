@@ -1,4 +1,5 @@
 import os
+import sys
 from datetime import timedelta
 from pathlib import Path
 from dotenv import load_dotenv
@@ -9,6 +10,7 @@ load_dotenv(os.path.join(BASE_DIR, ".env"))
 
 SECRET_KEY = os.environ.get('SECRET_KEY',"fallback_secret_key")
 DEBUG = os.environ.get('DEBUG', 'False') == 'True'
+TESTING = sys.argv[1:2] == ['test']
 ALLOWED_HOSTS = [
     '127.0.0.1',
     'payacard.co',
@@ -252,6 +254,7 @@ CORS_ALLOW_HEADERS = [
     'x-requested-with',
     'cache-control',
     'pragma',
+    'idempotency-key',
 ]
 
 # Allow all methods for development
@@ -288,6 +291,59 @@ PAYMENT_GATEWAYS = {
     }
 }
 
+# Idempotency-Key برای endpointهای جابه‌جایی پول (charge, debit, transfer, charge-gateway)
+IDEMPOTENCY_KEY_TTL = int(os.environ.get('IDEMPOTENCY_KEY_TTL', 24 * 60 * 60))  # ثانیه
+IDEMPOTENCY_WAIT_TIMEOUT = int(os.environ.get('IDEMPOTENCY_WAIT_TIMEOUT', 15))  # ثانیه
+
+# لاگ امنیتی: ثبت غیرهم‌زمان و گروهی توسط users.core.audit_writer (در تست‌ها هم‌زمان)
+AUDIT_LOG_ASYNC = os.environ.get('AUDIT_LOG_ASYNC', str(not TESTING)) == 'True'
+AUDIT_LOG_BATCH_SIZE = int(os.environ.get('AUDIT_LOG_BATCH_SIZE', 200))
+AUDIT_LOG_FLUSH_INTERVAL_MS = int(os.environ.get('AUDIT_LOG_FLUSH_INTERVAL_MS', 500))
+AUDIT_LOG_SPILL_DIR = os.environ.get('AUDIT_LOG_SPILL_DIR', os.path.join(BASE_DIR, 'logs', 'audit_spill'))
+
+# زنجیره Merkle لاگ امنیتی (users.core.audit_chain): مهروموم دقیقه‌ای batchها
+AUDIT_CHAIN_SEAL_DELAY_SECONDS = int(os.environ.get('AUDIT_CHAIN_SEAL_DELAY_SECONDS', 60))
+AUDIT_CHAIN_MAX_BATCH_SIZE = int(os.environ.get('AUDIT_CHAIN_MAX_BATCH_SIZE', 10000))
+AUDIT_CHAIN_VERIFY_MAX_BATCHES = int(os.environ.get('AUDIT_CHAIN_VERIFY_MAX_BATCHES', 1440))  # حداکثر در هر درخواست API
+
+# بایگانی ماهانه لاگ امنیتی (users.core.audit_archive): ماه‌های قدیمی‌تر به فایل gzip منتقل می‌شوند
+AUDIT_LOG_RETENTION_MONTHS = int(os.environ.get('AUDIT_LOG_RETENTION_MONTHS', 6))
+AUDIT_LOG_ARCHIVE_DIR = os.environ.get('AUDIT_LOG_ARCHIVE_DIR', os.path.join(BASE_DIR, 'logs', 'audit_archive'))
+AUDIT_LOG_EXPORT_CHUNK_SIZE = int(os.environ.get('AUDIT_LOG_EXPORT_CHUNK_SIZE', 2000))  # رکورد در هر رفت‌وبرگشت cursor
+
+# حالت اجرای فرمان‌های کیف پول: 'direct' یا 'queue' (صف Celery پارتیشن‌شده بر اساس wallet_id)
+WALLET_COMMAND_MODE = os.environ.get('WALLET_COMMAND_MODE', 'direct')
+WALLET_COMMAND_PARTITIONS = int(os.environ.get('WALLET_COMMAND_PARTITIONS', 4))
+WALLET_COMMAND_TIMEOUT = int(os.environ.get('WALLET_COMMAND_TIMEOUT', 10))  # ثانیه
+
+# checkpoint موجودی (wallet.checkpoints)؛ فقط تراکنش‌های قدیمی‌تر از این مدت پوشش داده می‌شوند تا تراکنش‌های commit‌نشده جا نمانند
+BALANCE_CHECKPOINT_SAFETY_LAG = int(os.environ.get('BALANCE_CHECKPOINT_SAFETY_LAG', 5 * 60))  # ثانیه
+
+# متریک قفل ردیف کیف پول (wallet.lock_stats): دستورهای کندتر از این مقدار رقابت حساب می‌شوند
+WALLET_LOCK_CONTENTION_MS = int(os.environ.get('WALLET_LOCK_CONTENTION_MS', 50))
+
+# cache پاسخ موجودی و گزارش کیف پول (wallet.response_cache)؛ با هر تراکنش کیف پول باطل می‌شود
+WALLET_RESPONSE_CACHE_TTL = int(os.environ.get('WALLET_RESPONSE_CACHE_TTL', 60))  # ثانیه
+WALLET_RESPONSE_CACHE_STALE_TTL = int(os.environ.get('WALLET_RESPONSE_CACHE_STALE_TTL', 30))  # ثانیه
+
+# cache تصویر QR (wallet.qr_render): LRU محلی هر process جلوی cache مشترک
+QR_RENDER_LOCAL_CACHE_SIZE = int(os.environ.get('QR_RENDER_LOCAL_CACHE_SIZE', 256))  # تعداد تصویر
+QR_RENDER_CACHE_TTL = int(os.environ.get('QR_RENDER_CACHE_TTL', 24 * 60 * 60))  # ثانیه
+QR_ASSET_DIR = os.environ.get('QR_ASSET_DIR', os.path.join(MEDIA_ROOT, 'qr_assets'))  # تصاویر از پیش رندرشده
+
+# cache اطلاعات QR و لینک پرداخت (wallet.lookup_cache)؛ TTL تا expires_at و حداکثر این مقدار
+LOOKUP_CACHE_MAX_TTL = int(os.environ.get('LOOKUP_CACHE_MAX_TTL', 24 * 60 * 60))  # ثانیه
+
+# منقضی کردن دوره‌ای QR و لینک پرداخت (wallet.expiry)؛ ردیف‌های غیرفعال پس از این مدت حذف می‌شوند
+PAYMENT_CODE_RETENTION_DAYS = int(os.environ.get('PAYMENT_CODE_RETENTION_DAYS', 90))
+
+# استخر شناسه‌های یکتای از پیش تولیدشده (wallet.id_pool)؛ هر دقیقه تا این اندازه پر می‌شود
+ID_POOL_SIZE = int(os.environ.get('ID_POOL_SIZE', 2000))
+
+# تولید دسته‌ای QR برای چاپ (wallet.qr_batch)؛ دسته‌های بزرگ‌تر با دستور generate_qr_batch
+QR_BATCH_MAX_COUNT = int(os.environ.get('QR_BATCH_MAX_COUNT', 48))  # در هر درخواست API (4 برگه A4)
+QR_BATCH_MAX_EXPIRES_IN = int(os.environ.get('QR_BATCH_MAX_EXPIRES_IN', 365 * 24 * 60 * 60))  # ثانیه
+
 # Encryption Settings (طبق الزامات کاشف)
 # در production باید از environment variable استفاده شود
 ENCRYPTION_KEY = os.environ.get('ENCRYPTION_KEY', 'default-encryption-key-change-in-production-32-chars!!')
@@ -4,7 +4,8 @@ from rest_framework_simplejwt.tokens import RefreshToken
 from django.utils import timezone
 from datetime import timedelta
 
-from users.core.models import User, OTP, AuditLog
+from users.core.models import User, OTP
+from users.core.audit_context import record_event
 from users.core.utils.utils import _code
 from .serializer import ValidationPhoneSerializer,ValidationPhoneAndCodeSerializer
 
@@ -27,7 +28,7 @@ class LoginRegisterApiView(views.APIView):
         )
 
         # ثبت لاگ برای درخواست OTP
-        AuditLog.create_log(
+        record_event(
             event_type='auth_success' if created else 'other',
             event_description=f'درخواست کد OTP برای شماره {phone}',
             request=request,
@@ -52,7 +53,7 @@ class VerifyApiView(views.APIView):
 
         if not otp:
             # ثبت لاگ برای احراز هویت ناموفق
-            AuditLog.create_log(
+            record_event(
                 event_type='auth_failed',
                 event_description=f'تلاش ناموفق احراز هویت - کد OTP نامعتبر برای شماره {phone}',
                 request=request,
@@ -63,7 +64,7 @@ class VerifyApiView(views.APIView):
 
         if not otp.is_valid():
             # ثبت لاگ برای کد منقضی شده
-            AuditLog.create_log(
+            record_event(
                 event_type='auth_failed',
                 event_description=f'تلاش ناموفق احراز هویت - کد OTP منقضی شده برای شماره {phone}',
                 request=request,
@@ -77,7 +78,7 @@ class VerifyApiView(views.APIView):
         otp.delete()
 
         # ثبت لاگ برای احراز هویت موفق
-        AuditLog.create_log(
+        record_event(
             event_type='auth_success',
             event_description=f'احراز هویت موفق برای کاربر {phone}',
             user=user,
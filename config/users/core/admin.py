@@ -2,7 +2,7 @@ from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 from django.utils.translation import gettext_lazy as _
 
-from .models import User, OTP, AuditLog
+from .models import User, OTP, AuditLog, AuditLogArchive, AuditLogBatch
 
 
 
@@ -56,7 +56,7 @@ class AuditLogAdmin(admin.ModelAdmin):
     readonly_fields = (
         'event_type', 'event_description', 'result', 'user', 'username', 'user_phone',
         'ip_address', 'user_agent', 'request_method', 'request_path', 'request_id',
-        'metadata', 'integrity_hash', 'content_type', 'object_id', 'created_at'
+        'metadata', 'integrity_hash', 'content_type', 'object_id', 'batch', 'created_at'
     )
     ordering = ('-created_at',)
     date_hierarchy = 'created_at'
@@ -73,3 +73,39 @@ class AuditLogAdmin(admin.ModelAdmin):
         """غیرفعال کردن امکان حذف از admin"""
         return False
 
+
+@admin.register(AuditLogBatch)
+class AuditLogBatchAdmin(admin.ModelAdmin):
+    """
+    Admin برای batchهای مهروموم‌شده لاگ امنیتی (فقط خواندن)
+    """
+    list_display = ('sequence', 'period_start', 'record_count', 'merkle_root', 'archive', 'sealed_at')
+    search_fields = ('merkle_root', 'chain_hash')
+    ordering = ('-sequence',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(AuditLogArchive)
+class AuditLogArchiveAdmin(admin.ModelAdmin):
+    """
+    Admin برای بایگانی‌های ماهانه لاگ امنیتی (فقط خواندن)
+    """
+    list_display = ('month', 'record_count', 'first_sequence', 'last_sequence', 'sha256', 'created_at')
+    ordering = ('-month',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
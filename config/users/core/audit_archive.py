@@ -0,0 +1,345 @@
+"""
+بایگانی ماهانه لاگ‌های امنیتی
+
+جدول audit_logs فقط AUDIT_LOG_RETENTION_MONTHS ماه اخیر را نگه می‌دارد. هر ماه
+قدیمی‌تر به‌صورت یک پارتیشن منطقی بایگانی می‌شود:
+
+1. رکوردهای batchهای مهروموم‌شده آن ماه (به ترتیب زنجیره) در فایل NDJSON فشرده
+   (gzip) نوشته و ریشه Merkle هر batch هنگام نوشتن دوباره بررسی می‌شود
+2. فایل manifest (sha256 فایل، تعداد، بازه زمانی و ریشه/hash زنجیره batchها)
+   کنار آن نوشته و رکورد AuditLogArchive ثبت می‌شود
+3. رکوردها batch به batch از جدول حذف می‌شوند (قابل ادامه پس از توقف)
+
+AuditLogViewSet برای بازه‌های زمانی قدیمی‌تر، فایل‌های بایگانی هم‌پوشان را
+به‌صورت جریانی می‌خواند (iter_archived / archived_page).
+"""
+import gzip
+import hashlib
+import heapq
+import json
+import os
+from datetime import datetime
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from users.core.audit_chain import LEAF_FIELDS, leaf_hash, merkle_root, seal_batches
+from users.core.models import AuditLog, AuditLogArchive, AuditLogBatch
+
+_FIELDS_BY_ATTNAME = {field.attname: field for field in AuditLog._meta.concrete_fields}
+ARCHIVE_FIELDS = list(_FIELDS_BY_ATTNAME)
+
+SEARCH_FIELDS = ['event_type', 'event_description', 'user_phone', 'username', 'ip_address', 'request_path']
+
+_READ_SIZE = 1024 * 1024
+DROP_BATCH_CHUNK = 50
+
+
+def month_start(value):
+    """ابتدای ماه (UTC) زمان داده‌شده"""
+    value = value.astimezone(timezone.utc)
+    return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(value, months):
+    month_index = value.month - 1 + months
+    return value.replace(year=value.year + month_index // 12, month=month_index % 12 + 1)
+
+
+def archive_boundary(now=None):
+    """رکوردهای batchهایی که پیش از این زمان شروع شده‌اند قابل بایگانی هستند"""
+    return add_months(month_start(now or timezone.now()), -settings.AUDIT_LOG_RETENTION_MONTHS)
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as archive_file:
+        for block in iter(lambda: archive_file.read(_READ_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _encode(row):
+    record = dict(row)
+    # DjangoJSONEncoder میکروثانیه را حذف می‌کند؛ برای بازسازی hash برگ دقیق نگه داشته می‌شود
+    record['created_at'] = row['created_at'].isoformat()
+    return json.dumps(record, ensure_ascii=False, default=str)
+
+
+def _leaf_values(record):
+    values = {field: record[field] for field in LEAF_FIELDS}
+    values['created_at'] = datetime.fromisoformat(record['created_at'])
+    return values
+
+
+def _read_records(path):
+    with gzip.open(path, 'rt', encoding='utf-8') as archive_file:
+        for line in archive_file:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _check_batch_root(batch, leaves):
+    if len(leaves) != batch.record_count or merkle_root(leaves) != batch.merkle_root:
+        raise ValueError(f"Audit batch {batch.sequence} does not match its Merkle root")
+
+
+def _export(batches, path, chunk_size):
+    """
+    نوشتن رکوردهای batchها در فایل gzip با بررسی ریشه Merkle هر batch
+
+    خروجی: (تعداد رکورد، زمان اولین و آخرین رکورد)
+    """
+    by_id = {batch.id: batch for batch in batches}
+    rows = (
+        AuditLog.objects.filter(batch_id__in=list(by_id))
+        .order_by('batch_id', 'id')
+        .values(*ARCHIVE_FIELDS)
+        .iterator(chunk_size=chunk_size)
+    )
+    count = 0
+    first_created_at = last_created_at = None
+    current = None
+    leaves = []
+    with gzip.open(path, 'wt', encoding='utf-8') as archive_file:
+        for row in rows:
+            if row['batch_id'] != current:
+                if current is not None:
+                    _check_batch_root(by_id.pop(current), leaves)
+                current = row['batch_id']
+                leaves = []
+            leaves.append(leaf_hash({field: row[field] for field in LEAF_FIELDS}))
+            archive_file.write(_encode(row) + '\n')
+            count += 1
+            created_at = row['created_at']
+            first_created_at = min(first_created_at or created_at, created_at)
+            last_created_at = max(last_created_at or created_at, created_at)
+    if current is not None:
+        _check_batch_root(by_id.pop(current), leaves)
+    for batch in by_id.values():
+        _check_batch_root(batch, [])
+    return count, first_created_at, last_created_at
+
+
+def _drop_archived(archive):
+    """
+    حذف رکوردهای بایگانی‌شده از جدول (هر بار رکوردهای چند batch)
+
+    خروجی: تعداد رکوردهای حذف‌شده
+    """
+    batch_ids = list(archive.batches.order_by('sequence').values_list('id', flat=True))
+    dropped = 0
+    for start in range(0, len(batch_ids), DROP_BATCH_CHUNK):
+        dropped += AuditLog.objects.filter(batch_id__in=batch_ids[start:start + DROP_BATCH_CHUNK]).delete()[0]
+    return dropped
+
+
+def archive_month(month, chunk_size=5000):
+    """
+    بایگانی batchهای شروع‌شده پیش از پایان ماه month (شامل رکوردهای دیررس ماه‌های قبل)
+
+    اگر بایگانی ماه قبلاً ساخته شده ولی حذف نیمه‌کاره مانده باشد، فقط حذف ادامه می‌یابد.
+    خروجی: AuditLogArchive یا None اگر رکوردی برای بایگانی نباشد
+    """
+    month = month_start(month)
+    archive = AuditLogArchive.objects.filter(month=month.date()).first()
+    if archive is not None:
+        _drop_archived(archive)
+        return archive
+
+    batches = list(
+        AuditLogBatch.objects.filter(period_start__lt=add_months(month, 1), archive__isnull=True)
+        .order_by('sequence')
+    )
+    if not batches:
+        return None
+
+    directory = settings.AUDIT_LOG_ARCHIVE_DIR
+    os.makedirs(directory, exist_ok=True)
+    name = f"audit_logs-{month:%Y-%m}"
+    path = os.path.join(directory, f"{name}.ndjson.gz")
+    manifest_path = os.path.join(directory, f"{name}.manifest.json")
+    partial_path = f"{path}.partial"
+
+    count, first_created_at, last_created_at = _export(batches, partial_path, chunk_size)
+    os.replace(partial_path, path)
+    sha256 = _file_sha256(path)
+
+    manifest = {
+        'month': f"{month:%Y-%m}",
+        'file': os.path.basename(path),
+        'sha256': sha256,
+        'record_count': count,
+        'first_created_at': first_created_at.isoformat() if first_created_at else None,
+        'last_created_at': last_created_at.isoformat() if last_created_at else None,
+        'batches': [
+            {
+                'sequence': batch.sequence,
+                'record_count': batch.record_count,
+                'merkle_root': batch.merkle_root,
+                'chain_hash': batch.chain_hash,
+            }
+            for batch in batches
+        ],
+    }
+    with open(manifest_path, 'w', encoding='utf-8') as manifest_file:
+        json.dump(manifest, manifest_file, ensure_ascii=False, indent=2)
+
+    with transaction.atomic():
+        archive = AuditLogArchive.objects.create(
+            month=month.date(),
+            file_path=path,
+            manifest_path=manifest_path,
+            sha256=sha256,
+            record_count=count,
+            first_created_at=first_created_at or batches[0].period_start,
+            last_created_at=last_created_at or batches[-1].period_end,
+            first_sequence=batches[0].sequence,
+            last_sequence=batches[-1].sequence,
+        )
+        # از این لحظه verify_audit_chain رکوردهای این batchها را از فایل بایگانی بررسی می‌کند
+        AuditLogBatch.objects.filter(id__in=[batch.id for batch in batches]).update(archive=archive)
+    _drop_archived(archive)
+    return archive
+
+
+def archive_expired(now=None, chunk_size=5000):
+    """
+    بایگانی همه ماه‌های قدیمی‌تر از AUDIT_LOG_RETENTION_MONTHS
+
+    رکوردهای مهروموم‌نشده قدیمی ابتدا مهروموم می‌شوند.
+    خروجی: لیست AuditLogArchiveهای ساخته/تکمیل‌شده
+    """
+    boundary = archive_boundary(now)
+    seal_batches(now=now)
+    archives = []
+    # بایگانی‌های نیمه‌کاره (توقف حین حذف)
+    unfinished = AuditLogArchive.objects.filter(
+        Exists(AuditLog.objects.filter(batch__archive=OuterRef('pk')))
+    )
+    for archive in unfinished:
+        _drop_archived(archive)
+        archives.append(archive)
+
+    while True:
+        oldest = (
+            AuditLogBatch.objects.filter(archive__isnull=True, period_start__lt=boundary)
+            .order_by('period_start').values_list('period_start', flat=True).first()
+        )
+        if oldest is None:
+            return archives
+        # batchهای دیررسِ ماهی که قبلاً بایگانی شده در بایگانی ماه بعد قرار می‌گیرند
+        month = month_start(oldest)
+        while AuditLogArchive.objects.filter(month=month.date()).exists():
+            month = add_months(month, 1)
+        if month >= boundary:
+            return archives
+        archives.append(archive_month(month, chunk_size=chunk_size))
+
+
+def verify_archive(archive):
+    """
+    بررسی فایل بایگانی با manifest و ریشه‌های Merkle زنجیره
+
+    خروجی: لیست مغایرت‌ها
+    """
+    issues = []
+    if not os.path.exists(archive.file_path):
+        return [{'check': 'archive_missing', 'month': f"{archive.month:%Y-%m}"}]
+    if _file_sha256(archive.file_path) != archive.sha256:
+        issues.append({'check': 'archive_hash_mismatch', 'month': f"{archive.month:%Y-%m}"})
+
+    batches = {batch.id: batch for batch in archive.batches.all()}
+    leaves = {}
+    for record in _read_records(archive.file_path):
+        leaves.setdefault(record['batch_id'], []).append(leaf_hash(_leaf_values(record)))
+    for batch_id, batch in batches.items():
+        batch_leaves = leaves.pop(batch_id, [])
+        if len(batch_leaves) != batch.record_count:
+            issues.append({
+                'check': 'count_mismatch', 'sequence': batch.sequence,
+                'expected': batch.record_count, 'actual': len(batch_leaves)
+            })
+        elif merkle_root(batch_leaves) != batch.merkle_root:
+            issues.append({'check': 'root_mismatch', 'sequence': batch.sequence})
+    for batch_id in leaves:
+        issues.append({'check': 'unknown_batch', 'month': f"{archive.month:%Y-%m}", 'batch_id': batch_id})
+    return issues
+
+
+def _matches(record, filters):
+    if filters.get('event_type') and record['event_type'] != filters['event_type']:
+        return False
+    if filters.get('result') and record['result'] != filters['result']:
+        return False
+    if filters.get('user_id') and str(record['user_id']) != str(filters['user_id']):
+        return False
+    if filters.get('user_phone') and filters['user_phone'] not in (record['user_phone'] or ''):
+        return False
+    if filters.get('ip_address') and record['ip_address'] != filters['ip_address']:
+        return False
+    if filters.get('request_id') and record['request_id'] != filters['request_id']:
+        return False
+    if filters.get('search'):
+        term = filters['search'].lower()
+        if not any(term in str(record[field] or '').lower() for field in SEARCH_FIELDS):
+            return False
+    return True
+
+
+def _to_log(record):
+    """ساخت AuditLog ذخیره‌نشده از رکورد بایگانی (برای serializerهای API)"""
+    return AuditLog(**{
+        attname: _FIELDS_BY_ATTNAME[attname].to_python(value)
+        for attname, value in record.items() if attname in _FIELDS_BY_ATTNAME
+    })
+
+
+def overlapping_archives(start_date, end_date=None):
+    """بایگانی‌هایی که بازه زمانی آن‌ها با [start_date, end_date] هم‌پوشانی دارد"""
+    archives = AuditLogArchive.objects.filter(last_created_at__gte=start_date)
+    if end_date is not None:
+        archives = archives.filter(first_created_at__lte=end_date)
+    return archives.order_by('-month')
+
+
+def iter_archived(filters):
+    """
+    رکوردهای بایگانی‌شده مطابق فیلترها (start_date الزامی است)
+
+    خروجی: (created_at، id، record) به ترتیب فایل
+    """
+    start_date = filters['start_date']
+    end_date = filters.get('end_date')
+    for archive in overlapping_archives(start_date, end_date):
+        for record in _read_records(archive.file_path):
+            created_at = datetime.fromisoformat(record['created_at'])
+            if created_at < start_date or (end_date is not None and created_at > end_date):
+                continue
+            if _matches(record, filters):
+                yield created_at, record['id'], record
+
+
+def archived_page(filters, offset, limit):
+    """
+    یک صفحه از رکوردهای بایگانی‌شده به ترتیب نزولی زمان
+
+    فایل‌ها جریانی خوانده می‌شوند و فقط offset + limit رکورد در حافظه می‌ماند.
+    خروجی: (تعداد کل رکوردهای مطابق، لیست AuditLogهای ذخیره‌نشده صفحه)
+    """
+    count = 0
+    newest = []
+    keep = offset + limit
+    for created_at, log_id, record in iter_archived(filters):
+        count += 1
+        if keep <= 0:
+            continue
+        item = (created_at, log_id, record)
+        if len(newest) < keep:
+            heapq.heappush(newest, item)
+        elif item[:2] > newest[0][:2]:
+            heapq.heapreplace(newest, item)
+    page = sorted(newest, key=lambda item: item[:2], reverse=True)[offset:offset + limit]
+    return count, [_to_log(record) for _, _, record in page]
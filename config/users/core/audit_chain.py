@@ -0,0 +1,286 @@
+"""
+زنجیره Merkle لاگ‌های امنیتی
+
+رکوردهای AuditLog به‌صورت دوره‌ای (هر دقیقه، توسط celery beat) در batchهای
+مهروموم‌شده گروه‌بندی می‌شوند:
+
+- leaf هر رکورد: SHA-256 همه فیلدهای رکورد (به‌جز batch) به‌صورت JSON مرتب
+- merkle_root: ریشه درخت Merkle برگ‌ها به ترتیب id
+- chain_hash: SHA-256 (previous_hash، sequence، record_count، merkle_root)
+
+برای بررسی صحت یک بازه فقط batchهای همان بازه دوباره hash می‌شوند (دستور
+verify_audit_chain آن‌ها را بین چند process پخش می‌کند) و اثبات وجود یک رکورد
+در batch با log2(n) hash همسایه انجام می‌شود (inclusion_proof / verify_proof).
+"""
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from users.core.models import AuditLog, AuditLogBatch
+
+
+GENESIS_HASH = '0' * 64
+
+SEAL_RETRIES = 3
+
+LEAF_FIELDS = [
+    'id', 'event_type', 'event_description', 'result', 'user_id', 'username', 'user_phone',
+    'ip_address', 'user_agent', 'request_method', 'request_path', 'request_id', 'metadata',
+    'integrity_hash', 'content_type_id', 'object_id', 'created_at',
+]
+
+_LEAF_PREFIX = b'\x00'
+_NODE_PREFIX = b'\x01'
+
+
+def leaf_hash(values):
+    """hash برگ یک رکورد (values: دیکشنری LEAF_FIELDS)"""
+    record = dict(values)
+    record['created_at'] = record['created_at'].astimezone(timezone.utc).isoformat()
+    canonical = json.dumps(
+        record, cls=DjangoJSONEncoder, sort_keys=True, ensure_ascii=False, separators=(',', ':')
+    )
+    return hashlib.sha256(_LEAF_PREFIX + canonical.encode('utf-8')).hexdigest()
+
+
+def node_hash(left, right):
+    return hashlib.sha256(_NODE_PREFIX + bytes.fromhex(left) + bytes.fromhex(right)).hexdigest()
+
+
+def chain_hash(previous_hash, sequence, record_count, merkle_root):
+    data = f"{previous_hash}:{sequence}:{record_count}:{merkle_root}"
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+def _next_level(level):
+    # گره بدون جفت در انتهای هر سطح بدون تغییر به سطح بالاتر می‌رود
+    parents = [node_hash(level[i], level[i + 1]) for i in range(0, len(level) - 1, 2)]
+    if len(level) % 2:
+        parents.append(level[-1])
+    return parents
+
+
+def merkle_root(leaves):
+    """ریشه درخت Merkle لیست hash برگ‌ها"""
+    if not leaves:
+        return GENESIS_HASH
+    level = list(leaves)
+    while len(level) > 1:
+        level = _next_level(level)
+    return level[0]
+
+
+def inclusion_proof(leaves, index):
+    """
+    مسیر اثبات وجود برگ index در درخت
+
+    خروجی: لیست {'hash', 'position'}؛ position محل گره همسایه (left/right) است
+    """
+    proof = []
+    level = list(leaves)
+    while len(level) > 1:
+        sibling = index ^ 1
+        if sibling < len(level):
+            proof.append({'hash': level[sibling], 'position': 'left' if sibling < index else 'right'})
+        level = _next_level(level)
+        index //= 2
+    return proof
+
+
+def verify_proof(leaf, proof, root):
+    """بررسی اثبات وجود با O(log n) hash"""
+    current = leaf
+    for step in proof:
+        if step['position'] == 'left':
+            current = node_hash(step['hash'], current)
+        else:
+            current = node_hash(current, step['hash'])
+    return current == root
+
+
+def batch_leaves(batch):
+    """(id، hash برگ) رکوردهای یک batch به ترتیب id"""
+    rows = AuditLog.objects.filter(batch=batch).order_by('id').values(*LEAF_FIELDS)
+    return [(row['id'], leaf_hash(row)) for row in rows.iterator(chunk_size=2000)]
+
+
+def _seal_next_batch(cutoff):
+    """
+    مهروموم رکوردهای دقیقه قدیمی‌ترین رکورد بدون batch در batch بعدی زنجیره
+
+    خروجی: batch ایجادشده یا None اگر رکوردی قدیمی‌تر از cutoff نمانده باشد
+    """
+    unsealed = AuditLog.objects.filter(batch__isnull=True)
+    with transaction.atomic():
+        # قفل آخرین batch، مهروموم‌های هم‌زمان را ترتیبی می‌کند. اولین batch ردیفی
+        # برای قفل ندارد و منتظر قفل ممکن است batch قدیمی را خوانده باشد؛ در هر دو
+        # حالت INSERT دوم با unique بودن sequence رد می‌شود (seal_batches دوباره تلاش می‌کند)
+        previous = AuditLogBatch.objects.select_for_update().order_by('-sequence').first()
+        oldest = (
+            unsealed.filter(created_at__lt=cutoff).order_by('created_at')
+            .values_list('created_at', flat=True).first()
+        )
+        if oldest is None:
+            return None
+        period_start = oldest.replace(second=0, microsecond=0)
+        period_end = period_start + timedelta(minutes=1)
+        rows = list(
+            unsealed.filter(created_at__lt=period_end).order_by('id')
+            .values(*LEAF_FIELDS)[:settings.AUDIT_CHAIN_MAX_BATCH_SIZE]
+        )
+        ids = [row['id'] for row in rows]
+        root = merkle_root([leaf_hash(row) for row in rows])
+        sequence = previous.sequence + 1 if previous else 1
+        previous_hash = previous.chain_hash if previous else GENESIS_HASH
+        batch = AuditLogBatch.objects.create(
+            sequence=sequence,
+            period_start=period_start,
+            period_end=period_end,
+            first_log_id=ids[0],
+            last_log_id=ids[-1],
+            record_count=len(ids),
+            merkle_root=root,
+            previous_hash=previous_hash,
+            chain_hash=chain_hash(previous_hash, sequence, len(ids), root),
+        )
+        for start in range(0, len(ids), 500):
+            AuditLog.objects.filter(id__in=ids[start:start + 500]).update(batch=batch)
+    return batch
+
+
+def seal_batches(now=None):
+    """
+    مهروموم رکوردهای بدون batch، هر دقیقه در یک batch
+
+    رکوردهای AUDIT_CHAIN_SEAL_DELAY_SECONDS ثانیه اخیر مهروموم نمی‌شوند تا
+    رکوردهای بافرشده audit_writer به batch دقیقه خود برسند؛ رکوردهای دیرتر
+    (مثلاً بازیابی‌شده از فایل spill) در batch بعدی قرار می‌گیرند.
+    خروجی: تعداد batchهای ایجادشده
+    """
+    cutoff = (now or timezone.now()) - timedelta(seconds=settings.AUDIT_CHAIN_SEAL_DELAY_SECONDS)
+    cutoff = cutoff.replace(second=0, microsecond=0)
+    sealed = 0
+    conflicts = 0
+    while True:
+        try:
+            batch = _seal_next_batch(cutoff)
+        except IntegrityError:
+            # مهروموم هم‌زمان همین sequence را ثبت کرده است؛ تلاش بعدی روی batch جدید ادامه می‌دهد
+            conflicts += 1
+            if conflicts > SEAL_RETRIES:
+                raise
+            continue
+        if batch is None:
+            return sealed
+        sealed += 1
+
+
+def _issue(check, sequence, **details):
+    issue = {'check': check, 'sequence': sequence}
+    issue.update(details)
+    return issue
+
+
+def verify_range(start_sequence, end_sequence, chunk_size=5000):
+    """
+    بررسی batchهای با start_sequence <= sequence < end_sequence
+
+    - chain_broken: previous_hash یا chain_hash با batch قبلی سازگار نیست
+    - sequence_gap: batch میانی حذف شده است
+    - count_mismatch / root_mismatch: رکوردی تغییر کرده، حذف یا اضافه شده است
+      (فقط برای batchهای بایگانی‌نشده)
+    خروجی: (تعداد batch، تعداد رکورد، لیست مغایرت‌ها)
+    """
+    batches = list(
+        AuditLogBatch.objects.filter(sequence__gte=start_sequence - 1, sequence__lt=end_sequence)
+        .order_by('sequence')
+    )
+    issues = []
+    previous = None
+    if batches and batches[0].sequence == start_sequence - 1:
+        previous = batches.pop(0)
+    elif start_sequence > 1 and batches:
+        issues.append(_issue('sequence_gap', start_sequence - 1))
+
+    for batch in batches:
+        if previous is None:
+            expected_previous = GENESIS_HASH if batch.sequence == 1 else None
+        else:
+            if batch.sequence != previous.sequence + 1:
+                issues.append(_issue('sequence_gap', batch.sequence, previous_sequence=previous.sequence))
+            expected_previous = previous.chain_hash
+        computed = chain_hash(batch.previous_hash, batch.sequence, batch.record_count, batch.merkle_root)
+        if (expected_previous is not None and batch.previous_hash != expected_previous) \
+                or batch.chain_hash != computed:
+            issues.append(_issue('chain_broken', batch.sequence))
+        previous = batch
+
+    # رکوردهای batchهای بایگانی‌شده در فایل بایگانی هستند (audit_archive.verify_archive)
+    by_id = {batch.id: batch for batch in batches if batch.archive_id is None}
+    rows = (
+        AuditLog.objects.filter(batch_id__in=list(by_id))
+        .order_by('batch_id', 'id')
+        .values('batch_id', *LEAF_FIELDS)
+        .iterator(chunk_size=chunk_size)
+    )
+    record_count = 0
+    leaves = {batch_id: [] for batch_id in by_id}
+    current = None
+    for row in rows:
+        record_count += 1
+        batch_id = row.pop('batch_id')
+        if batch_id != current:
+            if current is not None:
+                _check_batch(by_id[current], leaves.pop(current), issues)
+            current = batch_id
+        leaves[current].append(leaf_hash(row))
+    if current is not None:
+        _check_batch(by_id[current], leaves.pop(current), issues)
+    # batchهایی که همه رکوردهایشان حذف شده‌اند
+    for batch_id in leaves:
+        _check_batch(by_id[batch_id], [], issues)
+
+    return len(batches), record_count, issues
+
+
+def _check_batch(batch, leaves, issues):
+    if len(leaves) != batch.record_count:
+        issues.append(_issue(
+            'count_mismatch', batch.sequence, expected=batch.record_count, actual=len(leaves)
+        ))
+    elif merkle_root(leaves) != batch.merkle_root:
+        issues.append(_issue('root_mismatch', batch.sequence))
+
+
+def build_proof(log):
+    """
+    اثبات وجود رکورد در batch و زنجیره
+
+    خروجی: دیکشنری شامل hash برگ فعلی رکورد، مسیر اثبات، ریشه و hash زنجیره
+    batch و نتیجه بررسی (valid)
+    """
+    if log.batch_id is None:
+        raise ValueError("Audit log is not sealed yet")
+    batch = log.batch
+    leaf_ids, leaves = zip(*batch_leaves(batch))
+    index = leaf_ids.index(log.id)
+    proof = inclusion_proof(leaves, index)
+    return {
+        'log_id': log.id,
+        'leaf_hash': leaves[index],
+        'leaf_index': index,
+        'proof': proof,
+        'batch': {
+            'sequence': batch.sequence,
+            'record_count': batch.record_count,
+            'merkle_root': batch.merkle_root,
+            'previous_hash': batch.previous_hash,
+            'chain_hash': batch.chain_hash,
+        },
+        'valid': verify_proof(leaves[index], proof, batch.merkle_root),
+    }
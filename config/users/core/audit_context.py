@@ -0,0 +1,92 @@
+"""
+context لاگ امنیتی در محدوده یک درخواست
+
+AuditLoggingMiddleware برای هر درخواست یک AuditContext روی request قرار
+می‌دهد. کد کسب‌وکار (شارژ، برداشت، انتقال، احراز هویت) به‌جای ثبت رکورد
+جداگانه با record_event نوع رویداد، توضیحات و metadata (شناسه تراکنش‌ها،
+موجودی‌ها و ...) را به این context اضافه می‌کند و middleware در پایان درخواست
+فقط یک رکورد غنی‌شده ثبت می‌کند.
+
+اگر request از middleware عبور نکرده باشد (Celery، دستورات مدیریتی، تست‌ها)
+record_event مثل قبل مستقیم AuditLog.create_log را صدا می‌زند.
+"""
+from users.core.models import AuditLog
+
+
+class AuditContext:
+    """اطلاعات رویداد کسب‌وکار برای ادغام در رکورد لاگ درخواست"""
+
+    def __init__(self):
+        self.event_type = None
+        self.event_description = None
+        self.user = None
+        self.result = None
+        self.metadata = {}
+        self.related_object = None
+
+    @property
+    def has_event(self):
+        return self.event_type is not None
+
+    def update(self, event_type, event_description, user=None, result='success',
+               metadata=None, related_object=None):
+        """ثبت رویداد؛ در صورت چند رویداد، metadata آن‌ها ادغام می‌شود"""
+        self.event_type = event_type
+        self.event_description = event_description
+        self.result = result
+        if user is not None:
+            self.user = user
+        if metadata:
+            self.metadata.update(metadata)
+        if related_object is not None:
+            self.related_object = related_object
+
+    def to_payload(self):
+        """نسخه قابل serialize برای برگرداندن از worker صف فرمان‌ها"""
+        if not self.has_event:
+            return None
+        return {
+            'event_type': self.event_type,
+            'event_description': self.event_description,
+            'result': self.result,
+            'metadata': self.metadata,
+        }
+
+
+def attach(request):
+    """ایجاد context برای درخواست (در middleware)"""
+    request.audit_context = AuditContext()
+    return request.audit_context
+
+
+def get_context(request):
+    """context درخواست یا None"""
+    if request is None:
+        return None
+    return getattr(request, 'audit_context', None)
+
+
+def record_event(event_type, event_description, user=None, request=None, result='success',
+                 metadata=None, related_object=None):
+    """
+    ثبت رویداد امنیتی
+
+    اگر request دارای context باشد اطلاعات به رکورد درخواست اضافه می‌شود،
+    در غیر این صورت رکورد مستقل ثبت می‌شود.
+    """
+    context = get_context(request)
+    if context is None:
+        return AuditLog.create_log(
+            event_type=event_type,
+            event_description=event_description,
+            user=user,
+            request=request,
+            result=result,
+            metadata=metadata,
+            related_object=related_object
+        )
+    context.update(
+        event_type, event_description, user=user, result=result,
+        metadata=metadata, related_object=related_object
+    )
+    return None
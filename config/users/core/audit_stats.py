@@ -0,0 +1,99 @@
+"""
+آمار تجمیعی لاگ‌های امنیتی
+
+شمارنده‌های ساعتی (AuditLogHourlyStat) هنگام درج لاگ‌ها با یک upsert افزایشی
+به‌روز می‌شوند. آمار هر بازه از جمع شمارنده‌های ساعت‌های کامل بازه به‌علاوه
+یک GROUP BY روی رکوردهای ساعت ناقص ابتدای بازه محاسبه می‌شود.
+"""
+from collections import Counter
+from datetime import timedelta
+
+from django.db import connection
+from django.db.models import Count, Sum
+
+from users.core.models import AuditLog, AuditLogHourlyStat
+
+SECURITY_EVENT_TYPES = ['auth_failed', 'access_denied', 'security_event', 'system_error']
+
+
+def truncate_hour(value):
+    return value.replace(minute=0, second=0, microsecond=0)
+
+
+def add_counts(logs):
+    """افزایش شمارنده‌های ساعتی برای لاگ‌های تازه درج‌شده"""
+    counts = Counter((truncate_hour(log.created_at), log.event_type, log.result) for log in logs)
+    if not counts:
+        return
+    hour_field = AuditLogHourlyStat._meta.get_field('hour')
+    table = connection.ops.quote_name(AuditLogHourlyStat._meta.db_table)
+    count_column = connection.ops.quote_name('count')
+    sql = (
+        f"INSERT INTO {table} (hour, event_type, result, {count_column}) VALUES (%s, %s, %s, %s) "
+        f"ON CONFLICT (hour, event_type, result) "
+        f"DO UPDATE SET {count_column} = {table}.{count_column} + excluded.{count_column}"
+    )
+    params = [
+        (hour_field.get_db_prep_value(hour, connection), event_type, result, count)
+        for (hour, event_type, result), count in sorted(counts.items())
+    ]
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, params)
+
+
+def count_by_type_and_result(start, event_type=None, result=None):
+    """
+    تعداد لاگ‌ها از زمان start به تفکیک (event_type، result)
+
+    ساعت‌های کامل از شمارنده‌ها و ساعت ناقص ابتدای بازه با یک GROUP BY روی
+    audit_logs خوانده می‌شوند.
+    """
+    first_full_hour = truncate_hour(start)
+    if first_full_hour < start:
+        first_full_hour += timedelta(hours=1)
+
+    stats = AuditLogHourlyStat.objects.filter(hour__gte=first_full_hour)
+    head = AuditLog.objects.filter(created_at__gte=start, created_at__lt=first_full_hour)
+    if event_type:
+        stats = stats.filter(event_type=event_type)
+        head = head.filter(event_type=event_type)
+    if result:
+        stats = stats.filter(result=result)
+        head = head.filter(result=result)
+
+    counts = Counter()
+    for row in stats.values('event_type', 'result').annotate(total=Sum('count')):
+        counts[row['event_type'], row['result']] += row['total']
+    for row in head.order_by().values('event_type', 'result').annotate(total=Count('id')):
+        counts[row['event_type'], row['result']] += row['total']
+    return counts
+
+
+def count_queryset(queryset):
+    """تعداد لاگ‌های queryset به تفکیک (event_type، result) با یک GROUP BY"""
+    counts = Counter()
+    for row in queryset.order_by().values('event_type', 'result').annotate(total=Count('id')):
+        counts[row['event_type'], row['result']] += row['total']
+    return counts
+
+
+def summarize(counts):
+    """خلاصه آمار از شمارش‌های (event_type، result)"""
+    event_type_stats = Counter()
+    result_stats = Counter()
+    for (event_type, result), count in counts.items():
+        event_type_stats[event_type] += count
+        result_stats[result] += count
+    return {
+        'total_count': sum(counts.values()),
+        'failed_count': result_stats['failed'],
+        'security_events': sum(event_type_stats[event_type] for event_type in SECURITY_EVENT_TYPES),
+        'event_type_stats': {
+            event_type: event_type_stats[event_type]
+            for event_type, _ in AuditLog.EVENT_TYPE_CHOICES if event_type_stats[event_type]
+        },
+        'result_stats': {
+            result: result_stats[result]
+            for result, _ in AuditLog.RESULT_CHOICES if result_stats[result]
+        },
+    }
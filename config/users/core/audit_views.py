@@ -6,12 +6,20 @@ from rest_framework import viewsets, status, filters
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
+from django.conf import settings
+from django.http import StreamingHttpResponse
 from django.utils import timezone
-from django.db.models import Q
+from django.db.models import Max
 from django.core.paginator import Paginator
 from datetime import timedelta
 
-from users.core.models import AuditLog
+from users.core.audit_archive import archived_page, overlapping_archives
+from users.core.audit_chain import build_proof, verify_range
+from users.core.audit_context import record_event
+from users.core.audit_export import EXPORT_FORMATS, stream_export
+from users.core.audit_stats import SECURITY_EVENT_TYPES, count_by_type_and_result, count_queryset, summarize
+from users.core.models import AuditLog, AuditLogBatch
+from users.core.pagination import get_page_size, keyset_page, wants_count
 from users.core.serializers import AuditLogSerializer, AuditLogListSerializer
 from users.core.permissions import CanViewAuditLogs
 
@@ -33,57 +41,61 @@ class AuditLogViewSet(viewsets.ReadOnlyModelViewSet):
             return AuditLogListSerializer
         return AuditLogSerializer
     
+    def _get_filters(self):
+        """پارامترهای فیلتر درخواست (مشترک بین جدول audit_logs و فایل‌های بایگانی)"""
+        params = self.request.query_params
+        filters = {
+            key: params.get(key)
+            for key in ('event_type', 'result', 'user_id', 'user_phone', 'ip_address', 'request_id')
+            if params.get(key)
+        }
+        for key in ('start_date', 'end_date'):
+            value = params.get(key)
+            if not value:
+                continue
+            try:
+                value = timezone.datetime.fromisoformat(value.replace('Z', '+00:00'))
+            except ValueError:
+                continue
+            filters[key] = timezone.make_aware(value) if timezone.is_naive(value) else value
+        return filters
+    
     def get_queryset(self):
         """فیلتر کردن queryset بر اساس پارامترهای درخواست"""
         queryset = AuditLog.objects.all()
+        filters = self._get_filters()
         
         # فیلتر بر اساس نوع رویداد
-        event_type = self.request.query_params.get('event_type')
-        if event_type:
-            queryset = queryset.filter(event_type=event_type)
+        if 'event_type' in filters:
+            queryset = queryset.filter(event_type=filters['event_type'])
         
         # فیلتر بر اساس نتیجه
-        result = self.request.query_params.get('result')
-        if result:
-            queryset = queryset.filter(result=result)
+        if 'result' in filters:
+            queryset = queryset.filter(result=filters['result'])
         
         # فیلتر بر اساس کاربر
-        user_id = self.request.query_params.get('user_id')
-        if user_id:
-            queryset = queryset.filter(user_id=user_id)
+        if 'user_id' in filters:
+            queryset = queryset.filter(user_id=filters['user_id'])
         
         # فیلتر بر اساس شماره تلفن
-        user_phone = self.request.query_params.get('user_phone')
-        if user_phone:
-            queryset = queryset.filter(user_phone__icontains=user_phone)
+        if 'user_phone' in filters:
+            queryset = queryset.filter(user_phone__icontains=filters['user_phone'])
         
         # فیلتر بر اساس IP
-        ip_address = self.request.query_params.get('ip_address')
-        if ip_address:
-            queryset = queryset.filter(ip_address=ip_address)
+        if 'ip_address' in filters:
+            queryset = queryset.filter(ip_address=filters['ip_address'])
         
         # فیلتر بر اساس تاریخ شروع
-        start_date = self.request.query_params.get('start_date')
-        if start_date:
-            try:
-                start_datetime = timezone.datetime.fromisoformat(start_date.replace('Z', '+00:00'))
-                queryset = queryset.filter(created_at__gte=start_datetime)
-            except ValueError:
-                pass
+        if 'start_date' in filters:
+            queryset = queryset.filter(created_at__gte=filters['start_date'])
         
         # فیلتر بر اساس تاریخ پایان
-        end_date = self.request.query_params.get('end_date')
-        if end_date:
-            try:
-                end_datetime = timezone.datetime.fromisoformat(end_date.replace('Z', '+00:00'))
-                queryset = queryset.filter(created_at__lte=end_datetime)
-            except ValueError:
-                pass
+        if 'end_date' in filters:
+            queryset = queryset.filter(created_at__lte=filters['end_date'])
         
         # فیلتر بر اساس request_id
-        request_id = self.request.query_params.get('request_id')
-        if request_id:
-            queryset = queryset.filter(request_id=request_id)
+        if 'request_id' in filters:
+            queryset = queryset.filter(request_id=filters['request_id'])
         
         return queryset
     
@@ -93,8 +105,30 @@ class AuditLogViewSet(viewsets.ReadOnlyModelViewSet):
         
         # Pagination
         page = int(request.query_params.get('page', 1))
-        page_size = int(request.query_params.get('page_size', 50))
-        page_size = min(page_size, 100)  # حداکثر 100 رکورد در هر صفحه
+        page_size = get_page_size(request, default=50)  # حداکثر 100 رکورد در هر صفحه
+        
+        # بازه‌ای که به ماه‌های بایگانی‌شده می‌رسد از فایل‌های بایگانی هم خوانده می‌شود
+        filters = self._get_filters()
+        if 'start_date' in filters and overlapping_archives(filters['start_date'], filters.get('end_date')).exists():
+            return self._list_with_archive(queryset, filters, max(page, 1), page_size)
+        
+        # صفحه‌بندی keyset روی (created_at, id)، مگر با page یا ordering صریح
+        params = request.query_params
+        if 'cursor' in params or ('page' not in params and 'ordering' not in params):
+            try:
+                page_data = keyset_page(
+                    queryset, cursor=params.get('cursor'), page_size=page_size,
+                    include_count=wants_count(request)
+                )
+            except ValueError as e:
+                return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            serializer = self.get_serializer(page_data['results'], many=True)
+            return Response({
+                'count': page_data['count'],
+                'next': page_data['next'],
+                'previous': None,
+                'results': serializer.data
+            })
         
         paginator = Paginator(queryset, page_size)
         page_obj = paginator.get_page(page)
@@ -108,49 +142,87 @@ class AuditLogViewSet(viewsets.ReadOnlyModelViewSet):
             'results': serializer.data
         })
     
+    def _list_with_archive(self, queryset, filters, page, page_size):
+        """صفحه‌بندی روی رکوردهای جدول و سپس رکوردهای بایگانی (قدیمی‌تر)"""
+        filters['search'] = self.request.query_params.get('search')
+        offset = (page - 1) * page_size
+        
+        table_count = queryset.count()
+        results = list(queryset[offset:offset + page_size]) if offset < table_count else []
+        archived_count, archived = archived_page(
+            filters, max(offset - table_count, 0), page_size - len(results)
+        )
+        results += archived
+        count = table_count + archived_count
+        
+        serializer = self.get_serializer(results, many=True)
+        return Response({
+            'count': count,
+            'archived_count': archived_count,
+            'next': page + 1 if offset + page_size < count else None,
+            'previous': page - 1 if page > 1 else None,
+            'results': serializer.data
+        })
+    
     @action(detail=False, methods=['get'])
     def statistics(self, request):
         """آمار لاگ‌ها"""
-        queryset = self.get_queryset()
-        
         # فیلتر بر اساس بازه زمانی (پیش‌فرض: 30 روز گذشته)
         days = int(request.query_params.get('days', 30))
         start_date = timezone.now() - timedelta(days=days)
-        queryset = queryset.filter(created_at__gte=start_date)
         
-        # آمار بر اساس نوع رویداد
-        event_type_stats = {}
-        for event_type, _ in AuditLog.EVENT_TYPE_CHOICES:
-            count = queryset.filter(event_type=event_type).count()
-            if count > 0:
-                event_type_stats[event_type] = count
+        # فیلترهای نوع رویداد و نتیجه از شمارنده‌های ساعتی پاسخ داده می‌شوند؛
+        # سایر فیلترها با یک GROUP BY روی جدول
+        filters = self._get_filters()
+        if set(filters) <= {'event_type', 'result'}:
+            counts = count_by_type_and_result(
+                start_date, event_type=filters.get('event_type'), result=filters.get('result')
+            )
+        else:
+            counts = count_queryset(self.get_queryset().filter(created_at__gte=start_date))
         
-        # آمار بر اساس نتیجه
-        result_stats = {}
-        for result, _ in AuditLog.RESULT_CHOICES:
-            count = queryset.filter(result=result).count()
-            if count > 0:
-                result_stats[result] = count
+        return Response(dict(summarize(counts), period_days=days))
+    
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """
+        خروجی جریانی لاگ‌های فیلترشده به‌صورت NDJSON یا CSV
         
-        # تعداد کل
-        total_count = queryset.count()
+        پارامترها: همان فیلترهای لیست، export_format (ndjson/csv) و compress=gzip
+        """
+        export_format = request.query_params.get('export_format', 'ndjson')
+        if export_format not in EXPORT_FORMATS:
+            return Response({'detail': 'Unsupported export format'}, status=status.HTTP_400_BAD_REQUEST)
+        compress = request.query_params.get('compress') == 'gzip'
         
-        # تعداد رویدادهای ناموفق
-        failed_count = queryset.filter(result='failed').count()
+        export_filters = self._get_filters()
+        export_filters['search'] = request.query_params.get('search')
+        queryset = self.filter_queryset(self.get_queryset())
         
-        # تعداد رویدادهای امنیتی
-        security_events = queryset.filter(
-            event_type__in=['auth_failed', 'access_denied', 'security_event', 'system_error']
-        ).count()
+        # ثبت خود این خروجی در لاگ امنیتی درخواست
+        record_event(
+            event_type='data_export',
+            event_description=f'خروجی لاگ‌های امنیتی ({export_format})',
+            user=request.user,
+            request=request,
+            metadata={
+                'export_format': export_format,
+                'compress': compress,
+                'filters': {key: str(value) for key, value in export_filters.items() if value},
+            }
+        )
         
-        return Response({
-            'total_count': total_count,
-            'failed_count': failed_count,
-            'security_events': security_events,
-            'event_type_stats': event_type_stats,
-            'result_stats': result_stats,
-            'period_days': days,
-        })
+        content_type, extension = EXPORT_FORMATS[export_format]
+        filename = f"audit-logs-{timezone.now():%Y%m%d%H%M%S}.{extension}"
+        if compress:
+            content_type = 'application/gzip'
+            filename += '.gz'
+        response = StreamingHttpResponse(
+            stream_export(queryset, export_filters, export_format=export_format, compress=compress),
+            content_type=content_type
+        )
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
     
     @action(detail=False, methods=['get'])
     def recent_failures(self, request):
@@ -166,9 +238,7 @@ class AuditLogViewSet(viewsets.ReadOnlyModelViewSet):
     @action(detail=False, methods=['get'])
     def security_events(self, request):
         """رویدادهای امنیتی"""
-        queryset = self.get_queryset().filter(
-            event_type__in=['auth_failed', 'access_denied', 'security_event', 'system_error']
-        )
+        queryset = self.get_queryset().filter(event_type__in=SECURITY_EVENT_TYPES)
         
         # Pagination
         page = int(request.query_params.get('page', 1))
@@ -185,5 +255,42 @@ class AuditLogViewSet(viewsets.ReadOnlyModelViewSet):
             'previous': page_obj.previous_page_number() if page_obj.has_previous() else None,
             'results': serializer.data
         })
-
-
+    
+    @action(detail=True, methods=['get'])
+    def proof(self, request, pk=None):
+        """اثبات وجود رکورد در batch مهروموم‌شده زنجیره (O(log n) hash)"""
+        log = self.get_object()
+        try:
+            return Response(build_proof(log))
+        except ValueError as e:
+            return Response({'detail': str(e)}, status=status.HTTP_409_CONFLICT)
+    
+    @action(detail=False, methods=['get'], url_path='verify-chain')
+    def verify_chain(self, request):
+        """بررسی صحت زنجیره Merkle در بازه from_sequence تا to_sequence"""
+        try:
+            from_sequence = max(int(request.query_params.get('from_sequence', 1)), 1)
+            to_sequence = request.query_params.get('to_sequence')
+            if to_sequence is None:
+                to_sequence = AuditLogBatch.objects.aggregate(last=Max('sequence'))['last'] or 0
+            to_sequence = int(to_sequence)
+        except ValueError:
+            return Response({'detail': 'Invalid sequence range'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        # بازه‌های بزرگ‌تر با دستور verify_audit_chain (چند process) بررسی می‌شوند
+        max_batches = settings.AUDIT_CHAIN_VERIFY_MAX_BATCHES
+        if to_sequence - from_sequence + 1 > max_batches:
+            return Response(
+                {'detail': f'At most {max_batches} batches can be verified per request'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        batch_count, record_count, issues = verify_range(from_sequence, to_sequence + 1)
+        return Response({
+            'from_sequence': from_sequence,
+            'to_sequence': to_sequence,
+            'batches': batch_count,
+            'records': record_count,
+            'valid': not issues,
+            'issues': issues,
+        })
@@ -0,0 +1,276 @@
+"""
+نویسنده غیرهم‌زمان و گروهی لاگ‌های امنیتی
+
+AuditLoggingMiddleware به‌جای INSERT در مسیر درخواست، رکورد را به این بافر
+درون‌پروسه‌ای می‌دهد. هر رکورد ابتدا به فایل spill (یک خط JSON) اضافه می‌شود و
+سپس در بافر قرار می‌گیرد؛ یک thread پس‌زمینه هر AUDIT_LOG_BATCH_SIZE رکورد یا
+هر AUDIT_LOG_FLUSH_INTERVAL_MS میلی‌ثانیه بافر را با bulk_create ذخیره می‌کند.
+
+هر پروسه فایل‌های spill خود را با نام یکتا (hostname، pid و یک شناسه تصادفی
+شروع) می‌سازد و تا حذف آن‌ها قفل flock انحصاری نگه می‌دارد. در هر flush فایل
+جاری fsync و بسته‌نشده کنار گذاشته می‌شود، فایل جدیدی باز می‌شود و فایل قبلی
+فقط پس از موفقیت bulk_create حذف می‌شود. قفل با توقف پروسه (حتی روی میزبان
+یا container دیگری که همین پوشه را mount کرده) آزاد می‌شود؛ هر پروسه‌ای که
+قفل فایلی را بگیرد آن را با rename اتمی تصاحب، بازخوانی و ثبت می‌کند.
+رکوردهایی که hash صحت آن‌ها از قبل در جدول هست دوباره ثبت نمی‌شوند.
+
+با AUDIT_LOG_ASYNC=False (مثلاً در تست‌ها) هر رکورد مستقیم ذخیره می‌شود.
+"""
+import atexit
+import fcntl
+import json
+import logging
+import os
+import socket
+import threading
+import uuid
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections, transaction
+
+from users.core.audit_stats import add_counts
+from users.core.models import AuditLog
+
+logger = logging.getLogger(__name__)
+
+
+SPILL_PREFIX = 'audit-'
+SPILL_SUFFIX = '.ndjson'
+CLAIM_SUFFIX = '.claimed-'
+
+_FIELDS = [field for field in AuditLog._meta.concrete_fields if not field.primary_key]
+
+
+def serialize_log(log):
+    """تبدیل رکورد ذخیره‌نشده به دیکشنری قابل نوشتن در فایل spill"""
+    return {field.attname: getattr(log, field.attname) for field in _FIELDS}
+
+
+def deserialize_log(record):
+    """ساخت رکورد AuditLog از دیکشنری spill"""
+    values = {}
+    for field in _FIELDS:
+        if field.attname in record:
+            values[field.attname] = field.to_python(record[field.attname])
+    return AuditLog(**values)
+
+
+def write_records(records, skip_existing=False):
+    """
+    ذخیره گروهی رکوردها (hash صحت همین‌جا و خارج از مسیر درخواست محاسبه می‌شود)
+
+    skip_existing: رکوردهایی که hash آن‌ها قبلاً ثبت شده نادیده گرفته می‌شوند
+    (برای بازخوانی فایل‌های spill پس از crash)
+    """
+    logs = [deserialize_log(record) for record in records]
+    for log in logs:
+        log.integrity_hash = log.compute_integrity_hash()
+    if skip_existing and logs:
+        existing = set(
+            AuditLog.objects.filter(integrity_hash__in=[log.integrity_hash for log in logs])
+            .values_list('integrity_hash', flat=True)
+        )
+        logs = [log for log in logs if log.integrity_hash not in existing]
+    with transaction.atomic():
+        AuditLog.objects.bulk_create(logs, batch_size=settings.AUDIT_LOG_BATCH_SIZE)
+        # یک upsert برای هر (ساعت، نوع رویداد، نتیجه) در batch
+        add_counts(logs)
+    return len(logs)
+
+
+def _read_spill_file(path):
+    records = []
+    with open(path, encoding='utf-8') as spill:
+        for line in spill:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                # خط ناقص انتهای فایل (crash در حین نوشتن)
+                logger.warning('Skipping truncated audit spill line in %s', path)
+    return records
+
+
+def _lock(spill):
+    """قفل انحصاری فایل spill؛ False اگر پروسه دیگری آن را نگه داشته است"""
+    try:
+        fcntl.flock(spill.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return False
+    return True
+
+
+def _claim(path, claimant):
+    """
+    تصاحب فایل spill رهاشده با قفل و rename اتمی
+
+    خروجی: (فایل باز و قفل‌شده، مسیر جدید) یا None اگر صاحب فایل هنوز زنده است
+    یا پروسه دیگری زودتر آن را تصاحب کرده
+    """
+    try:
+        spill = open(path, encoding='utf-8')
+    except FileNotFoundError:
+        return None
+    try:
+        if not _lock(spill) or os.stat(path).st_ino != os.fstat(spill.fileno()).st_ino:
+            # قفل در دست صاحب فایل است یا فایل پس از باز شدن تصاحب و جابه‌جا شده
+            spill.close()
+            return None
+        claimed = f"{path.split(CLAIM_SUFFIX)[0]}{CLAIM_SUFFIX}{claimant}"
+        os.rename(path, claimed)
+    except FileNotFoundError:
+        spill.close()
+        return None
+    return spill, claimed
+
+
+def _discard(spill, path):
+    os.remove(path)
+    spill.close()
+
+
+class AuditLogWriter:
+    """
+    بافر درون‌پروسه‌ای لاگ‌ها با flush پس‌زمینه و فایل spill
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self._writer_id = None
+        self._buffer = []
+        self._failed = []
+        self._spill = None
+        self._segment = 0
+        self._wake = threading.Event()
+
+    @property
+    def spill_dir(self):
+        return settings.AUDIT_LOG_SPILL_DIR
+
+    def _open_segment(self):
+        self._segment += 1
+        path = os.path.join(self.spill_dir, f"{SPILL_PREFIX}{self._writer_id}-{self._segment}{SPILL_SUFFIX}")
+        spill = open(path, 'a', encoding='utf-8')
+        # قفل تا حذف فایل نگه داشته می‌شود و با توقف پروسه خودبه‌خود آزاد می‌شود
+        _lock(spill)
+        return spill
+
+    def _ensure_started(self):
+        """راه‌اندازی تنبل در هر پروسه (پس از fork در gunicorn هم دوباره اجرا می‌شود)"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._writer_id = f"{socket.gethostname()}-{self._pid}-{uuid.uuid4().hex[:12]}"
+            self._buffer = []
+            self._failed = []
+            self._segment = 0
+            self._wake = threading.Event()
+            os.makedirs(self.spill_dir, exist_ok=True)
+            self._spill = self._open_segment()
+            threading.Thread(target=self._run, name='audit-log-writer', daemon=True).start()
+            atexit.register(self.flush)
+
+    def submit(self, log):
+        """
+        ثبت یک رکورد لاگ (ذخیره‌نشده)
+
+        در حالت غیرهم‌زمان فقط یک append به فایل و بافر انجام می‌شود.
+        """
+        if not settings.AUDIT_LOG_ASYNC:
+            log.save()
+            return
+
+        self._ensure_started()
+        record = serialize_log(log)
+        line = json.dumps(record, cls=DjangoJSONEncoder, ensure_ascii=False)
+        with self._lock:
+            self._spill.write(line + '\n')
+            self._spill.flush()
+            self._buffer.append(record)
+            full = len(self._buffer) >= settings.AUDIT_LOG_BATCH_SIZE
+        if full:
+            self._wake.set()
+
+    def flush(self):
+        """
+        ذخیره بافر جاری در پایگاه داده
+
+        خروجی: تعداد رکوردهای ذخیره‌شده
+        """
+        if self._pid != os.getpid():
+            return 0
+        with self._lock:
+            if not self._buffer:
+                return 0
+            batch, self._buffer = self._buffer, []
+            spill = self._spill
+            # رکوردهای batch پیش از خروج از بافر روی دیسک پایدار می‌شوند
+            os.fsync(spill.fileno())
+            self._spill = self._open_segment()
+
+        try:
+            written = write_records(batch)
+        except Exception:
+            # فایل spill (همچنان قفل‌شده) نگه داشته می‌شود و در چرخه‌های بعدی دوباره تلاش می‌شود
+            logger.error('Error writing audit log batch', exc_info=True)
+            self._failed.append((spill, spill.name))
+            return 0
+        _discard(spill, spill.name)
+        return written
+
+    def recover(self):
+        """
+        ثبت دوباره batchهای ناموفق همین پروسه و فایل‌های spill رهاشده
+
+        فایلی که قفل آن در دست پروسه زنده‌ای است نادیده گرفته می‌شود؛ فایل
+        رهاشده پیش از پردازش با rename تصاحب می‌شود تا دو پروسه آن را هم‌زمان
+        ثبت نکنند.
+        خروجی: تعداد رکوردهای ثبت‌شده
+        """
+        claimant = self._writer_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:12]}"
+        spills, self._failed = self._failed, []
+        if os.path.isdir(self.spill_dir):
+            for name in sorted(os.listdir(self.spill_dir)):
+                if name.startswith(SPILL_PREFIX):
+                    claimed = _claim(os.path.join(self.spill_dir, name), claimant)
+                    if claimed is not None:
+                        spills.append(claimed)
+
+        recovered = 0
+        for spill, path in spills:
+            try:
+                recovered += write_records(_read_spill_file(path), skip_existing=True)
+            except Exception:
+                logger.error('Error recovering audit spill file %s', path, exc_info=True)
+                self._failed.append((spill, path))
+                continue
+            _discard(spill, path)
+        return recovered
+
+    def _run(self):
+        interval = settings.AUDIT_LOG_FLUSH_INTERVAL_MS / 1000
+        try:
+            self.recover()
+        except Exception:
+            logger.error('Error recovering audit spill files', exc_info=True)
+        while True:
+            self._wake.wait(interval)
+            self._wake.clear()
+            try:
+                self.flush()
+                if self._failed:
+                    self.recover()
+            except Exception:
+                logger.error('Audit log writer error', exc_info=True)
+            finally:
+                close_old_connections()
+
+
+audit_writer = AuditLogWriter()
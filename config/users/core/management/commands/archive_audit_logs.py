@@ -0,0 +1,49 @@
+"""
+بایگانی ماهانه لاگ‌های امنیتی
+
+ماه‌های قدیمی‌تر از AUDIT_LOG_RETENTION_MONTHS در فایل NDJSON فشرده با manifest
+صحت نوشته و از جدول audit_logs حذف می‌شوند. با --verify فایل‌های بایگانی با
+manifest و ریشه‌های Merkle زنجیره مقایسه می‌شوند.
+
+نمونه:
+    python manage.py archive_audit_logs
+    python manage.py archive_audit_logs --verify
+"""
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from users.core.audit_archive import archive_expired, verify_archive
+from users.core.models import AuditLogArchive
+
+
+class Command(BaseCommand):
+    help = 'Archive audit log months older than the retention period, or verify existing archives'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true', help='Verify existing archive files instead of archiving')
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Rows fetched per cursor round trip')
+
+    def handle(self, *args, **options):
+        if options['verify']:
+            return self._verify()
+
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be positive')
+        try:
+            archives = archive_expired(chunk_size=options['chunk_size'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        for archive in archives:
+            self.stdout.write(f"{archive.month:%Y-%m}: {archive.record_count} records -> {archive.file_path}")
+        if not archives:
+            self.stdout.write('Nothing to archive')
+
+    def _verify(self):
+        discrepancies = 0
+        for archive in AuditLogArchive.objects.order_by('month'):
+            for issue in verify_archive(archive):
+                self.stdout.write(json.dumps(issue, ensure_ascii=False))
+                discrepancies += 1
+        if discrepancies:
+            raise CommandError(f"{discrepancies} audit archive discrepancies found")
@@ -0,0 +1,117 @@
+"""
+بررسی صحت زنجیره Merkle لاگ‌های امنیتی
+
+batchهای بازه (--from-sequence تا --to-sequence) به بازه‌های پشت‌سرهم تقسیم و
+بین یک process pool پخش می‌شوند؛ هر worker ریشه Merkle batchهای خود را از
+رکوردها دوباره می‌سازد و پیوند chain_hash را با batch قبلی بررسی می‌کند.
+گزارش به‌صورت NDJSON (هر خط یک مغایرت) نوشته می‌شود و خلاصه در انتها چاپ می‌شود.
+با --record فقط اثبات وجود یک رکورد (O(log n)) چاپ می‌شود.
+
+نمونه:
+    python manage.py verify_audit_chain --workers 8 --from-sequence 1000
+    python manage.py verify_audit_chain --record 123456
+"""
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Max
+
+from users.core.audit_chain import build_proof, verify_range
+from users.core.models import AuditLog, AuditLogBatch
+
+
+def _close_connections():
+    """اتصال‌های به ارث رسیده از process والد در worker قابل استفاده نیستند"""
+    connections.close_all()
+
+
+class Command(BaseCommand):
+    help = 'Verify the audit log Merkle chain or print an inclusion proof for one record'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from-sequence', type=int, default=1, help='First batch sequence to verify')
+        parser.add_argument('--to-sequence', type=int, help='Last batch sequence to verify (default: latest)')
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1,
+            help='Number of worker processes (1 runs in-process)'
+        )
+        parser.add_argument(
+            '--partition-size', type=int, default=60,
+            help='Number of batches per partition'
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=5000,
+            help='Rows fetched per cursor round trip'
+        )
+        parser.add_argument(
+            '--output', default='-',
+            help='Path of the NDJSON discrepancy report ("-" for stdout)'
+        )
+        parser.add_argument('--record', type=int, help='Print the inclusion proof of this audit log id')
+
+    def handle(self, *args, **options):
+        if options['record'] is not None:
+            return self._print_proof(options['record'])
+
+        workers = options['workers']
+        partition_size = options['partition_size']
+        chunk_size = options['chunk_size']
+        if workers < 1 or partition_size < 1 or chunk_size < 1:
+            raise CommandError('--workers, --partition-size and --chunk-size must be positive')
+
+        first = max(options['from_sequence'], 1)
+        last = options['to_sequence']
+        if last is None:
+            last = AuditLogBatch.objects.aggregate(last=Max('sequence'))['last'] or 0
+        partitions = [
+            (start, min(start + partition_size, last + 1), chunk_size)
+            for start in range(first, last + 1, partition_size)
+        ]
+
+        started = time.monotonic()
+        report = sys.stdout if options['output'] == '-' else open(options['output'], 'w', encoding='utf-8')
+        summary = {'batches': 0, 'records': 0, 'discrepancies': 0, 'by_check': {}}
+        try:
+            if workers == 1:
+                results = (verify_range(*partition) for partition in partitions)
+                self._collect(results, report, summary)
+            else:
+                _close_connections()
+                with ProcessPoolExecutor(max_workers=workers, initializer=_close_connections) as pool:
+                    results = pool.map(verify_range, *zip(*partitions)) if partitions else []
+                    self._collect(results, report, summary)
+        finally:
+            if report is not sys.stdout:
+                report.close()
+
+        summary['partitions'] = len(partitions)
+        summary['elapsed_seconds'] = round(time.monotonic() - started, 3)
+        self.stderr.write(json.dumps(summary, ensure_ascii=False))
+        if summary['discrepancies']:
+            raise CommandError(f"{summary['discrepancies']} audit chain discrepancies found")
+
+    def _collect(self, results, report, summary):
+        for batch_count, record_count, issues in results:
+            summary['batches'] += batch_count
+            summary['records'] += record_count
+            for issue in issues:
+                report.write(json.dumps(issue, ensure_ascii=False) + '\n')
+                summary['discrepancies'] += 1
+                summary['by_check'][issue['check']] = summary['by_check'].get(issue['check'], 0) + 1
+            report.flush()
+
+    def _print_proof(self, log_id):
+        try:
+            proof = build_proof(AuditLog.objects.select_related('batch').get(id=log_id))
+        except AuditLog.DoesNotExist:
+            raise CommandError(f"Audit log {log_id} not found")
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(json.dumps(proof, ensure_ascii=False, indent=2))
+        if not proof['valid']:
+            raise CommandError(f"Audit log {log_id} does not match its sealed batch")
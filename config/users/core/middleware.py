@@ -5,8 +5,9 @@ Middleware برای ثبت خودکار لاگ‌های امنیتی
 import uuid
 import logging
 from django.utils.deprecation import MiddlewareMixin
-from django.utils import timezone
 from users.core.models import AuditLog
+from users.core.audit_writer import audit_writer
+from users.core import audit_context
 
 logger = logging.getLogger(__name__)
 
@@ -29,15 +30,20 @@ class AuditLoggingMiddleware(MiddlewareMixin):
     LOGGED_METHODS = ['GET', 'POST', 'PUT', 'PATCH', 'DELETE']
     
     def process_request(self, request):
-        """افزودن request_id به request"""
+        """افزودن request_id و context لاگ به request"""
         # تولید شناسه یکتا برای هر درخواست
         request.request_id = str(uuid.uuid4())
+        # کد کسب‌وکار رویداد خود را به این context اضافه می‌کند (یک رکورد برای هر درخواست)
+        audit_context.attach(request)
         return None
     
     def process_response(self, request, response):
         """ثبت لاگ برای درخواست‌ها"""
-        # بررسی اینکه آیا نیاز به لاگ داریم
-        if not self._should_log(request, response):
+        context = audit_context.get_context(request)
+        has_event = context is not None and context.has_event
+        
+        # بررسی اینکه آیا نیاز به لاگ داریم (رویداد ثبت‌شده توسط کد کسب‌وکار همیشه ثبت می‌شود)
+        if not has_event and not self._should_log(request, response):
             return response
         
         try:
@@ -47,18 +53,34 @@ class AuditLoggingMiddleware(MiddlewareMixin):
             # تعیین نتیجه
             result = 'success' if 200 <= response.status_code < 400 else 'failed'
             
-            # ایجاد لاگ
-            AuditLog.create_log(
+            user = getattr(request, 'user', None) if hasattr(request, 'user') and request.user.is_authenticated else None
+            description = self._get_description(request, response)
+            metadata = {}
+            related_object = None
+            
+            # ادغام رویداد کسب‌وکار (شناسه تراکنش‌ها، موجودی‌ها و ...) در همین رکورد
+            if has_event:
+                event_type = context.event_type
+                description = self._get_description(request, response, context.event_description)
+                if result == 'success':
+                    result = context.result
+                user = context.user or user
+                metadata.update(context.metadata)
+                related_object = context.related_object
+            
+            metadata['status_code'] = response.status_code
+            metadata['response_size'] = 0 if response.streaming else len(response.content)
+            
+            # ایجاد لاگ و سپردن آن به بافر (درج گروهی در پس‌زمینه)
+            audit_writer.submit(AuditLog.build_log(
                 event_type=event_type,
-                event_description=self._get_description(request, response),
-                user=getattr(request, 'user', None) if hasattr(request, 'user') and request.user.is_authenticated else None,
+                event_description=description,
+                user=user,
                 request=request,
                 result=result,
-                metadata={
-                    'status_code': response.status_code,
-                    'response_size': len(response.content) if hasattr(response, 'content') else 0,
-                }
-            )
+                metadata=metadata,
+                related_object=related_object
+            ))
         except Exception as e:
             # در صورت خطا در ثبت لاگ، فقط در لاگ سیستم ثبت می‌کنیم
             logger.error(f"Error creating audit log: {str(e)}", exc_info=True)
@@ -123,12 +145,12 @@ class AuditLoggingMiddleware(MiddlewareMixin):
         # سایر
         return 'other'
     
-    def _get_description(self, request, response):
+    def _get_description(self, request, response, event_description=None):
         """تولید توضیحات برای لاگ"""
         method = request.method
         path = request.path
         
-        description = f"{method} {path}"
+        description = event_description or f"{method} {path}"
         
         if response.status_code >= 400:
             description += f" - Status: {response.status_code}"
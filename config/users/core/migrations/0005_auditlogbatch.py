@@ -0,0 +1,45 @@
+# Generated by Django 4.2 on 2026-10-16 23:03
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_auditlog_created_at_default'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuditLogBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sequence', models.PositiveBigIntegerField(unique=True, verbose_name='شماره ترتیب')),
+                ('period_start', models.DateTimeField(verbose_name='شروع بازه')),
+                ('period_end', models.DateTimeField(verbose_name='پایان بازه')),
+                ('first_log_id', models.BigIntegerField(verbose_name='شناسه اولین لاگ')),
+                ('last_log_id', models.BigIntegerField(verbose_name='شناسه آخرین لاگ')),
+                ('record_count', models.PositiveIntegerField(verbose_name='تعداد رکورد')),
+                ('merkle_root', models.CharField(max_length=64, verbose_name='ریشه Merkle')),
+                ('previous_hash', models.CharField(max_length=64, verbose_name='Hash batch قبلی')),
+                ('chain_hash', models.CharField(max_length=64, unique=True, verbose_name='Hash زنجیره')),
+                ('sealed_at', models.DateTimeField(auto_now_add=True, verbose_name='زمان مهروموم')),
+            ],
+            options={
+                'verbose_name': 'batch لاگ امنیتی',
+                'verbose_name_plural': 'batchهای لاگ امنیتی',
+                'db_table': 'audit_log_batches',
+                'ordering': ['sequence'],
+            },
+        ),
+        migrations.AddField(
+            model_name='auditlog',
+            name='batch',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='logs', to='core.auditlogbatch', verbose_name='batch'),
+        ),
+        migrations.AddIndex(
+            model_name='auditlog',
+            index=models.Index(condition=models.Q(('batch__isnull', True)), fields=['created_at'], name='audit_logs_unsealed_idx'),
+        ),
+    ]
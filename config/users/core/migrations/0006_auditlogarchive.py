@@ -0,0 +1,45 @@
+# Generated by Django 4.2 on 2026-10-16 23:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_auditlogbatch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuditLogArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(unique=True, verbose_name='ماه')),
+                ('file_path', models.CharField(max_length=500, verbose_name='مسیر فایل')),
+                ('manifest_path', models.CharField(max_length=500, verbose_name='مسیر manifest')),
+                ('sha256', models.CharField(max_length=64, verbose_name='Hash فایل')),
+                ('record_count', models.PositiveIntegerField(verbose_name='تعداد رکورد')),
+                ('first_created_at', models.DateTimeField(verbose_name='زمان اولین رکورد')),
+                ('last_created_at', models.DateTimeField(verbose_name='زمان آخرین رکورد')),
+                ('first_sequence', models.PositiveBigIntegerField(verbose_name='اولین batch')),
+                ('last_sequence', models.PositiveBigIntegerField(verbose_name='آخرین batch')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='زمان بایگانی')),
+            ],
+            options={
+                'verbose_name': 'بایگانی لاگ امنیتی',
+                'verbose_name_plural': 'بایگانی\u200cهای لاگ امنیتی',
+                'db_table': 'audit_log_archives',
+                'ordering': ['-month'],
+            },
+        ),
+        migrations.RemoveIndex(
+            model_name='auditlog',
+            name='audit_logs_request_298ea7_idx',
+        ),
+        migrations.AddField(
+            model_name='auditlogbatch',
+            name='archive',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='batches', to='core.auditlogarchive', verbose_name='بایگانی'),
+        ),
+    ]
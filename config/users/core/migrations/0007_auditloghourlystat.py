@@ -0,0 +1,50 @@
+# Generated by Django 4.2 on 2026-10-16 23:08
+
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import TruncHour
+
+
+def backfill_hourly_stats(apps, schema_editor):
+    AuditLog = apps.get_model('core', 'AuditLog')
+    AuditLogHourlyStat = apps.get_model('core', 'AuditLogHourlyStat')
+    rows = (
+        AuditLog.objects.order_by()
+        .annotate(hour=TruncHour('created_at'))
+        .values('hour', 'event_type', 'result')
+        .annotate(count=Count('id'))
+    )
+    AuditLogHourlyStat.objects.bulk_create(
+        (AuditLogHourlyStat(**row) for row in rows.iterator()), batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_auditlogarchive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuditLogHourlyStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField(verbose_name='ساعت')),
+                ('event_type', models.CharField(max_length=50, verbose_name='نوع رویداد')),
+                ('result', models.CharField(max_length=20, verbose_name='نتیجه')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='تعداد')),
+            ],
+            options={
+                'verbose_name': 'آمار ساعتی لاگ امنیتی',
+                'verbose_name_plural': 'آمار ساعتی لاگ\u200cهای امنیتی',
+                'db_table': 'audit_log_hourly_stats',
+                'ordering': ['-hour'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='auditloghourlystat',
+            constraint=models.UniqueConstraint(fields=('hour', 'event_type', 'result'), name='audit_log_hourly_stats_unique'),
+        ),
+        migrations.RunPython(backfill_hourly_stats, migrations.RunPython.noop),
+    ]
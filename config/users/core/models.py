@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import AbstractUser, UserManager
 from django.core.validators import MinLengthValidator, MaxLengthValidator
 from django.utils.translation import gettext_lazy as _
@@ -257,9 +257,22 @@ class AuditLog(models.Model):
     object_id = models.PositiveIntegerField(null=True, blank=True)
     related_object = GenericForeignKey('content_type', 'object_id')
     
+    # batch مهروموم‌شده (زنجیره Merkle)؛ تا زمان مهروموم خالی است
+    batch = models.ForeignKey(
+        'AuditLogBatch',
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        related_name='logs',
+        verbose_name=_('batch')
+    )
+    
     # زمان‌بندی
+    # زمان رویداد هنگام ساخت رکورد تعیین می‌شود (نه هنگام درج) تا رکوردهای بافرشده
+    # توسط audit_writer زمان واقعی درخواست را داشته باشند
     created_at = models.DateTimeField(
-        auto_now_add=True,
+        default=timezone.now,
+        editable=False,
         db_index=True,
         verbose_name=_('تاریخ و زمان')
     )
@@ -274,7 +287,12 @@ class AuditLog(models.Model):
             models.Index(fields=['user', '-created_at']),
             models.Index(fields=['ip_address', '-created_at']),
             models.Index(fields=['event_type', 'result']),
-            models.Index(fields=['request_id']),
+            # ایندکس request_id از db_index خود فیلد ساخته می‌شود
+            # رکوردهای هنوز مهروموم‌نشده (audit_chain.seal_batches)
+            models.Index(
+                fields=['created_at'], condition=models.Q(batch__isnull=True),
+                name='audit_logs_unsealed_idx'
+            ),
         ]
     
     def __str__(self):
@@ -285,11 +303,23 @@ class AuditLog(models.Model):
         محاسبه hash صحت قبل از ذخیره
         """
         # محاسبه hash برای تشخیص تغییرات
+        self.integrity_hash = self.compute_integrity_hash()
+        
+        if not self._state.adding:
+            super().save(*args, **kwargs)
+            return
+        
+        # شمارنده ساعتی آمار در همان تراکنش درج به‌روز می‌شود
+        from users.core.audit_stats import add_counts
+        with transaction.atomic(savepoint=False):
+            super().save(*args, **kwargs)
+            add_counts([self])
+    
+    def compute_integrity_hash(self):
+        """hash صحت رکورد (در save و در درج گروهی audit_writer استفاده می‌شود)"""
         from users.core.encryption import EncryptionService
         hash_data = f"{self.event_type}{self.user_id}{self.ip_address}{self.created_at}{self.event_description}"
-        self.integrity_hash = EncryptionService.hash_data(hash_data)
-        
-        super().save(*args, **kwargs)
+        return EncryptionService.hash_data(hash_data)
     
     @classmethod
     def create_log(cls, event_type, event_description, user=None, request=None, 
@@ -297,6 +327,19 @@ class AuditLog(models.Model):
         """
         متد کمکی برای ایجاد لاگ
         """
+        log = cls.build_log(
+            event_type, event_description, user=user, request=request,
+            result=result, metadata=metadata, related_object=related_object
+        )
+        log.save()
+        return log
+    
+    @classmethod
+    def build_log(cls, event_type, event_description, user=None, request=None,
+                  result='success', metadata=None, related_object=None):
+        """
+        ساخت رکورد لاگ بدون ذخیره (برای ثبت گروهی توسط audit_writer)
+        """
         log_data = {
             'event_type': event_type,
             'event_description': event_description,
@@ -320,8 +363,7 @@ class AuditLog(models.Model):
             log_data['content_type'] = ContentType.objects.get_for_model(related_object)
             log_data['object_id'] = related_object.pk
         
-        log = cls.objects.create(**log_data)
-        return log
+        return cls(**log_data)
     
     @staticmethod
     def _get_client_ip(request):
@@ -334,3 +376,97 @@ class AuditLog(models.Model):
         return ip
 
 
+class AuditLogBatch(models.Model):
+    """
+    batch مهروموم‌شده لاگ‌های امنیتی
+
+    ریشه Merkle رکوردهای batch همراه با hash زنجیره batch قبلی در chain_hash
+    ترکیب می‌شود؛ تغییر، حذف یا افزودن هر رکورد، ریشه batch و همه hashهای
+    زنجیره پس از آن را نامعتبر می‌کند (users.core.audit_chain).
+    """
+    sequence = models.PositiveBigIntegerField(
+        unique=True,
+        verbose_name=_('شماره ترتیب')
+    )
+    period_start = models.DateTimeField(verbose_name=_('شروع بازه'))
+    period_end = models.DateTimeField(verbose_name=_('پایان بازه'))
+    first_log_id = models.BigIntegerField(verbose_name=_('شناسه اولین لاگ'))
+    last_log_id = models.BigIntegerField(verbose_name=_('شناسه آخرین لاگ'))
+    record_count = models.PositiveIntegerField(verbose_name=_('تعداد رکورد'))
+    merkle_root = models.CharField(max_length=64, verbose_name=_('ریشه Merkle'))
+    previous_hash = models.CharField(max_length=64, verbose_name=_('Hash batch قبلی'))
+    chain_hash = models.CharField(max_length=64, unique=True, verbose_name=_('Hash زنجیره'))
+    sealed_at = models.DateTimeField(auto_now_add=True, verbose_name=_('زمان مهروموم'))
+    # پس از بایگانی، رکوردهای batch فقط در فایل بایگانی هستند
+    archive = models.ForeignKey(
+        'AuditLogArchive',
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        related_name='batches',
+        verbose_name=_('بایگانی')
+    )
+
+    class Meta:
+        db_table = 'audit_log_batches'
+        ordering = ['sequence']
+        verbose_name = _('batch لاگ امنیتی')
+        verbose_name_plural = _('batchهای لاگ امنیتی')
+
+    def __str__(self):
+        return f"#{self.sequence} ({self.record_count}) - {self.merkle_root[:12]}"
+
+
+class AuditLogArchive(models.Model):
+    """
+    بایگانی فشرده یک ماه از لاگ‌های امنیتی
+
+    رکوردها در فایل NDJSON فشرده (gzip) و اطلاعات صحت (sha256 فایل و ریشه
+    Merkle batchها) در فایل manifest کنار آن ذخیره و سپس از جدول audit_logs
+    حذف می‌شوند (users.core.audit_archive).
+    """
+    month = models.DateField(unique=True, verbose_name=_('ماه'))
+    file_path = models.CharField(max_length=500, verbose_name=_('مسیر فایل'))
+    manifest_path = models.CharField(max_length=500, verbose_name=_('مسیر manifest'))
+    sha256 = models.CharField(max_length=64, verbose_name=_('Hash فایل'))
+    record_count = models.PositiveIntegerField(verbose_name=_('تعداد رکورد'))
+    first_created_at = models.DateTimeField(verbose_name=_('زمان اولین رکورد'))
+    last_created_at = models.DateTimeField(verbose_name=_('زمان آخرین رکورد'))
+    first_sequence = models.PositiveBigIntegerField(verbose_name=_('اولین batch'))
+    last_sequence = models.PositiveBigIntegerField(verbose_name=_('آخرین batch'))
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name=_('زمان بایگانی'))
+
+    class Meta:
+        db_table = 'audit_log_archives'
+        ordering = ['-month']
+        verbose_name = _('بایگانی لاگ امنیتی')
+        verbose_name_plural = _('بایگانی‌های لاگ امنیتی')
+
+    def __str__(self):
+        return f"{self.month:%Y-%m} ({self.record_count})"
+
+
+class AuditLogHourlyStat(models.Model):
+    """
+    شمارنده ساعتی لاگ‌های امنیتی بر اساس نوع رویداد و نتیجه
+
+    هنگام درج لاگ‌ها (save و درج گروهی audit_writer) به‌صورت افزایشی به‌روز
+    می‌شود و endpoint آمار را بدون اسکن جدول audit_logs پاسخ می‌دهد. با بایگانی
+    لاگ‌ها شمارنده‌ها کم نمی‌شوند.
+    """
+    hour = models.DateTimeField(verbose_name=_('ساعت'))
+    event_type = models.CharField(max_length=50, verbose_name=_('نوع رویداد'))
+    result = models.CharField(max_length=20, verbose_name=_('نتیجه'))
+    count = models.PositiveIntegerField(default=0, verbose_name=_('تعداد'))
+
+    class Meta:
+        db_table = 'audit_log_hourly_stats'
+        ordering = ['-hour']
+        verbose_name = _('آمار ساعتی لاگ امنیتی')
+        verbose_name_plural = _('آمار ساعتی لاگ‌های امنیتی')
+        constraints = [
+            models.UniqueConstraint(fields=['hour', 'event_type', 'result'], name='audit_log_hourly_stats_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.hour:%Y-%m-%d %H}:00 {self.event_type}/{self.result}: {self.count}"
@@ -0,0 +1,65 @@
+"""
+صفحه‌بندی keyset (cursor) بر اساس (created_at, id)
+
+به‌جای OFFSET و COUNT(*) در هر درخواست، هر صفحه با شرط «قدیمی‌تر از آخرین
+رکورد صفحه قبل» از روی ایندکس‌های (... , -created_at) خوانده می‌شود، بنابراین
+هزینه صفحه‌های عمیق با صفحه اول برابر است. cursor یک رشته base64 مبهم است و
+تعداد کل فقط با include_count=true محاسبه می‌شود.
+"""
+import base64
+import json
+
+from django.utils.dateparse import parse_datetime
+
+MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(created_at, pk):
+    payload = json.dumps({'t': created_at.isoformat(), 'id': pk}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """خروجی: (created_at, id)؛ برای cursor نامعتبر ValueError"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        created_at = parse_datetime(payload['t'])
+        pk = int(payload['id'])
+    except (ValueError, KeyError, TypeError):
+        raise ValueError("Invalid cursor")
+    if created_at is None:
+        raise ValueError("Invalid cursor")
+    return created_at, pk
+
+
+def get_page_size(request, default=20):
+    return max(1, min(int(request.query_params.get('page_size', default)), MAX_PAGE_SIZE))
+
+
+def wants_count(request):
+    return request.query_params.get('include_count', '').lower() in ('1', 'true')
+
+
+def keyset_page(queryset, cursor=None, page_size=20, include_count=False):
+    """
+    یک صفحه به ترتیب نزولی (created_at, id)
+
+    خروجی: دیکشنری results (لیست اشیا)، next (cursor صفحه بعد یا None) و
+    count (فقط با include_count، در غیر این صورت None)
+    """
+    count = queryset.count() if include_count else None
+    queryset = queryset.order_by('-created_at', '-id')
+    if cursor:
+        created_at, pk = decode_cursor(cursor)
+        # شرط created_at <= t بازه اسکن ایندکس را محدود می‌کند
+        queryset = queryset.filter(created_at__lte=created_at).exclude(created_at=created_at, id__gte=pk)
+
+    rows = list(queryset[:page_size + 1])
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    return {
+        'count': count,
+        'next': encode_cursor(rows[-1].created_at, rows[-1].pk) if has_more else None,
+        'results': rows,
+    }
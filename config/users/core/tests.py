@@ -1,3 +1,367 @@
-from django.test import TestCase
+import csv
+import gzip
+import io
+import json
+import os
+import socket
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from unittest.mock import patch
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from users.core import audit_archive, audit_chain, audit_stats
+from users.core.audit_writer import AuditLogWriter, serialize_log
+from users.core.models import AuditLog, AuditLogArchive, AuditLogBatch, AuditLogHourlyStat, User
+from wallet.models import Wallet
+from wallet.utils import charge_wallet
+
+
+class AuditLogWriterTest(TestCase):
+    """تست بافر غیرهم‌زمان لاگ امنیتی"""
+
+    def setUp(self):
+        spill_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(spill_dir.cleanup)
+        self.spill_dir = spill_dir.name
+        settings_override = override_settings(
+            AUDIT_LOG_ASYNC=True, AUDIT_LOG_SPILL_DIR=self.spill_dir, AUDIT_LOG_BATCH_SIZE=100
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        # thread پس‌زمینه در تست اجرا نمی‌شود؛ flush و recover مستقیم صدا زده می‌شوند
+        thread_patch = patch('users.core.audit_writer.threading.Thread')
+        thread_patch.start()
+        self.addCleanup(thread_patch.stop)
+        self.writer = AuditLogWriter()
+
+    def test_submit_buffers_and_flush_writes_batch(self):
+        for index in range(3):
+            self.writer.submit(AuditLog.build_log('other', f'GET /api/test/{index}/'))
+        self.assertFalse(AuditLog.objects.exists())
+        self.assertEqual(len(os.listdir(self.spill_dir)), 1)
+
+        self.assertEqual(self.writer.flush(), 3)
+        self.assertEqual(AuditLog.objects.count(), 3)
+        self.assertEqual(AuditLogHourlyStat.objects.get().count, 3)
+        log = AuditLog.objects.first()
+        self.assertEqual(log.integrity_hash, log.compute_integrity_hash())
+        # فایل spill قبلی حذف و فقط فایل خالی جدید باقی می‌ماند
+        self.assertEqual(len(os.listdir(self.spill_dir)), 1)
+
+    def test_recover_spill_file_of_dead_process(self):
+        records = [serialize_log(AuditLog.build_log('other', 'GET /api/crashed/'))]
+        path = os.path.join(self.spill_dir, 'audit-999999999-1.ndjson')
+        for _ in range(2):
+            with open(path, 'w', encoding='utf-8') as spill:
+                spill.write(json.dumps(records[0], default=str) + '\n')
+                spill.write('{"truncated')
+            self.writer.recover()
+        self.assertEqual(AuditLog.objects.filter(event_description='GET /api/crashed/').count(), 1)
+        self.assertEqual(os.listdir(self.spill_dir), [])
+
+    def test_live_writer_spill_is_not_claimed(self):
+        self.writer.submit(AuditLog.build_log('other', 'GET /api/live/'))
+        other = AuditLogWriter()
+        # pid یکسان است؛ قفل فایل (نه pid) زنده بودن صاحب آن را نشان می‌دهد
+        self.assertEqual(other.recover(), 0)
+        self.assertFalse(AuditLog.objects.exists())
+        name, = os.listdir(self.spill_dir)
+        self.assertTrue(name.startswith(f'audit-{socket.gethostname()}-{os.getpid()}-'))
+
+        self.assertEqual(self.writer.flush(), 1)
+        self.assertEqual(other.recover(), 0)
+        self.assertEqual(AuditLog.objects.count(), 1)
+
+    def test_failed_batch_is_kept_and_retried(self):
+        self.writer.submit(AuditLog.build_log('other', 'GET /api/retry/'))
+        with patch('users.core.audit_writer.write_records', side_effect=RuntimeError('db down')):
+            self.assertEqual(self.writer.flush(), 0)
+        self.assertEqual(len(os.listdir(self.spill_dir)), 2)
+        self.assertEqual(AuditLogWriter().recover(), 0)
+
+        self.assertEqual(self.writer.recover(), 1)
+        self.assertEqual(AuditLog.objects.filter(event_description='GET /api/retry/').count(), 1)
+        self.assertEqual(len(os.listdir(self.spill_dir)), 1)
+
+
+class AuditContextTest(TestCase):
+    """تست ادغام رویداد کسب‌وکار در رکورد لاگ درخواست"""
+
+    def setUp(self):
+        cache.clear()
+        self.sender = User.objects.create_user(phone='+989123456789', password='testpass123')
+        self.recipient = User.objects.create_user(phone='+989123456780', password='testpass123')
+        Wallet.objects.filter(id=self.sender.wallet.id).update(balance=Decimal('100000'))
+        self.client = APIClient()
+        self.client.force_authenticate(self.sender)
+
+    def test_transfer_request_writes_single_enriched_record(self):
+        response = self.client.post('/api/wallet/transfer/', {
+            'method': 'phone', 'recipient_phone': '+989123456780', 'amount': '30000'
+        }, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        log = AuditLog.objects.get()
+        self.assertEqual(log.event_type, 'transaction_create')
+        self.assertEqual(log.request_path, '/api/wallet/transfer/')
+        self.assertEqual(log.metadata['sender_transaction_id'], response.data['transaction_id'])
+        self.assertEqual(log.metadata['sender_balance_after'], '70000.00')
+        self.assertEqual(log.metadata['status_code'], 200)
+        self.assertEqual(log.object_id, self.sender.wallet.transactions.get().pk)
+
+    def test_failed_request_keeps_generic_record(self):
+        response = self.client.post('/api/wallet/debit/', {'amount': '500000'}, format='json')
+
+        self.assertEqual(response.status_code, 400)
+        log = AuditLog.objects.get()
+        self.assertEqual(log.result, 'failed')
+        self.assertNotIn('transaction_id', log.metadata)
+
+    def test_without_request_context_writes_directly(self):
+        class Request:
+            META = {'REMOTE_ADDR': '127.0.0.1'}
+            method = 'POST'
+            path = '/internal/charge/'
+
+        transaction = charge_wallet(self.sender.wallet, Decimal('1000'), request=Request())
+
+        log = AuditLog.objects.get()
+        self.assertEqual(log.metadata['transaction_id'], transaction.transaction_id)
+
+
+class AuditChainTest(TestCase):
+    """تست زنجیره Merkle لاگ‌های امنیتی"""
+
+    def setUp(self):
+        now = timezone.now().replace(second=30)
+        for minutes_ago, count in ((3, 3), (2, 5)):
+            for index in range(count):
+                log = AuditLog.build_log('other', f'GET /api/test/{minutes_ago}/{index}/', metadata={'index': index})
+                log.created_at = now - timedelta(minutes=minutes_ago)
+                log.save()
+        # رکورد دقیقه جاری هنوز مهروموم نمی‌شود
+        AuditLog.create_log('other', 'GET /api/test/now/')
+        self.assertEqual(audit_chain.seal_batches(now=now), 2)
+
+    def test_batches_are_chained(self):
+        first, second = AuditLogBatch.objects.order_by('sequence')
+        self.assertEqual((first.record_count, second.record_count), (3, 5))
+        self.assertEqual(first.previous_hash, audit_chain.GENESIS_HASH)
+        self.assertEqual(second.previous_hash, first.chain_hash)
+        self.assertEqual(AuditLog.objects.filter(batch__isnull=True).count(), 1)
+        self.assertEqual(audit_chain.verify_range(1, 3), (2, 8, []))
+
+    def test_concurrent_seal_does_not_fork_chain(self):
+        now = timezone.now().replace(second=30)
+        AuditLog.objects.filter(batch__isnull=True).update(created_at=now - timedelta(minutes=1))
+        real_create = AuditLogBatch.objects.create
+
+        def stale_create(**fields):
+            # مهروموم هم‌زمانی که batch قبلی را پیش از commit دیگری خوانده است
+            if stale_create.calls == 0:
+                fields['sequence'] -= 1
+            stale_create.calls += 1
+            return real_create(**fields)
+        stale_create.calls = 0
+
+        with patch.object(AuditLogBatch.objects, 'create', side_effect=stale_create):
+            self.assertEqual(audit_chain.seal_batches(now=now + timedelta(minutes=1)), 1)
+        third = AuditLogBatch.objects.get(sequence=3)
+        self.assertEqual(third.previous_hash, AuditLogBatch.objects.get(sequence=2).chain_hash)
+        self.assertEqual(audit_chain.verify_range(1, 4)[2], [])
+
+    def test_inclusion_proof(self):
+        log = AuditLog.objects.filter(batch__sequence=2).order_by('id')[2]
+        proof = audit_chain.build_proof(log)
+        self.assertTrue(proof['valid'])
+        self.assertLessEqual(len(proof['proof']), 3)
+        self.assertTrue(audit_chain.verify_proof(proof['leaf_hash'], proof['proof'], proof['batch']['merkle_root']))
+
+        AuditLog.objects.filter(id=log.id).update(event_description='GET /api/forged/')
+        self.assertFalse(audit_chain.build_proof(log)['valid'])
+
+    def test_tampering_is_detected(self):
+        logs = AuditLog.objects.filter(batch__sequence=2).order_by('id')
+        AuditLog.objects.filter(id=logs[0].id).update(metadata={'index': 99})
+        AuditLog.objects.filter(id=logs[1].id).delete()
+        AuditLogBatch.objects.filter(sequence=1).update(merkle_root='f' * 64)
+
+        _, _, issues = audit_chain.verify_range(1, 3)
+        self.assertEqual(
+            sorted(issue['check'] for issue in issues),
+            ['chain_broken', 'count_mismatch', 'root_mismatch']
+        )
+        with self.assertRaises(CommandError):
+            call_command('verify_audit_chain', workers=1, output=os.devnull, stderr=io.StringIO())
+
+    def test_proof_and_verify_endpoints(self):
+        admin = User.objects.create_superuser(phone='+989120000000', password='testpass123')
+        client = APIClient()
+        client.force_authenticate(admin)
+        log = AuditLog.objects.filter(batch__isnull=False).first()
+
+        response = client.get(f'/api/management/core/audit-logs/{log.id}/proof/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['valid'])
+
+        response = client.get('/api/management/core/audit-logs/verify-chain/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['batches'], response.data['valid']), (2, True))
+
+
+class AuditArchiveTest(TestCase):
+    """تست بایگانی ماهانه لاگ‌های امنیتی"""
+
+    def setUp(self):
+        archive_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(archive_dir.cleanup)
+        settings_override = override_settings(AUDIT_LOG_ARCHIVE_DIR=archive_dir.name, AUDIT_LOG_RETENTION_MONTHS=6)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.now = timezone.now()
+        for days_ago, count in ((250, 2), (215, 3), (10, 4)):
+            for index in range(count):
+                log = AuditLog.build_log('other', f'GET /api/test/{days_ago}/{index}/', result='failed')
+                log.created_at = self.now - timedelta(days=days_ago, minutes=index)
+                log.save()
+
+    def test_expired_months_are_archived_and_dropped(self):
+        archives = audit_archive.archive_expired(now=self.now)
+
+        self.assertEqual([archive.record_count for archive in archives], [2, 3])
+        self.assertEqual(AuditLog.objects.count(), 4)
+        for archive in archives:
+            self.assertTrue(os.path.exists(archive.manifest_path))
+            self.assertEqual(audit_archive.verify_archive(archive), [])
+        last = AuditLogBatch.objects.order_by('-sequence').first().sequence
+        self.assertEqual(audit_chain.verify_range(1, last + 1)[2], [])
+        # اجرای دوباره چیزی بایگانی نمی‌کند
+        self.assertEqual(audit_archive.archive_expired(now=self.now), [])
+
+    def test_tampered_archive_is_detected(self):
+        archive = audit_archive.archive_expired(now=self.now)[0]
+        with open(archive.file_path, 'ab') as archive_file:
+            archive_file.write(b'\x00')
+        checks = [issue['check'] for issue in audit_archive.verify_archive(archive)]
+        self.assertEqual(checks[0], 'archive_hash_mismatch')
+
+    def test_list_reads_archive_for_old_ranges(self):
+        audit_archive.archive_expired(now=self.now)
+        admin = User.objects.create_superuser(phone='+989120000000', password='testpass123')
+        client = APIClient()
+        client.force_authenticate(admin)
+        start_date = (self.now - timedelta(days=300)).isoformat()
+
+        response = client.get('/api/management/core/audit-logs/', {
+            'start_date': start_date, 'result': 'failed', 'page_size': 3, 'page': 2
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['count'], response.data['archived_count']), (9, 5))
+        descriptions = [item['event_description'] for item in response.data['results']]
+        self.assertEqual(descriptions, ['GET /api/test/10/3/', 'GET /api/test/215/0/', 'GET /api/test/215/1/'])
+
+        response = client.get('/api/management/core/audit-logs/', {'result': 'failed', 'include_count': 'true'})
+        self.assertEqual(response.data['count'], 4)
+
+
+class AuditStatisticsTest(TestCase):
+    """تست آمار لاگ‌ها از شمارنده‌های ساعتی"""
+
+    def setUp(self):
+        now = timezone.now()
+        events = [
+            (timedelta(hours=2), 'auth_failed', 'failed'),
+            (timedelta(hours=2), 'auth_failed', 'failed'),
+            (timedelta(hours=5), 'transaction_create', 'success'),
+            (timedelta(hours=23, minutes=59), 'access_denied', 'failed'),
+            (timedelta(days=3), 'other', 'success'),
+        ]
+        for age, event_type, result in events:
+            log = AuditLog.build_log(event_type, 'event', result=result)
+            log.created_at = now - age
+            log.save()
+        self.admin = User.objects.create_superuser(phone='+989120000000', password='testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def test_counts_match_table(self):
+        start = timezone.now() - timedelta(days=1)
+        self.assertEqual(
+            audit_stats.count_by_type_and_result(start),
+            audit_stats.count_queryset(AuditLog.objects.filter(created_at__gte=start))
+        )
+
+    def test_statistics_endpoint(self):
+        response = self.client.get('/api/management/core/audit-logs/statistics/', {'days': 1})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['total_count'], 4)
+        self.assertEqual(response.data['failed_count'], 3)
+        self.assertEqual(response.data['security_events'], 3)
+        self.assertEqual(response.data['event_type_stats'], {'auth_failed': 2, 'transaction_create': 1, 'access_denied': 1})
+
+        # رکورد لاگ درخواست قبلی هم شمرده می‌شود
+        response = self.client.get('/api/management/core/audit-logs/statistics/', {'days': 7, 'result': 'success'})
+        self.assertEqual(response.data['total_count'], 3)
+
+    def test_list_cursor_pagination(self):
+        expected = list(AuditLog.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+        ids = []
+        params = {'page_size': 2}
+        while True:
+            response = self.client.get('/api/management/core/audit-logs/', params)
+            self.assertEqual(response.status_code, 200)
+            self.assertIsNone(response.data['count'])
+            ids += [item['id'] for item in response.data['results']]
+            if response.data['next'] is None:
+                break
+            params['cursor'] = response.data['next']
+        # رکوردهای لاگ همین درخواست‌ها بعد از شروع پیمایش ثبت می‌شوند
+        self.assertEqual(ids, expected)
+
+
+class AuditExportTest(TestCase):
+    """تست خروجی جریانی لاگ‌ها"""
+
+    def setUp(self):
+        for index in range(5):
+            AuditLog.create_log('auth_failed' if index % 2 else 'other', f'event {index}', metadata={'index': index})
+        admin = User.objects.create_superuser(phone='+989120000000', password='testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(admin)
+
+    def _export(self, **params):
+        response = self.client.get('/api/management/core/audit-logs/export/', params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content)
+
+    def test_ndjson_export_with_filter(self):
+        _, content = self._export(event_type='auth_failed')
+        records = [json.loads(line) for line in content.decode().splitlines()]
+        self.assertEqual([record['metadata']['index'] for record in records], [1, 3])
+
+    def test_gzipped_csv_export(self):
+        response, content = self._export(event_type='other', export_format='csv', compress='gzip')
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        rows = list(csv.DictReader(io.StringIO(gzip.decompress(content).decode())))
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(json.loads(rows[0]['metadata']), {'index': 0})
+
+    def test_export_is_logged(self):
+        self._export(event_type='other')
+        log = AuditLog.objects.get(event_type='data_export')
+        self.assertEqual(log.metadata['export_format'], 'ndjson')
+        self.assertEqual(log.metadata['filters'], {'event_type': 'other'})
+
+    def test_unsupported_format(self):
+        response = self.client.get('/api/management/core/audit-logs/export/', {'export_format': 'xml'})
+        self.assertEqual(response.status_code, 400)
@@ -1,14 +1,40 @@
 from django.contrib import admin
-from .models import Wallet, Transaction, WalletLimit, PaymentRequest
+from . import ledger
+from .models import (
+    Wallet, Transaction, WalletLimit, PaymentRequest, WalletBalanceShard, BalanceCheckpoint,
+    WalletDailyStat
+)
+
+
+DEFAULT_SHARD_COUNT = 8
 
 
 @admin.register(Wallet)
 class WalletAdmin(admin.ModelAdmin):
-    list_display = ['id', 'user', 'balance', 'currency', 'status', 'created_at']
+    list_display = ['id', 'user', 'balance', 'shard_count', 'currency', 'status', 'created_at']
     list_filter = ['status', 'currency', 'created_at']
     search_fields = ['user__phone', 'user__fullname']
-    readonly_fields = ['created_at', 'updated_at']
+    readonly_fields = ['shard_count', 'created_at', 'updated_at']
     ordering = ['-created_at']
+    actions = ['enable_balance_shards', 'disable_balance_shards']
+
+    @admin.action(description='فعال‌سازی شاردینگ موجودی ورودی (%d شارد)' % DEFAULT_SHARD_COUNT)
+    def enable_balance_shards(self, request, queryset):
+        for wallet in queryset:
+            ledger.set_shard_count(wallet, DEFAULT_SHARD_COUNT)
+
+    @admin.action(description='غیرفعال‌سازی شاردینگ و ادغام شاردها')
+    def disable_balance_shards(self, request, queryset):
+        for wallet in queryset:
+            ledger.set_shard_count(wallet, 0)
+
+
+@admin.register(WalletBalanceShard)
+class WalletBalanceShardAdmin(admin.ModelAdmin):
+    list_display = ['wallet', 'shard_index', 'balance', 'updated_at']
+    search_fields = ['wallet__user__phone']
+    readonly_fields = ['wallet', 'shard_index', 'balance', 'updated_at']
+    ordering = ['wallet', 'shard_index']
 
 
 @admin.register(Transaction)
@@ -35,6 +61,24 @@ class WalletLimitAdmin(admin.ModelAdmin):
     ordering = ['-date', '-total_transfer_amount']
 
 
+@admin.register(BalanceCheckpoint)
+class BalanceCheckpointAdmin(admin.ModelAdmin):
+    list_display = ['wallet', 'as_of', 'balance', 'last_transaction_id']
+    search_fields = ['wallet__user__phone']
+    readonly_fields = ['wallet', 'as_of', 'balance', 'last_transaction_id', 'created_at']
+    ordering = ['-as_of']
+    date_hierarchy = 'as_of'
+
+
+@admin.register(WalletDailyStat)
+class WalletDailyStatAdmin(admin.ModelAdmin):
+    list_display = ['wallet', 'day', 'type', 'transfer_method', 'count', 'amount']
+    list_filter = ['type', 'transfer_method']
+    search_fields = ['wallet__user__phone']
+    readonly_fields = ['wallet', 'day', 'type', 'transfer_method', 'count', 'amount']
+    ordering = ['-day']
+
+
 @admin.register(PaymentRequest)
 class PaymentRequestAdmin(admin.ModelAdmin):
     list_display = [
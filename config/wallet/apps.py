@@ -6,4 +6,5 @@ class WalletConfig(AppConfig):
     name = 'wallet'
     verbose_name = 'Wallet Service'
 
-
+    def ready(self):
+        from . import signals  # noqa: F401
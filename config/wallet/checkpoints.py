@@ -0,0 +1,138 @@
+"""
+سرویس checkpoint موجودی و محاسبه موجودی در یک لحظه دلخواه
+
+به‌صورت دوره‌ای (تسک create_balance_checkpoints_task) برای کیف پول‌هایی که
+تراکنش جدید دارند یک ردیف balance_checkpoints ثبت می‌شود. برای محاسبه موجودی
+در زمان ts فقط نزدیک‌ترین checkpoint قبل از ts خوانده می‌شود و مجموع علامت‌دار
+تراکنش‌های پس از آن (دنباله) روی آن اعمال می‌شود؛ نیازی به پیمایش کل تاریخچه نیست.
+
+محاسبه از روی مبلغ تراکنش‌ها انجام می‌شود نه balance_after، بنابراین پس از
+اصلاح یک باگ می‌توان checkpointها را حذف و دوباره ساخت.
+
+هر checkpoint همه تراکنش‌های تکمیل‌شده با created_at <= as_of را پوشش می‌دهد و
+دنباله آن تراکنش‌های با created_at > as_of است. id ملاک نیست چون شناسه‌ها از قبل
+رزرو می‌شوند (Transaction.reserve_ids) و ترتیب commit را نشان نمی‌دهند. as_of
+پیش‌فرض BALANCE_CHECKPOINT_SAFETY_LAG ثانیه عقب‌تر از اکنون است تا تراکنشی که
+created_at آن قبل از as_of است ولی هنوز commit نشده از checkpoint جا نماند.
+"""
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import models
+from django.db.models import Case, F, OuterRef, Q, Subquery, Sum, Value, When
+from django.utils import timezone
+
+from .models import BalanceCheckpoint, Transaction, Wallet
+
+
+CREDIT_TYPES = ('charge', 'transfer_in', 'refund')
+DEBIT_TYPES = ('debit', 'transfer_out')
+
+CHECKPOINT_BATCH_SIZE = 500
+
+_AMOUNT_FIELD = models.DecimalField(max_digits=15, decimal_places=2)
+
+
+def signed_amount():
+    """عبارت مبلغ علامت‌دار تراکنش (واریز مثبت، برداشت منفی)"""
+    return Case(
+        When(type__in=CREDIT_TYPES, then=F('amount')),
+        When(type__in=DEBIT_TYPES, then=-F('amount')),
+        default=Value(Decimal('0')),
+        output_field=_AMOUNT_FIELD,
+    )
+
+
+def get_checkpoint(wallet, ts):
+    """نزدیک‌ترین checkpoint کیف پول در زمان ts یا قبل از آن"""
+    return (
+        BalanceCheckpoint.objects.filter(wallet=wallet, as_of__lte=ts)
+        .order_by('-as_of', '-id')
+        .first()
+    )
+
+
+def balance_at(wallet, ts):
+    """
+    موجودی کیف پول در لحظه ts
+
+    خروجی: (موجودی، checkpoint استفاده‌شده یا None)
+    """
+    checkpoint = get_checkpoint(wallet, ts)
+    base = checkpoint.balance if checkpoint else Decimal('0')
+
+    tail = Transaction.objects.filter(wallet=wallet, status='completed', created_at__lte=ts)
+    if checkpoint:
+        tail = tail.filter(created_at__gt=checkpoint.as_of)
+    delta = tail.aggregate(delta=Sum(signed_amount()))['delta']
+    return base + (delta or Decimal('0')), checkpoint
+
+
+def create_checkpoints(as_of=None, batch_size=CHECKPOINT_BATCH_SIZE):
+    """
+    ثبت checkpoint برای کیف پول‌هایی که از آخرین checkpoint تراکنش جدید دارند
+
+    برای هر دسته از کیف پول‌ها یک کوئری گروه‌بندی‌شده مجموع دنباله را محاسبه
+    می‌کند و checkpointهای جدید با bulk_create ثبت می‌شوند.
+    as_of پیش‌فرض: اکنون منهای BALANCE_CHECKPOINT_SAFETY_LAG
+    خروجی: تعداد checkpointهای ثبت‌شده
+    """
+    as_of = as_of or timezone.now() - timedelta(seconds=settings.BALANCE_CHECKPOINT_SAFETY_LAG)
+    latest = BalanceCheckpoint.objects.filter(wallet_id=OuterRef('wallet_id')).order_by('-as_of', '-id')
+
+    wallet_ids = Wallet.objects.order_by('id').values_list('id', flat=True).iterator(chunk_size=batch_size)
+    created = 0
+    batch = []
+    for wallet_id in wallet_ids:
+        batch.append(wallet_id)
+        if len(batch) >= batch_size:
+            created += _create_batch(batch, as_of, latest)
+            batch = []
+    if batch:
+        created += _create_batch(batch, as_of, latest)
+    return created
+
+
+def _create_batch(wallet_ids, as_of, latest):
+    tails = (
+        Transaction.objects.filter(wallet_id__in=wallet_ids, status='completed', created_at__lte=as_of)
+        .annotate(checkpoint_as_of=Subquery(latest.values('as_of')[:1]))
+        .filter(Q(checkpoint_as_of__isnull=True) | Q(created_at__gt=F('checkpoint_as_of')))
+        .order_by()
+        .values('wallet_id')
+        .annotate(delta=Sum(signed_amount()))
+    )
+    tails = {row['wallet_id']: row['delta'] for row in tails}
+    if not tails:
+        return 0
+
+    # موجودی checkpoint قبلی و آخرین تراکنش پوشش‌داده‌شده به ترتیب (created_at, id)
+    previous = (
+        Wallet.objects.filter(id__in=list(tails))
+        .annotate(
+            checkpoint_balance=Subquery(
+                BalanceCheckpoint.objects.filter(wallet_id=OuterRef('id'))
+                .order_by('-as_of', '-id')
+                .values('balance')[:1]
+            ),
+            last_transaction_id=Subquery(
+                Transaction.objects.filter(wallet_id=OuterRef('id'), status='completed', created_at__lte=as_of)
+                .order_by('-created_at', '-id')
+                .values('id')[:1]
+            ),
+        )
+        .values_list('id', 'checkpoint_balance', 'last_transaction_id')
+    )
+
+    checkpoints = [
+        BalanceCheckpoint(
+            wallet_id=wallet_id,
+            as_of=as_of,
+            balance=(checkpoint_balance or Decimal('0')) + tails[wallet_id],
+            last_transaction_id=last_transaction_id,
+        )
+        for wallet_id, checkpoint_balance, last_transaction_id in previous
+    ]
+    BalanceCheckpoint.objects.bulk_create(checkpoints)
+    return len(checkpoints)
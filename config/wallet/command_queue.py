@@ -0,0 +1,336 @@
+"""
+حالت اجرای صف‌محور (actor) برای شارژ، برداشت و انتقال
+
+با WALLET_COMMAND_MODE='queue' هر فرمان به صف Celery پارتیشن کیف پول
+(wallet_id % WALLET_COMMAND_PARTITIONS) فرستاده می‌شود. هر صف توسط یک worker با
+concurrency=1 مصرف می‌شود، بنابراین فرمان‌های یک کیف پول به ترتیب و بدون رقابت
+روی قفل اجرا می‌شوند و API تا WALLET_COMMAND_TIMEOUT ثانیه منتظر نتیجه می‌ماند.
+انتقال در پارتیشن کیف پول فرستنده اجرا می‌شود (طرف واریز با UPDATE اتمی و
+بدون نیاز به ترتیب اعمال می‌شود). برای افزایش ظرفیت، پارتیشن‌ها بین workerهای
+بیشتری تقسیم می‌شوند.
+
+هر فرمان یک command_id دارد که همراه تراکنش‌هایش در جدول wallet_commands ثبت
+می‌شود؛ تحویل دوباره پیام (acks_late/reject_on_worker_lost) یا تکرار درخواست با
+همان Idempotency-Key پول را دوباره جابه‌جا نمی‌کند. فرمانی که در مهلت پاسخ
+نگیرد revoke می‌شود (و با expires پس از مهلت اجرا نمی‌شود) و API به‌جای خطای
+قطعی 202 با command_id برمی‌گرداند.
+
+در حالت پیش‌فرض ('direct') توابع همان توابع wallet.utils را مستقیم صدا می‌زنند.
+"""
+import hashlib
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import IntegrityError, transaction as db_transaction
+from django.utils import timezone
+
+from users.core import audit_context
+
+from . import utils
+from .idempotency import IDEMPOTENCY_HEADER, IDEMPOTENCY_KEY_TTL
+from .models import PaymentLink, Transaction, Wallet, WalletCommand, WalletQRCode
+
+
+class WalletCommandPending(Exception):
+    """فرمان در مهلت WALLET_COMMAND_TIMEOUT نتیجه نداد و وضعیت نهایی آن نامعلوم است"""
+
+    def __init__(self, command_id):
+        super().__init__("Wallet command is still being processed")
+        self.command_id = command_id
+
+
+def is_enabled():
+    """آیا حالت صف‌محور فعال است"""
+    return getattr(settings, 'WALLET_COMMAND_MODE', 'direct') == 'queue'
+
+
+def get_partition(wallet_id):
+    """شماره پارتیشن کیف پول"""
+    return wallet_id % settings.WALLET_COMMAND_PARTITIONS
+
+
+def get_queue_name(wallet_id):
+    """نام صف Celery پارتیشن کیف پول"""
+    return f"wallet_commands_{get_partition(wallet_id)}"
+
+
+class RequestContext:
+    """
+    اطلاعات لازم از request برای ثبت IP، user_agent و لاگ امنیتی در worker
+    (خود شیء request قابل ارسال به صف نیست)
+    """
+
+    def __init__(self, meta=None, method='', path='', request_id=None, audit=False):
+        self.META = meta or {}
+        self.method = method
+        self.path = path
+        self.request_id = request_id
+        if audit:
+            # رویداد به درخواست اصلی برگردانده و در رکورد middleware ادغام می‌شود
+            audit_context.attach(self)
+
+    @classmethod
+    def from_request(cls, request):
+        if request is None:
+            return None
+        meta_keys = ('HTTP_X_FORWARDED_FOR', 'REMOTE_ADDR', 'HTTP_USER_AGENT')
+        return {
+            'meta': {key: request.META[key] for key in meta_keys if key in request.META},
+            'method': request.method,
+            'path': request.path,
+            'request_id': getattr(request, 'request_id', None),
+            'audit': audit_context.get_context(request) is not None,
+        }
+
+    @classmethod
+    def from_payload(cls, payload):
+        if payload is None:
+            return None
+        return cls(**payload)
+
+
+def get_command_id(request=None, reference=None):
+    """
+    شناسه فرمان
+
+    با هدر Idempotency-Key (یا reference، مثلاً شناسه درخواست پرداخت) شناسه
+    قطعی است تا تکرار درخواست پس از timeout همان فرمان قبلی را پیدا کند.
+    """
+    key = getattr(request, 'headers', {}).get(IDEMPOTENCY_HEADER)
+    if key:
+        raw = f"idem:{request.user.id}:{key}"
+    elif reference:
+        raw = f"ref:{reference}"
+    else:
+        return uuid.uuid4().hex
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def _processed_outcome(command_id):
+    """نتیجه فرمانی که قبلاً اجرا شده یا None"""
+    if not command_id:
+        return None
+    transaction_ids = WalletCommand.objects.filter(command_id=command_id).values_list(
+        'transaction_ids', flat=True
+    ).first()
+    if transaction_ids is None:
+        return None
+    return {'ok': True, 'transaction_ids': transaction_ids, 'replayed': True}
+
+
+def apply_command(command, payload):
+    """
+    اجرای یک فرمان در worker
+
+    فرمانی که command_id آن قبلاً ثبت شده دوباره اجرا نمی‌شود.
+
+    خروجی قابل serialize به JSON: شناسه تراکنش‌ها (و رویداد لاگ امنیتی) یا
+    پیام خطای کسب‌وکار
+    """
+    request = RequestContext.from_payload(payload.get('request'))
+    amount = Decimal(payload['amount'])
+    command_id = payload.get('command_id')
+    try:
+        with db_transaction.atomic():
+            processed = _processed_outcome(command_id)
+            if processed is not None:
+                return processed
+            outcome = _run_command(command, payload, request, amount)
+            if outcome['ok'] and command_id:
+                WalletCommand.objects.create(
+                    command_id=command_id, command=command, transaction_ids=outcome['transaction_ids']
+                )
+    except IntegrityError:
+        # همان فرمان هم‌زمان در worker دیگری ثبت شد؛ تراکنش‌های این اجرا برگشت خوردند
+        processed = _processed_outcome(command_id)
+        if processed is None:
+            raise
+        return processed
+    context = audit_context.get_context(request)
+    if outcome['ok'] and context is not None:
+        outcome['audit'] = context.to_payload()
+    return outcome
+
+
+def _run_command(command, payload, request, amount):
+    """فراخوانی تابع wallet.utils متناظر با فرمان"""
+    try:
+        if command == 'charge':
+            wallet = Wallet.objects.select_related('user').get(id=payload['wallet_id'])
+            transaction = utils.charge_wallet(
+                wallet, amount,
+                description=payload.get('description', ''),
+                payment_method=payload.get('payment_method'),
+                payment_id=payload.get('payment_id'),
+                request=request
+            )
+            return {'ok': True, 'transaction_ids': [transaction.transaction_id]}
+
+        if command == 'debit':
+            wallet = Wallet.objects.select_related('user').get(id=payload['wallet_id'])
+            transaction = utils.debit_wallet(
+                wallet, amount,
+                description=payload.get('description', ''),
+                reference_id=payload.get('reference_id'),
+                request=request
+            )
+            return {'ok': True, 'transaction_ids': [transaction.transaction_id]}
+
+        if command == 'transfer':
+            wallets = Wallet.objects.select_related('user').in_bulk(
+                [payload['sender_wallet_id'], payload['recipient_wallet_id']]
+            )
+            if len(wallets) != 2:
+                raise ValueError("Wallet not found")
+            sender_transaction, recipient_transaction = _claim_and_transfer(
+                wallets[payload['sender_wallet_id']],
+                wallets[payload['recipient_wallet_id']],
+                amount,
+                description=payload.get('description', ''),
+                method=payload.get('method'),
+                metadata=payload.get('metadata'),
+                claim=payload.get('claim'),
+                request=request
+            )
+            return {
+                'ok': True,
+                'transaction_ids': [sender_transaction.transaction_id, recipient_transaction.transaction_id]
+            }
+    except Wallet.DoesNotExist:
+        return {'ok': False, 'detail': 'Wallet not found'}
+    except ValueError as e:
+        return {'ok': False, 'detail': str(e)}
+
+    return {'ok': False, 'detail': f"Unknown wallet command: {command}"}
+
+
+def _claim_and_transfer(sender_wallet, recipient_wallet, amount, description='', method=None, metadata=None,
+                        claim=None, request=None):
+    """
+    مصرف QR یا لینک پرداخت (claim) و انتقال وجه در یک تراکنش پایگاه داده
+
+    claim: {'qr_payload' یا 'payment_link_id'، 'usage_metadata'}؛ در حالت صف‌محور
+    همین تابع در worker اجرا می‌شود تا مصرف کد و جابه‌جایی پول با هم commit یا
+    برگشت داده شوند.
+    """
+    claim = claim or {}
+    usage_metadata = claim.get('usage_metadata')
+    with db_transaction.atomic():
+        if claim.get('qr_payload') and not WalletQRCode.claim(claim['qr_payload'], usage_metadata):
+            raise ValueError('QR code is not active')
+        link = None
+        if claim.get('payment_link_id'):
+            link = PaymentLink.claim(claim['payment_link_id'], sender_wallet, usage_metadata)
+            if link is None:
+                raise ValueError('Payment link is not active')
+
+        sender_transaction, recipient_transaction = utils.transfer_money(
+            sender_wallet, recipient_wallet, amount, description=description,
+            method=method, metadata=metadata, request=request
+        )
+
+        if link is not None:
+            link.usage_metadata['transaction_id'] = sender_transaction.transaction_id
+            link.save(update_fields=['usage_metadata', 'updated_at'])
+    return sender_transaction, recipient_transaction
+
+
+def _dispatch(command, wallet_id, payload, request=None, command_id=None):
+    """ارسال فرمان به صف پارتیشن و انتظار برای نتیجه"""
+    from celery.exceptions import TimeoutError as CeleryTimeoutError
+    from config.celery_tasks.ex_wallet import apply_wallet_command_task
+
+    payload['command_id'] = command_id or get_command_id(request)
+    result = apply_wallet_command_task.apply_async(
+        args=[command, payload], queue=get_queue_name(wallet_id),
+        expires=settings.WALLET_COMMAND_TIMEOUT
+    )
+    try:
+        outcome = result.get(timeout=settings.WALLET_COMMAND_TIMEOUT)
+    except CeleryTimeoutError:
+        # فرمانی که هنوز شروع نشده اجرا نمی‌شود؛ فرمان در حال اجرا ممکن است کامل شود
+        result.revoke()
+        raise WalletCommandPending(payload['command_id'])
+    if not outcome['ok']:
+        raise ValueError(outcome['detail'])
+
+    transactions = Transaction.objects.in_bulk(outcome['transaction_ids'], field_name='transaction_id')
+    transactions = [transactions[transaction_id] for transaction_id in outcome['transaction_ids']]
+
+    context = audit_context.get_context(request)
+    if context is not None and outcome.get('audit'):
+        context.update(related_object=transactions[0], **outcome['audit'])
+    return transactions
+
+
+def charge_wallet(wallet, amount, description='', payment_method=None, payment_id=None, request=None,
+                  command_id=None):
+    """شارژ کیف پول (مستقیم یا از طریق صف پارتیشن)"""
+    if not is_enabled():
+        return utils.charge_wallet(
+            wallet, amount, description=description, payment_method=payment_method,
+            payment_id=payment_id, request=request
+        )
+    transaction = _dispatch('charge', wallet.id, {
+        'wallet_id': wallet.id,
+        'amount': str(amount),
+        'description': description,
+        'payment_method': payment_method,
+        'payment_id': payment_id,
+        'request': RequestContext.from_request(request),
+    }, request=request, command_id=command_id)[0]
+    wallet.refresh_from_db(fields=['balance'])
+    return transaction
+
+
+def debit_wallet(wallet, amount, description='', reference_id=None, request=None):
+    """برداشت از کیف پول (مستقیم یا از طریق صف پارتیشن)"""
+    if not is_enabled():
+        return utils.debit_wallet(
+            wallet, amount, description=description, reference_id=reference_id, request=request
+        )
+    transaction = _dispatch('debit', wallet.id, {
+        'wallet_id': wallet.id,
+        'amount': str(amount),
+        'description': description,
+        'reference_id': reference_id,
+        'request': RequestContext.from_request(request),
+    }, request=request)[0]
+    wallet.refresh_from_db(fields=['balance'])
+    return transaction
+
+
+def transfer_money(sender_wallet, recipient_wallet, amount, description='', method=None, metadata=None,
+                   claim=None, request=None):
+    """
+    انتقال وجه (مستقیم یا از طریق صف پارتیشن کیف پول فرستنده)
+
+    claim: QR یا لینک پرداختی که در همان تراکنش انتقال مصرف می‌شود (_claim_and_transfer)
+    """
+    if not is_enabled():
+        return _claim_and_transfer(
+            sender_wallet, recipient_wallet, amount, description=description,
+            method=method, metadata=metadata, claim=claim, request=request
+        )
+    sender_transaction, recipient_transaction = _dispatch('transfer', sender_wallet.id, {
+        'sender_wallet_id': sender_wallet.id,
+        'recipient_wallet_id': recipient_wallet.id,
+        'amount': str(amount),
+        'description': description,
+        'method': method,
+        'metadata': metadata,
+        'claim': claim,
+        'request': RequestContext.from_request(request),
+    }, request=request)
+    sender_wallet.refresh_from_db(fields=['balance'])
+    recipient_wallet.refresh_from_db(fields=['balance'])
+    return sender_transaction, recipient_transaction
+
+
+def purge_processed_commands():
+    """حذف فرمان‌های قدیمی‌تر از IDEMPOTENCY_KEY_TTL (بازه تکرار درخواست)"""
+    cutoff = timezone.now() - timedelta(seconds=IDEMPOTENCY_KEY_TTL)
+    deleted, _ = WalletCommand.objects.filter(created_at__lt=cutoff).delete()
+    return deleted
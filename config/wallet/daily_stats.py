@@ -0,0 +1,124 @@
+"""
+آمار روزانه کیف پول‌ها (wallet_daily_stats) برای گزارش تراکنش‌ها
+
+هر درج تراکنش در همان تراکنش پایگاه داده شمارنده و مجموع مبلغ روز را با یک
+upsert افزایشی به‌روز می‌کند. خلاصه و نمودار گزارش از ردیف‌های روزهای کامل بازه
+(حداکثر چند ردیف در روز) به‌علاوه یک GROUP BY روی تراکنش‌های روز ناقص ابتدا و
+انتهای بازه محاسبه می‌شود، بنابراین هزینه گزارش به حجم تراکنش‌ها بستگی ندارد.
+"""
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db import connection
+from django.db.models import Count, F, Q, Sum, Value
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from .models import Transaction, WalletDailyStat
+
+PAYMENT_TYPES = ('transfer_out', 'debit')
+RECEIPT_TYPES = ('transfer_in', 'charge', 'refund')
+
+
+def add_transactions(transactions):
+    """افزایش آمار روزانه برای تراکنش‌های تازه درج‌شده"""
+    totals = defaultdict(lambda: [0, Decimal('0')])
+    for txn in transactions:
+        key = (txn.wallet_id, timezone.localdate(txn.created_at), txn.type, txn.transfer_method or '')
+        totals[key][0] += 1
+        totals[key][1] += Decimal(txn.amount)
+    if not totals:
+        return
+    day_field = WalletDailyStat._meta.get_field('day')
+    amount_field = WalletDailyStat._meta.get_field('amount')
+    quote = connection.ops.quote_name
+    table = quote(WalletDailyStat._meta.db_table)
+    sql = (
+        f"INSERT INTO {table} (wallet_id, day, {quote('type')}, transfer_method, {quote('count')}, amount) "
+        f"VALUES (%s, %s, %s, %s, %s, %s) "
+        f"ON CONFLICT (wallet_id, day, {quote('type')}, transfer_method) "
+        f"DO UPDATE SET {quote('count')} = {table}.{quote('count')} + excluded.{quote('count')}, "
+        f"amount = {table}.amount + excluded.amount"
+    )
+    params = [
+        (
+            wallet_id, day_field.get_db_prep_value(day, connection), txn_type, method, count,
+            amount_field.get_db_prep_save(amount, connection)
+        )
+        for (wallet_id, day, txn_type, method), (count, amount) in sorted(totals.items())
+    ]
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, params)
+
+
+def _day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def group_by_day(queryset):
+    """ردیف‌های روزانه (day، type، transfer_method، count، amount) یک queryset تراکنش"""
+    return list(
+        queryset.order_by()
+        .annotate(day=TruncDate('created_at'), method=Coalesce('transfer_method', Value('')))
+        .values('day', 'type', 'method')
+        .annotate(count=Count('id'), amount=Sum('amount'))
+    )
+
+
+def daily_rows(wallet, start, end, transaction_type=None):
+    """
+    ردیف‌های روزانه کیف پول در بازه [start, end]
+
+    روزهای کامل از wallet_daily_stats و روز ناقص ابتدا و انتهای بازه با یک
+    GROUP BY روی transactions خوانده می‌شوند.
+    """
+    transactions = Transaction.objects.filter(wallet=wallet)
+    if transaction_type:
+        transactions = transactions.filter(type=transaction_type)
+
+    first_full_day = timezone.localdate(start)
+    if _day_start(first_full_day) < start:
+        first_full_day += timedelta(days=1)
+    end_day = timezone.localdate(end)
+    if first_full_day >= end_day:
+        return group_by_day(transactions.filter(created_at__gte=start, created_at__lte=end))
+
+    stats = WalletDailyStat.objects.filter(wallet=wallet, day__gte=first_full_day, day__lt=end_day)
+    if transaction_type:
+        stats = stats.filter(type=transaction_type)
+    rows = list(stats.values('day', 'type', 'count', 'amount', method=F('transfer_method')))
+    rows += group_by_day(transactions.filter(
+        Q(created_at__gte=start, created_at__lt=_day_start(first_full_day))
+        | Q(created_at__gte=_day_start(end_day), created_at__lte=end)
+    ))
+    return rows
+
+
+def summarize(rows):
+    """کل پرداختی، کل دریافتی و تعداد تراکنش‌ها"""
+    summary = {'payments': Decimal('0'), 'receipts': Decimal('0'), 'count': 0}
+    for row in rows:
+        summary['count'] += row['count']
+        if row['type'] in PAYMENT_TYPES:
+            summary['payments'] += row['amount']
+        elif row['type'] in RECEIPT_TYPES:
+            summary['receipts'] += row['amount']
+    return summary
+
+
+def chart(rows, period='week'):
+    """
+    پرداختی و دریافتی به تفکیک هفته (از دوشنبه) یا ماه
+
+    خروجی: لیست (شروع دوره، پرداختی، دریافتی) به ترتیب زمان
+    """
+    buckets = defaultdict(lambda: [Decimal('0'), Decimal('0')])
+    for row in rows:
+        day = row['day']
+        start = day - timedelta(days=day.weekday()) if period == 'week' else day.replace(day=1)
+        if row['type'] in PAYMENT_TYPES:
+            buckets[start][0] += row['amount']
+        elif row['type'] in RECEIPT_TYPES:
+            buckets[start][1] += row['amount']
+    return [(start, payments, receipts) for start, (payments, receipts) in sorted(buckets.items())]
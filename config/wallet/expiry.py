@@ -0,0 +1,85 @@
+"""
+منقضی کردن و پاک‌سازی دوره‌ای QRها و لینک‌های پرداخت
+
+تسک expire_payment_codes_task هر دقیقه ردیف‌های فعالی که expires_at آن‌ها
+گذشته است را با UPDATEهای تکه‌ای (EXPIRY_CHUNK_SIZE ردیف) منقضی می‌کند و
+ردیف‌های غیرفعال (استفاده‌شده، منقضی، لغوشده) که بیش از
+PAYMENT_CODE_RETENTION_DAYS روز از انقضای آن‌ها گذشته را حذف می‌کند. هر دو
+شرط روی index ستون expires_at اجرا می‌شوند.
+
+مسیرهای خواندنی (qr/lookup، qr/image، transfer) چیزی نمی‌نویسند و انقضا را فقط
+از روی expires_at تشخیص می‌دهند. qr/image تصویر QR منقضی را هم برمی‌گرداند، بنابراین
+فایل از پیش رندرشده QRهای دسته‌ای با حذف ردیف (نه انقضا) پاک می‌شود (wallet.signals).
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from . import lookup_cache
+from .models import PaymentLink, WalletQRCode
+
+EXPIRY_CHUNK_SIZE = 1000
+
+TERMINAL_STATUSES = ('used', 'expired', 'cancelled')
+
+
+def _expire(model, key_field, invalidate, now, chunk_size):
+    expired = 0
+    while True:
+        rows = list(
+            model.objects.filter(status='active', expires_at__lt=now)
+            .order_by('expires_at')
+            .values_list('id', key_field)[:chunk_size]
+        )
+        if not rows:
+            return expired
+        # شرط status دوباره بررسی می‌شود تا ردیفی که هم‌زمان استفاده شده بازنویسی نشود
+        expired += model.objects.filter(id__in=[row[0] for row in rows], status='active').update(
+            status='expired', updated_at=now
+        )
+        invalidate([row[1] for row in rows])
+        if len(rows) < chunk_size:
+            return expired
+
+
+def _prune(model, cutoff, chunk_size):
+    pruned = 0
+    while True:
+        ids = list(
+            model.objects.filter(expires_at__lt=cutoff, status__in=TERMINAL_STATUSES)
+            .order_by('expires_at')
+            .values_list('id', flat=True)[:chunk_size]
+        )
+        if not ids:
+            return pruned
+        pruned += model.objects.filter(id__in=ids).delete()[0]
+        if len(ids) < chunk_size:
+            return pruned
+
+
+def expire_due(now=None, chunk_size=EXPIRY_CHUNK_SIZE):
+    """
+    منقضی کردن QRها و لینک‌های فعال سررسیده
+
+    خروجی: {'qr_codes': تعداد، 'payment_links': تعداد}
+    """
+    now = now or timezone.now()
+    return {
+        'qr_codes': _expire(WalletQRCode, 'qr_payload', lookup_cache.invalidate_qrs, now, chunk_size),
+        'payment_links': _expire(PaymentLink, 'link_id', lookup_cache.invalidate_links, now, chunk_size),
+    }
+
+
+def prune_old(now=None, chunk_size=EXPIRY_CHUNK_SIZE):
+    """
+    حذف QRها و لینک‌های غیرفعال قدیمی‌تر از PAYMENT_CODE_RETENTION_DAYS
+
+    خروجی: {'qr_codes': تعداد، 'payment_links': تعداد}
+    """
+    now = now or timezone.now()
+    cutoff = now - timedelta(days=settings.PAYMENT_CODE_RETENTION_DAYS)
+    return {
+        'qr_codes': _prune(WalletQRCode, cutoff, chunk_size),
+        'payment_links': _prune(PaymentLink, cutoff, chunk_size),
+    }
@@ -0,0 +1,215 @@
+"""
+استخر شناسه‌های یکتای از پیش تولیدشده
+
+آدرس کیف پول، payload QR، شناسه لینک پرداخت و کد اختصاصی راننده به‌جای حلقه
+exists() در مسیر درخواست از یک استخر Redis برداشته می‌شوند (یک SPOP/LPOP، بدون
+query). تسک refill_id_pools_task استخرها را به‌صورت دسته‌ای پر می‌کند و یکتایی
+نامزدها را با یک query IN برای هر 500 شناسه بررسی می‌کند.
+
+- فضاهای تنک (آدرس، payload، شناسه لینک) یک SET هستند؛ SPOP عضو تصادفی برمی‌دارد.
+- فضای متراکم کدهای 5 رقمی (100 هزار کد) یک bitmap از کدهای تخصیص‌یافته دارد و
+  استخر، فهرست به‌هم‌ریخته‌ای از کدهای آزاد است. بیت هر کد هنگام ورود به استخر
+  (با SETBIT اتمی) روشن می‌شود، بنابراین یک کد هرگز دو بار در استخر قرار نمی‌گیرد
+  و پر شدن فضا سرعت تخصیص را کم نمی‌کند. کدی که جایگزین یا حذف شود پس از commit
+  با release_special_code دوباره آزاد می‌شود.
+
+اگر cache پیش‌فرض Redis نباشد یا استخر خالی باشد allocate مقدار None برمی‌گرداند
+و مدل‌ها به روش قبلی (تولید و بررسی با exists()) برمی‌گردند.
+"""
+import random
+import string
+import uuid
+
+from django.conf import settings
+from django.db import transaction
+
+SPARSE_KINDS = ('wallet_address', 'qr_payload', 'link_id')
+SPECIAL_CODE_LENGTH = 5
+SPECIAL_CODE_SPACE = 10 ** SPECIAL_CODE_LENGTH
+
+CHECK_CHUNK_SIZE = 500
+
+_random = random.SystemRandom()
+_LINK_CHARS = string.ascii_letters + string.digits
+
+
+def _pool_key(kind):
+    return f"id_pool:{kind}"
+
+
+SPECIAL_CODE_BITMAP_KEY = "id_pool:special_code:allocated"
+
+
+def _get_redis():
+    """اتصال خام Redis یا None اگر cache پیش‌فرض Redis نباشد"""
+    from django_redis import get_redis_connection
+    try:
+        return get_redis_connection('default')
+    except NotImplementedError:
+        return None
+
+
+def make_wallet_address():
+    return f"PAYA{uuid.uuid4().hex[:20].upper()}"
+
+
+def make_qr_payload():
+    return 'qr_' + uuid.uuid4().hex[:12].upper()
+
+
+def make_link_id():
+    return 'pl_' + ''.join(_random.choice(_LINK_CHARS) for _ in range(10))
+
+
+def _sparse_source(kind):
+    """(مدل، فیلد، تابع تولید نامزد)"""
+    from .models import PaymentLink, Wallet, WalletQRCode
+    return {
+        'wallet_address': (Wallet, 'wallet_address', make_wallet_address),
+        'qr_payload': (WalletQRCode, 'qr_payload', make_qr_payload),
+        'link_id': (PaymentLink, 'link_id', make_link_id),
+    }[kind]
+
+
+def _taken(model, field, values):
+    """مقادیری از values که در پایگاه داده وجود دارند (یک query برای هر CHECK_CHUNK_SIZE)"""
+    values = sorted(values)
+    taken = set()
+    for start in range(0, len(values), CHECK_CHUNK_SIZE):
+        chunk = values[start:start + CHECK_CHUNK_SIZE]
+        taken.update(model.objects.filter(**{f'{field}__in': chunk}).values_list(field, flat=True))
+    return taken
+
+
+def allocate(kind):
+    """برداشتن یک شناسه از استخر؛ None اگر Redis در دسترس نباشد یا استخر خالی باشد"""
+    return (allocate_many(kind, 1) or [None])[0]
+
+
+def allocate_many(kind, count):
+    """برداشتن حداکثر count شناسه از استخر در یک رفت‌وبرگشت"""
+    client = _get_redis()
+    if client is None or count < 1:
+        return []
+    if kind == 'special_code':
+        values = client.lpop(_pool_key(kind), count)
+    else:
+        values = client.spop(_pool_key(kind), count)
+    return [value.decode() for value in values or []]
+
+
+def claim_special_code(code):
+    """
+    ثبت کد انتخاب‌شده توسط کاربر به‌عنوان تخصیص‌یافته
+
+    کد دیگر وارد استخر نمی‌شود و اگر از قبل در استخر بوده حذف می‌شود.
+    """
+    client = _get_redis()
+    if client is None or not _is_special_code(code):
+        return
+    pipe = client.pipeline()
+    pipe.setbit(SPECIAL_CODE_BITMAP_KEY, int(code), 1)
+    pipe.lrem(_pool_key('special_code'), 0, code)
+    pipe.execute()
+
+
+def _is_special_code(code):
+    return len(code) == SPECIAL_CODE_LENGTH and code.isdigit()
+
+
+def release_special_code(code):
+    """
+    آزاد کردن کدی که دیگر در پایگاه داده نیست (جایگزین یا حذف شده)
+
+    بیت کد پس از commit خاموش می‌شود تا پرکننده بعدی بتواند آن را دوباره در
+    استخر بگذارد. اگر bitmap هنوز ساخته نشده کاری لازم نیست؛ اولین پر کردن آن
+    را از پایگاه داده می‌سازد.
+    """
+    client = _get_redis()
+    if client is None or not _is_special_code(code):
+        return
+
+    def clear_bit():
+        if client.exists(SPECIAL_CODE_BITMAP_KEY):
+            client.setbit(SPECIAL_CODE_BITMAP_KEY, int(code), 0)
+
+    transaction.on_commit(clear_bit)
+
+
+def _refill_sparse(client, kind, size):
+    model, field, make = _sparse_source(kind)
+    missing = size - client.scard(_pool_key(kind))
+    if missing <= 0:
+        return 0
+    candidates = {make() for _ in range(missing)}
+    fresh = candidates - _taken(model, field, candidates)
+    if fresh:
+        client.sadd(_pool_key(kind), *fresh)
+    return len(fresh)
+
+
+def _format_code(number):
+    return str(number).zfill(SPECIAL_CODE_LENGTH)
+
+
+def _init_special_code_bitmap(client):
+    """روشن کردن بیت کدهای موجود در پایگاه داده و استخر (اولین پر کردن)"""
+    from .models import SpecialCode
+
+    codes = [code for code in SpecialCode.objects.values_list('code', flat=True) if _is_special_code(code)]
+    codes += [code.decode() for code in client.lrange(_pool_key('special_code'), 0, -1)]
+    pipe = client.pipeline()
+    # بیت آخر فضا کلید را می‌سازد حتی اگر هیچ کدی وجود نداشته باشد
+    pipe.setbit(SPECIAL_CODE_BITMAP_KEY, SPECIAL_CODE_SPACE - 1, 0)
+    for code in codes:
+        pipe.setbit(SPECIAL_CODE_BITMAP_KEY, int(code), 1)
+    pipe.execute()
+
+
+def _free_codes(bitmap):
+    free = []
+    for number in range(SPECIAL_CODE_SPACE):
+        byte_index, bit = divmod(number, 8)
+        if byte_index >= len(bitmap) or not bitmap[byte_index] & (0x80 >> bit):
+            free.append(number)
+    return free
+
+
+def _refill_special_codes(client, size):
+    from .models import SpecialCode
+
+    key = _pool_key('special_code')
+    missing = size - client.llen(key)
+    if missing <= 0:
+        return 0
+    if not client.exists(SPECIAL_CODE_BITMAP_KEY):
+        _init_special_code_bitmap(client)
+
+    free = _free_codes(client.get(SPECIAL_CODE_BITMAP_KEY) or b'')
+    chosen = _random.sample(free, min(missing, len(free)))
+    pipe = client.pipeline()
+    for number in chosen:
+        pipe.setbit(SPECIAL_CODE_BITMAP_KEY, number, 1)
+    # SETBIT مقدار قبلی را برمی‌گرداند؛ کدی که پرکننده هم‌زمان برداشته کنار گذاشته می‌شود
+    codes = [_format_code(number) for number, previous in zip(chosen, pipe.execute()) if not previous]
+    # کدهایی که خارج از استخر ثبت شده‌اند (مسیر جایگزین) فقط بیتشان روشن می‌ماند
+    taken = _taken(SpecialCode, 'code', codes)
+    codes = [code for code in codes if code not in taken]
+    if codes:
+        client.rpush(key, *codes)
+    return len(codes)
+
+
+def refill(size=None):
+    """
+    پر کردن همه استخرها تا size شناسه
+
+    خروجی: {نوع: تعداد شناسه‌های اضافه‌شده} یا {} اگر Redis در دسترس نباشد
+    """
+    client = _get_redis()
+    if client is None:
+        return {}
+    size = size or settings.ID_POOL_SIZE
+    added = {kind: _refill_sparse(client, kind, size) for kind in SPARSE_KINDS}
+    added['special_code'] = _refill_special_codes(client, size)
+    return added
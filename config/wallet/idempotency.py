@@ -0,0 +1,212 @@
+"""
+لایه Idempotency برای endpointهای جابه‌جایی پول
+
+کلاینت با ارسال هدر `Idempotency-Key` تضمین می‌کند که تکرار یک درخواست (مثلاً
+به‌دلیل قطعی شبکه) دوباره مسیر پول را اجرا نمی‌کند. پاسخ اول در دو لایه نگه
+داشته می‌شود: Redis (لایه داغ) و جدول idempotency_keys (لایه پایدار با TTL).
+درخواست تکراری هم‌زمان به‌جای اجرای موازی منتظر پاسخ درخواست اول می‌ماند.
+"""
+import functools
+import hashlib
+import json
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from .models import IdempotencyKey
+
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+IDEMPOTENCY_KEY_TTL = getattr(settings, 'IDEMPOTENCY_KEY_TTL', 24 * 60 * 60)  # ثانیه
+IDEMPOTENCY_WAIT_TIMEOUT = getattr(settings, 'IDEMPOTENCY_WAIT_TIMEOUT', 15)  # ثانیه
+IDEMPOTENCY_POLL_INTERVAL = 0.05
+IN_FLIGHT_TIMEOUT = 60  # حداکثر زمان نگه‌داشتن قفل درخواست در حال اجرا
+MAX_KEY_LENGTH = 255
+
+# پاسخ‌های 4xx که به وضعیت لحظه‌ای بستگی دارند و تکرار درخواست ممکن است نتیجه دیگری بدهد
+RETRYABLE_CLIENT_STATUSES = {408, 409, 423, 425, 429}
+
+
+def _record_cache_key(user_id, key):
+    return f"idem:{user_id}:{key}"
+
+
+def _in_flight_cache_key(user_id, key):
+    return f"idem_lock:{user_id}:{key}"
+
+
+def _to_json(data):
+    """تبدیل داده پاسخ DRF (Decimal، datetime و ...) به JSON قابل ذخیره"""
+    return json.loads(json.dumps(data, cls=JSONEncoder))
+
+
+def get_request_hash(request):
+    """Hash درخواست برای تشخیص استفاده مجدد از یک کلید با بدنه متفاوت"""
+    body = json.dumps(_to_json(request.data), sort_keys=True)
+    raw = f"{request.method}:{request.path}:{body}"
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def get_stored_response(user_id, key):
+    """
+    خواندن پاسخ ذخیره‌شده؛ ابتدا از Redis و در صورت نبود از پایگاه داده
+    """
+    record = cache.get(_record_cache_key(user_id, key))
+    if record is not None:
+        return record
+
+    stored = IdempotencyKey.objects.filter(
+        user_id=user_id,
+        key=key,
+        expires_at__gt=timezone.now()
+    ).values('request_hash', 'response_status', 'response_body', 'expires_at').first()
+    if stored is None:
+        return None
+
+    record = {
+        'request_hash': stored['request_hash'],
+        'response_status': stored['response_status'],
+        'response_body': stored['response_body'],
+    }
+    remaining = int((stored['expires_at'] - timezone.now()).total_seconds())
+    if remaining > 0:
+        cache.set(_record_cache_key(user_id, key), record, remaining)
+    return record
+
+
+def store_response(user_id, key, request, request_hash, response):
+    """ذخیره پاسخ نهایی در هر دو لایه"""
+    record = {
+        'request_hash': request_hash,
+        'response_status': response.status_code,
+        'response_body': _to_json(response.data),
+    }
+    try:
+        IdempotencyKey.objects.update_or_create(
+            user_id=user_id,
+            key=key,
+            defaults={
+                'request_path': request.path[:255],
+                'request_hash': request_hash,
+                'response_status': record['response_status'],
+                'response_body': record['response_body'],
+                'expires_at': timezone.now() + timedelta(seconds=IDEMPOTENCY_KEY_TTL),
+            }
+        )
+    except IntegrityError:
+        # درخواست دیگری هم‌زمان همین رکورد را ساخته است
+        pass
+    cache.set(_record_cache_key(user_id, key), record, IDEMPOTENCY_KEY_TTL)
+    return record
+
+
+def is_storable(status_code):
+    """
+    فقط پاسخ‌های موفق و خطاهای قطعی کلاینت ذخیره می‌شوند؛ 202 یعنی نتیجه هنوز
+    نامعلوم است و تکرار درخواست باید نتیجه نهایی را بگیرد
+    """
+    if status_code == status.HTTP_202_ACCEPTED:
+        return False
+    if 200 <= status_code < 300:
+        return True
+    return 400 <= status_code < 500 and status_code not in RETRYABLE_CLIENT_STATUSES
+
+
+def _replay(record, request_hash):
+    """بازپخش پاسخ ذخیره‌شده"""
+    if record['request_hash'] != request_hash:
+        return Response(
+            {'detail': 'Idempotency-Key has already been used with a different request'},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY
+        )
+    response = Response(record['response_body'], status=record['response_status'])
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _wait_for_response(user_id, key, request_hash):
+    """انتظار برای تکمیل درخواست هم‌زمان با همان کلید"""
+    deadline = time.monotonic() + IDEMPOTENCY_WAIT_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(IDEMPOTENCY_POLL_INTERVAL)
+        record = get_stored_response(user_id, key)
+        if record is not None:
+            return _replay(record, request_hash)
+        if cache.get(_in_flight_cache_key(user_id, key)) is None:
+            # درخواست اول بدون پاسخ قابل ذخیره (مثلاً خطای 5xx) تمام شده است
+            return None
+    return Response(
+        {'detail': 'A request with this Idempotency-Key is still being processed'},
+        status=status.HTTP_409_CONFLICT
+    )
+
+
+def idempotent(view_method):
+    """
+    Decorator برای actionهای ViewSet که هدر Idempotency-Key را پشتیبانی می‌کنند
+
+    - بدون هدر: رفتار قبلی بدون تغییر
+    - کلید تکراری با همان بدنه: پاسخ ذخیره‌شده بدون اجرای مجدد view
+    - کلید تکراری با بدنه متفاوت: 422
+    - درخواست هم‌زمان با همان کلید: انتظار برای پاسخ درخواست اول
+    پاسخ‌های 202، 5xx و 4xx گذرا (RETRYABLE_CLIENT_STATUSES) ذخیره نمی‌شوند تا کلاینت
+    بتواند دوباره تلاش کند.
+    """
+    @functools.wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return view_method(self, request, *args, **kwargs)
+
+        if len(key) > MAX_KEY_LENGTH:
+            return Response(
+                {'detail': f'Idempotency-Key must be at most {MAX_KEY_LENGTH} characters'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        user_id = request.user.id
+        request_hash = get_request_hash(request)
+
+        while True:
+            record = get_stored_response(user_id, key)
+            if record is not None:
+                return _replay(record, request_hash)
+
+            token = uuid.uuid4().hex
+            lock_key = _in_flight_cache_key(user_id, key)
+            if cache.add(lock_key, token, IN_FLIGHT_TIMEOUT):
+                break
+
+            response = _wait_for_response(user_id, key, request_hash)
+            if response is not None:
+                return response
+
+        try:
+            # بررسی مجدد پس از گرفتن قفل (ممکن است درخواست قبلی همین الان تمام شده باشد)
+            record = get_stored_response(user_id, key)
+            if record is not None:
+                return _replay(record, request_hash)
+
+            response = view_method(self, request, *args, **kwargs)
+            if is_storable(response.status_code):
+                store_response(user_id, key, request, request_hash, response)
+            return response
+        finally:
+            if cache.get(lock_key) == token:
+                cache.delete(lock_key)
+
+    return wrapper
+
+
+def purge_expired_keys():
+    """حذف کلیدهای منقضی‌شده از جدول idempotency_keys"""
+    deleted, _ = IdempotencyKey.objects.filter(expires_at__lte=timezone.now()).delete()
+    return deleted
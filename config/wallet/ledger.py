@@ -0,0 +1,362 @@
+"""
+موتور دفتر کل (Ledger) برای تغییر اتمی موجودی کیف پول
+
+به‌جای قفل cache + refresh_from_db + محاسبه در پایتون + save، هر تغییر موجودی
+با یک دستور UPDATE شرط‌دار انجام می‌شود که موجودی جدید را در همان دستور
+(RETURNING) برمی‌گرداند. قفل ردیف توسط خود پایگاه داده تا پایان تراکنش نگه
+داشته می‌شود، بنابراین درخواست‌های هم‌زمان به‌جای خطا منتظر می‌مانند.
+
+برای کیف پول‌های پردریافت (shard_count > 0) واریزهای ورودی روی یکی از K ردیف
+wallet_balance_shards ثبت می‌شوند؛ برداشت‌ها در صورت کمبود موجودی اصلی و تسک
+دوره‌ای merge_wallet_shards_task شاردها را به موجودی اصلی منتقل (sweep) می‌کنند.
+
+زمان انتظار دستورهای قفل‌گیر برای هر کیف پول در wallet.lock_stats ثبت می‌شود.
+"""
+import random
+from dataclasses import dataclass, field
+from decimal import Decimal
+from typing import Optional
+
+from django.db import connection, models
+from django.db import transaction as db_transaction
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+
+from .lock_stats import measure
+from .models import Wallet, WalletBalanceShard
+
+
+MAX_SHARD_COUNT = 64
+
+
+@dataclass(frozen=True)
+class BalanceChange:
+    """
+    نتیجه یک تغییر موجودی (قبل و بعد از همان دستور UPDATE)
+
+    balance_before/balance_after موجودی کل کیف پول است و main_balance موجودی
+    ردیف wallets (برای کیف پول‌های بدون شارد هر دو یکی هستند). برای واریز روی
+    شارد موجودی کل None است: واریزهای هم‌زمان روی شاردهای مختلف ترتیبی ندارند و
+    هر موجودی کلی که ثبت شود زنجیره موجودی را می‌شکند.
+    """
+    wallet_id: int
+    balance_before: Optional[Decimal]
+    balance_after: Optional[Decimal]
+    main_balance: Decimal = field(default=None)
+
+    def __post_init__(self):
+        if self.main_balance is None:
+            object.__setattr__(self, 'main_balance', self.balance_after)
+
+
+_BALANCE_FIELD = Wallet._meta.get_field('balance')
+
+
+def _to_decimal(value):
+    """تبدیل مقدار برگشتی پایگاه داده به Decimal با دقت فیلد موجودی"""
+    value = _BALANCE_FIELD.to_python(value)
+    return value.quantize(Decimal(1).scaleb(-_BALANCE_FIELD.decimal_places))
+
+
+def _execute_update(wallet_id, delta, require_active, require_funds):
+    """
+    اجرای UPDATE شرط‌دار و برگرداندن موجودی جدید (یا None اگر شرط برقرار نبود)
+    """
+    table = connection.ops.quote_name(Wallet._meta.db_table)
+    conditions = ['id = %s']
+    params = [delta, timezone.now(), wallet_id]
+    if require_active:
+        conditions.append("status = 'active'")
+    if require_funds:
+        conditions.append('balance >= %s')
+        params.append(-delta)
+
+    sql = (
+        f"UPDATE {table} SET balance = balance + %s, updated_at = %s "
+        f"WHERE {' AND '.join(conditions)} RETURNING balance"
+    )
+    with connection.cursor() as cursor, measure([wallet_id]):
+        cursor.execute(sql, params)
+        row = cursor.fetchone()
+    if row is None:
+        return None
+    return _to_decimal(row[0])
+
+
+def _raise_for_failed_update(wallet_id, amount, label):
+    """تشخیص علت شکست UPDATE شرط‌دار و تولید خطای مناسب"""
+    state = Wallet.objects.filter(id=wallet_id).values('status', 'balance').first()
+    if state is None:
+        raise ValueError("Wallet not found")
+    if state['balance'] < amount:
+        raise ValueError("Insufficient balance")
+    raise ValueError(f"{label} is not active")
+
+
+def lock_shard_totals(wallet_ids):
+    """
+    قفل شاردهای چند کیف پول (SELECT ... FOR UPDATE) و مجموع موجودی آن‌ها
+
+    همراه با قفل ردیف wallets، موجودی کل تا پایان تراکنش ثابت می‌ماند: واریز
+    در حال اجرا روی یک شارد پیش از خواندن commit می‌شود و واریز بعدی منتظر می‌ماند.
+    خروجی: دیکشنری wallet_id -> مجموع موجودی شاردها
+    """
+    totals = {}
+    wallet_ids = set(wallet_ids)
+    with measure(wallet_ids):
+        rows = list(
+            WalletBalanceShard.objects.select_for_update()
+            .filter(wallet_id__in=wallet_ids)
+            .order_by('wallet_id', 'shard_index')
+            .values_list('wallet_id', 'balance')
+        )
+    for wallet_id, balance in rows:
+        totals[wallet_id] = totals.get(wallet_id, Decimal('0')) + balance
+    return {wallet_id: _to_decimal(total) for wallet_id, total in totals.items()}
+
+
+def _locked_shards_total(wallet_id):
+    return lock_shard_totals([wallet_id]).get(wallet_id, _to_decimal(0))
+
+
+def _credit_shard(wallet_id, amount, shard_count, require_active):
+    """
+    واریز روی یک شارد تصادفی بدون قفل کردن ردیف wallets
+
+    خروجی: موجودی اصلی کیف پول یا None اگر شارد وجود نداشت یا کیف پول فعال نبود
+    """
+    shards_table = connection.ops.quote_name(WalletBalanceShard._meta.db_table)
+    wallets_table = connection.ops.quote_name(Wallet._meta.db_table)
+    params = [amount, timezone.now(), wallet_id, random.randrange(shard_count)]
+    condition = ''
+    if require_active:
+        condition = f" AND EXISTS (SELECT 1 FROM {wallets_table} WHERE id = %s AND status = 'active')"
+        params.append(wallet_id)
+
+    sql = (
+        f"UPDATE {shards_table} SET balance = balance + %s, updated_at = %s "
+        f"WHERE wallet_id = %s AND shard_index = %s{condition} RETURNING balance"
+    )
+    with connection.cursor() as cursor, measure([wallet_id]):
+        cursor.execute(sql, params)
+        if cursor.fetchone() is None:
+            return None
+    return Wallet.objects.filter(id=wallet_id).values_list('balance', flat=True).first()
+
+
+def credit(wallet_id, amount, require_active=False, label='Wallet', shard_count=0, use_shards=True):
+    """
+    افزایش موجودی کیف پول با یک دستور UPDATE
+
+    اگر shard_count داده شود (و use_shards) واریز روی یکی از شاردها ثبت می‌شود و
+    موجودی کل گزارش نمی‌شود؛ در غیر این صورت یا در صورت نبود شارد (مثلاً غیرفعال
+    شدن شاردینگ هم‌زمان) روی موجودی اصلی ثبت و موجودی کل با قفل شاردها محاسبه می‌شود.
+    """
+    if shard_count and use_shards:
+        main_balance = _credit_shard(wallet_id, amount, shard_count, require_active)
+        if main_balance is not None:
+            return BalanceChange(wallet_id, None, None, _to_decimal(main_balance))
+
+    balance_after = _execute_update(wallet_id, amount, require_active, require_funds=False)
+    if balance_after is None:
+        _raise_for_failed_update(wallet_id, Decimal('0'), label)
+    if shard_count:
+        main_balance = balance_after
+        balance_after = main_balance + _locked_shards_total(wallet_id)
+        return BalanceChange(wallet_id, balance_after - amount, balance_after, main_balance)
+    return BalanceChange(wallet_id, balance_after - amount, balance_after)
+
+
+def debit(wallet_id, amount, label='Wallet', shard_count=0):
+    """
+    کاهش موجودی کیف پول با UPDATE شرط‌دار
+    (balance >= amount و status='active')
+
+    برای کیف پول شارد‌شده اگر موجودی اصلی کافی نباشد ابتدا شاردها sweep
+    می‌شوند و برداشت یک بار دیگر تلاش می‌شود.
+    """
+    balance_after = _execute_update(wallet_id, -amount, require_active=True, require_funds=True)
+    if balance_after is None and shard_count and sweep_shards(wallet_id):
+        balance_after = _execute_update(wallet_id, -amount, require_active=True, require_funds=True)
+    if balance_after is None:
+        _raise_for_failed_update(wallet_id, amount, label)
+    if shard_count:
+        main_balance = balance_after
+        balance_after = main_balance + _locked_shards_total(wallet_id)
+        return BalanceChange(wallet_id, balance_after + amount, balance_after, main_balance)
+    return BalanceChange(wallet_id, balance_after + amount, balance_after)
+
+
+def _move_in_one_statement(sender_wallet_id, recipient_wallet_id, amount):
+    """
+    کسر از فرستنده و واریز به گیرنده با یک دستور UPDATE
+
+    PostgreSQL ردیف‌ها را به ترتیب اسکن ایندکس کلید اصلی (ترتیب ID) قفل می‌کند،
+    بنابراین دو انتقال هم‌زمان در جهت مخالف دچار deadlock نمی‌شوند.
+    خروجی: دیکشنری wallet_id -> موجودی جدید (برای ردیف‌هایی که شرط را داشتند)
+    """
+    table = connection.ops.quote_name(Wallet._meta.db_table)
+    sql = (
+        f"UPDATE {table} SET balance = balance + CASE WHEN id = %s THEN %s ELSE %s END, "
+        f"updated_at = %s "
+        f"WHERE id IN (%s, %s) AND status = 'active' AND (id <> %s OR balance >= %s) "
+        f"RETURNING id, balance"
+    )
+    params = [
+        sender_wallet_id, -amount, amount, timezone.now(),
+        sender_wallet_id, recipient_wallet_id, sender_wallet_id, amount,
+    ]
+    with connection.cursor() as cursor, measure([sender_wallet_id, recipient_wallet_id]):
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+    return {row[0]: _to_decimal(row[1]) for row in rows}
+
+
+def move(sender_wallet_id, recipient_wallet_id, amount, sender_shard_count=0, recipient_shard_count=0):
+    """
+    انتقال موجودی بین دو کیف پول
+
+    در حالت عادی هر دو کیف پول با یک دستور UPDATE تغییر می‌کنند؛ اگر یکی از آن‌ها
+    شارد داشته باشد، دو طرف جداگانه و به ترتیب ID قفل می‌شوند تا دو انتقال
+    هم‌زمان در جهت مخالف دچار deadlock نشوند. باید داخل db_transaction.atomic
+    صدا زده شود (در صورت خطا، تغییر نیمه‌کاره با rollback برگردانده می‌شود).
+    """
+    if sender_wallet_id == recipient_wallet_id:
+        raise ValueError("Cannot transfer to your own wallet")
+
+    if not sender_shard_count and not recipient_shard_count:
+        balances = _move_in_one_statement(sender_wallet_id, recipient_wallet_id, amount)
+        if sender_wallet_id not in balances:
+            _raise_for_failed_update(sender_wallet_id, amount, 'Sender wallet')
+        if recipient_wallet_id not in balances:
+            _raise_for_failed_update(recipient_wallet_id, Decimal('0'), 'Recipient wallet')
+        sender_after = balances[sender_wallet_id]
+        recipient_after = balances[recipient_wallet_id]
+        return (
+            BalanceChange(sender_wallet_id, sender_after + amount, sender_after),
+            BalanceChange(recipient_wallet_id, recipient_after - amount, recipient_after),
+        )
+
+    changes = {}
+    for wallet_id in sorted([sender_wallet_id, recipient_wallet_id]):
+        if wallet_id == sender_wallet_id:
+            changes[wallet_id] = debit(
+                wallet_id, amount, label='Sender wallet', shard_count=sender_shard_count
+            )
+        else:
+            changes[wallet_id] = credit(
+                wallet_id, amount, require_active=True, label='Recipient wallet',
+                shard_count=recipient_shard_count
+            )
+    return changes[sender_wallet_id], changes[recipient_wallet_id]
+
+
+def lock_wallets(wallet_ids):
+    """
+    قفل کردن چند کیف پول در یک دستور SELECT ... FOR UPDATE (به ترتیب ID)
+
+    خروجی: دیکشنری wallet_id -> {'balance', 'status'}
+    """
+    wallet_ids = set(wallet_ids)
+    with measure(wallet_ids):
+        rows = list(
+            Wallet.objects.select_for_update()
+            .filter(id__in=wallet_ids)
+            .order_by('id')
+            .values('id', 'balance', 'status')
+        )
+    return {row['id']: row for row in rows}
+
+
+def credit_many(amounts):
+    """
+    افزایش موجودی چند کیف پول (قفل‌شده با lock_wallets) در یک دستور UPDATE
+
+    amounts: دیکشنری wallet_id -> مبلغ
+    """
+    if not amounts:
+        return 0
+    whens = [When(id=wallet_id, then=Value(amount)) for wallet_id, amount in amounts.items()]
+    return Wallet.objects.filter(id__in=list(amounts), status='active').update(
+        balance=F('balance') + Case(
+            *whens,
+            output_field=models.DecimalField(max_digits=15, decimal_places=2),
+        ),
+        updated_at=timezone.now(),
+    )
+
+
+def sweep_shards(wallet_id):
+    """
+    انتقال موجودی شاردها به موجودی اصلی کیف پول
+
+    شاردهایی که در همین لحظه توسط یک واریز قفل شده‌اند رد می‌شوند
+    (SKIP LOCKED) تا sweep هرگز پشت واریزها منتظر نماند. باید داخل
+    db_transaction.atomic صدا زده شود.
+    خروجی: مبلغ منتقل‌شده
+    """
+    shards = list(
+        WalletBalanceShard.objects.select_for_update(skip_locked=True)
+        .filter(wallet_id=wallet_id, balance__gt=0)
+        .values_list('id', 'balance')
+    )
+    if not shards:
+        return Decimal('0')
+
+    total = sum((balance for _, balance in shards), Decimal('0'))
+    now = timezone.now()
+    WalletBalanceShard.objects.filter(id__in=[shard_id for shard_id, _ in shards]).update(
+        balance=0, updated_at=now
+    )
+    Wallet.objects.filter(id=wallet_id).update(balance=F('balance') + total, updated_at=now)
+    return total
+
+
+def merge_shards(batch_size=500):
+    """
+    sweep دوره‌ای همه کیف پول‌های شارد‌شده (هر کیف پول در تراکنش جداگانه)
+
+    خروجی: تعداد کیف پول‌هایی که موجودی شاردشان منتقل شد
+    """
+    wallet_ids = (
+        WalletBalanceShard.objects.filter(balance__gt=0)
+        .values_list('wallet_id', flat=True)
+        .distinct()
+        .iterator(chunk_size=batch_size)
+    )
+    merged = 0
+    for wallet_id in wallet_ids:
+        with db_transaction.atomic():
+            if sweep_shards(wallet_id):
+                merged += 1
+    return merged
+
+
+@db_transaction.atomic
+def set_shard_count(wallet, shard_count):
+    """
+    فعال‌سازی، تغییر یا غیرفعال‌سازی (shard_count=0) شاردینگ موجودی ورودی
+
+    شاردهای اضافه پس از انتقال موجودی‌شان به موجودی اصلی حذف می‌شوند.
+    """
+    if shard_count < 0 or shard_count > MAX_SHARD_COUNT:
+        raise ValueError(f"Shard count must be between 0 and {MAX_SHARD_COUNT}")
+
+    Wallet.objects.filter(id=wallet.id).update(shard_count=shard_count, updated_at=timezone.now())
+    WalletBalanceShard.objects.bulk_create(
+        [WalletBalanceShard(wallet=wallet, shard_index=index) for index in range(shard_count)],
+        ignore_conflicts=True
+    )
+
+    extra = list(
+        WalletBalanceShard.objects.select_for_update()
+        .filter(wallet=wallet, shard_index__gte=shard_count)
+        .values_list('id', 'balance')
+    )
+    total = sum((balance for _, balance in extra), Decimal('0'))
+    if total:
+        Wallet.objects.filter(id=wallet.id).update(balance=F('balance') + total)
+    WalletBalanceShard.objects.filter(id__in=[shard_id for shard_id, _ in extra]).delete()
+
+    wallet.refresh_from_db(fields=['balance', 'shard_count'])
+    return wallet
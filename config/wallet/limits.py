@@ -0,0 +1,287 @@
+"""
+سرویس شمارنده محدودیت‌های روزانه انتقال
+
+بررسی و افزایش شمارنده در یک رفت‌وبرگشت به Redis و با یک اسکریپت Lua انجام
+می‌شود، بنابراین انتقال‌های هم‌زمان نمی‌توانند از سقف روزانه عبور کنند. کلیدها
+در پایان روز منقضی می‌شوند و جدول wallet_limits فقط برای گزارش‌گیری و به‌صورت
+غیرهم‌زمان (تسک flush_wallet_limits_task) به‌روزرسانی می‌شود.
+
+مسیرهای انتقال با reservation رزرو می‌کنند: رزرو تا commit تراکنش پایگاه داده
+در مجموعه wallet_limit_pending می‌ماند. خطا در بدنه انتقال آن را فوراً برمی‌گرداند
+و اگر بلوک atomic بیرونی rollback شود (on_commit اجرا نمی‌شود) همان تسک دوره‌ای
+پس از PENDING_TIMEOUT مصرف را برمی‌گرداند.
+
+اگر cache پیش‌فرض Redis نباشد (مثلاً در محیط تست)، همان منطق با قفل ردیف
+روی جدول wallet_limits اجرا می‌شود.
+"""
+import json
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, time as dt_time, timedelta
+from decimal import Decimal
+
+from django.db import transaction as db_transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import WalletLimit
+
+
+MAX_DAILY_TRANSFER_AMOUNT = Decimal('5000000')  # حداکثر انتقال در روز
+MAX_DAILY_TRANSFER_COUNT = 10  # حداکثر تعداد انتقال در روز
+
+AMOUNT_EXCEEDED_MESSAGE = "Daily transfer limit exceeded"
+COUNT_EXCEEDED_MESSAGE = "Daily transfer count limit exceeded"
+
+KEY_GRACE_SECONDS = 60 * 60  # نگه‌داشتن کلید پس از پایان روز تا flush نهایی
+FLUSH_BATCH_SIZE = 500
+
+PENDING_KEY = "wallet_limit_pending"
+PENDING_TIMEOUT = 300  # ثانیه؛ رزرو تأییدنشده پس از این مدت rollback شده فرض می‌شود
+
+# KEYS[1]: هش شمارنده کیف پول در روز، KEYS[2]: مجموعه کیف پول‌های تغییر‌یافته
+# ARGV: مبلغ (ریال × 100)، تعداد، سقف مبلغ، سقف تعداد، زمان انقضا، wallet_id
+_RESERVE_SCRIPT = """
+local amount = tonumber(redis.call('HGET', KEYS[1], 'amount') or '0')
+local count = tonumber(redis.call('HGET', KEYS[1], 'count') or '0')
+local delta_amount = tonumber(ARGV[1])
+local delta_count = tonumber(ARGV[2])
+if delta_amount > 0 and amount + delta_amount > tonumber(ARGV[3]) then
+    return 1
+end
+if delta_count > 0 and count >= tonumber(ARGV[4]) then
+    return 2
+end
+redis.call('HINCRBY', KEYS[1], 'amount', ARGV[1])
+redis.call('HINCRBY', KEYS[1], 'count', ARGV[2])
+redis.call('EXPIREAT', KEYS[1], ARGV[5])
+redis.call('SADD', KEYS[2], ARGV[6])
+redis.call('EXPIREAT', KEYS[2], ARGV[5])
+return 0
+"""
+
+_scripts = {}
+
+
+def _get_redis():
+    """اتصال خام Redis یا None اگر cache پیش‌فرض Redis نباشد"""
+    from django_redis import get_redis_connection
+    try:
+        return get_redis_connection('default')
+    except NotImplementedError:
+        return None
+
+
+def _get_script(client):
+    script = _scripts.get(id(client))
+    if script is None:
+        script = client.register_script(_RESERVE_SCRIPT)
+        _scripts[id(client)] = script
+    return script
+
+
+def _counter_key(wallet_id, date):
+    return f"wallet_limit:{date.isoformat()}:{wallet_id}"
+
+
+def _dirty_key(date):
+    return f"wallet_limit_dirty:{date.isoformat()}"
+
+
+def _to_minor(amount):
+    return int((Decimal(amount) * 100).to_integral_value())
+
+
+def _from_minor(value):
+    return (Decimal(int(value or 0)) / 100).quantize(Decimal('0.01'))
+
+
+def _expire_at(date):
+    """زمان انقضای کلیدهای یک روز (پایان روز + مهلت flush)"""
+    end_of_day = timezone.make_aware(datetime.combine(date + timedelta(days=1), dt_time.min))
+    return int(end_of_day.timestamp()) + KEY_GRACE_SECONDS
+
+
+def get_usage(wallet, date=None):
+    """
+    مصرف روزانه کیف پول: (مجموع مبلغ، تعداد انتقال)
+    """
+    date = date or timezone.localdate()
+    client = _get_redis()
+    if client is not None:
+        amount, count = client.hmget(_counter_key(wallet.id, date), ['amount', 'count'])
+        return _from_minor(amount), int(count or 0)
+
+    limit = WalletLimit.objects.filter(wallet=wallet, date=date).first()
+    if limit is None:
+        return Decimal('0'), 0
+    return limit.total_transfer_amount, limit.transfer_count
+
+
+def reserve(wallet, amount, count=1):
+    """
+    بررسی و ثبت اتمی مصرف روزانه
+
+    خروجی: (True, None) در صورت موفقیت یا (False, پیام خطا)
+    """
+    date = timezone.localdate()
+    client = _get_redis()
+    if client is not None:
+        result = _get_script(client)(
+            keys=[_counter_key(wallet.id, date), _dirty_key(date)],
+            args=[
+                _to_minor(amount), count,
+                _to_minor(MAX_DAILY_TRANSFER_AMOUNT), MAX_DAILY_TRANSFER_COUNT,
+                _expire_at(date), wallet.id,
+            ],
+        )
+        if int(result) == 1:
+            return False, AMOUNT_EXCEEDED_MESSAGE
+        if int(result) == 2:
+            return False, COUNT_EXCEEDED_MESSAGE
+        return True, None
+
+    return _reserve_in_database(wallet, date, amount, count)
+
+
+def _release_counter(client, wallet_id, date, minor_amount, count):
+    _get_script(client)(
+        keys=[_counter_key(wallet_id, date), _dirty_key(date)],
+        args=[
+            -minor_amount, -count,
+            _to_minor(MAX_DAILY_TRANSFER_AMOUNT), MAX_DAILY_TRANSFER_COUNT,
+            _expire_at(date), wallet_id,
+        ],
+    )
+
+
+def _cancel_pending(client, member):
+    """برگرداندن رزرو تأییدنشده؛ فقط یک بار (هر کدام از on_commit یا این تابع که زودتر ZREM کند)"""
+    if not client.zrem(PENDING_KEY, member):
+        return False
+    pending = json.loads(member)
+    _release_counter(
+        client, pending['wallet_id'], datetime.fromisoformat(pending['date']).date(),
+        pending['amount'], pending['count']
+    )
+    return True
+
+
+@contextmanager
+def reservation(wallet, amount, count=1):
+    """
+    رزرو مصرف روزانه برای بدنه یک انتقال
+
+    اگر محدودیت رد شود ValueError. با هر rollback تراکنش پایگاه داده (خطای داخل
+    بدنه یا rollback بلوک atomic بیرونی) مصرف برگردانده می‌شود؛ در مسیر جایگزین
+    پایگاه داده شمارنده خودش همراه تراکنش rollback می‌شود.
+    """
+    can_transfer, error_msg = reserve(wallet, amount, count)
+    if not can_transfer:
+        raise ValueError(error_msg)
+
+    client = _get_redis()
+    if client is None:
+        yield
+        return
+
+    member = json.dumps({
+        'id': uuid.uuid4().hex,
+        'wallet_id': wallet.id,
+        'date': timezone.localdate().isoformat(),
+        'amount': _to_minor(amount),
+        'count': count,
+    })
+    client.zadd(PENDING_KEY, {member: time.time() + PENDING_TIMEOUT})
+    try:
+        yield
+    except BaseException:
+        _cancel_pending(client, member)
+        raise
+    db_transaction.on_commit(lambda: client.zrem(PENDING_KEY, member))
+
+
+def release_abandoned(now=None):
+    """
+    برگرداندن رزروهایی که تراکنششان commit نشد (rollback بلوک atomic بیرونی)
+
+    خروجی: تعداد رزروهای برگردانده‌شده
+    """
+    client = _get_redis()
+    if client is None:
+        return 0
+    members = client.zrangebyscore(PENDING_KEY, '-inf', now or time.time())
+    return sum(_cancel_pending(client, member) for member in members)
+
+
+@db_transaction.atomic
+def _reserve_in_database(wallet, date, amount, count):
+    """مسیر جایگزین بدون Redis: قفل ردیف wallet_limits و افزایش شمارنده"""
+    WalletLimit.objects.get_or_create(
+        wallet=wallet,
+        date=date,
+        defaults={
+            'total_transfer_amount': Decimal('0'),
+            'transfer_count': 0
+        }
+    )
+    limit = WalletLimit.objects.select_for_update().get(wallet=wallet, date=date)
+
+    if limit.total_transfer_amount + amount > MAX_DAILY_TRANSFER_AMOUNT:
+        return False, AMOUNT_EXCEEDED_MESSAGE
+    if limit.transfer_count >= MAX_DAILY_TRANSFER_COUNT:
+        return False, COUNT_EXCEEDED_MESSAGE
+
+    WalletLimit.objects.filter(id=limit.id).update(
+        total_transfer_amount=F('total_transfer_amount') + amount,
+        transfer_count=F('transfer_count') + count
+    )
+    return True, None
+
+
+def flush_to_database(date=None):
+    """
+    انتقال شمارنده‌های Redis به جدول wallet_limits برای گزارش‌گیری
+
+    فقط کیف پول‌هایی که از آخرین flush تغییر کرده‌اند خوانده می‌شوند.
+    خروجی: تعداد ردیف‌های به‌روزشده
+    """
+    client = _get_redis()
+    if client is None:
+        return 0
+
+    if date is None:
+        today = timezone.localdate()
+        return flush_to_database(today - timedelta(days=1)) + flush_to_database(today)
+
+    flushed = 0
+    while True:
+        wallet_ids = [int(wallet_id) for wallet_id in client.spop(_dirty_key(date), FLUSH_BATCH_SIZE) or []]
+        if not wallet_ids:
+            return flushed
+
+        pipe = client.pipeline(transaction=False)
+        for wallet_id in wallet_ids:
+            pipe.hmget(_counter_key(wallet_id, date), ['amount', 'count'])
+        counters = dict(zip(wallet_ids, pipe.execute()))
+
+        existing = {
+            limit.wallet_id: limit
+            for limit in WalletLimit.objects.filter(date=date, wallet_id__in=wallet_ids)
+        }
+        to_create = []
+        for wallet_id, (amount, count) in counters.items():
+            limit = existing.get(wallet_id)
+            if limit is None:
+                limit = WalletLimit(wallet_id=wallet_id, date=date)
+                to_create.append(limit)
+            limit.total_transfer_amount = _from_minor(amount)
+            limit.transfer_count = int(count or 0)
+
+        WalletLimit.objects.bulk_create(to_create, ignore_conflicts=True)
+        if existing:
+            WalletLimit.objects.bulk_update(
+                list(existing.values()), ['total_transfer_amount', 'transfer_count']
+            )
+        flushed += len(wallet_ids)
@@ -0,0 +1,115 @@
+"""
+متریک انتظار و رقابت روی قفل ردیف کیف پول‌ها
+
+تغییر موجودی در wallet.ledger با UPDATE شرط‌دار و SELECT ... FOR UPDATE انجام
+می‌شود و درخواست هم‌زمان به‌جای خطا منتظر قفل ردیف می‌ماند. زمان اجرای هر
+دستور قفل‌گیر اندازه گرفته می‌شود؛ خود دستور کمتر از یک میلی‌ثانیه طول می‌کشد،
+بنابراین زمان بیشتر از WALLET_LOCK_CONTENTION_MS انتظار برای قفل حساب می‌شود و
+برای هر کیف پول درگیر در Redis ثبت می‌شود:
+
+- wallet_lock_stats:{wallet_id}: تعداد رقابت، مجموع و بیشینه زمان انتظار (ms)
+- wallet_lock_contention:{YYYYMMDD}: sorted set تعداد رقابت هر کیف پول در روز
+
+هر دو کلید STATS_TTL ثانیه پس از آخرین رقابت منقضی می‌شوند. دستورهای بدون
+رقابت چیزی در Redis نمی‌نویسند. اگر cache پیش‌فرض Redis نباشد فقط انتظارهای
+طولانی‌تر از SLOW_WAIT_MS در لاگ ثبت می‌شوند.
+"""
+import logging
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+STATS_TTL = 7 * 24 * 60 * 60  # ثانیه
+SLOW_WAIT_MS = 500
+
+# ثبت بیشینه زمان انتظار به‌صورت اتمی
+_MAX_SCRIPT = """
+local current = tonumber(redis.call('HGET', KEYS[1], 'max_wait_ms') or '0')
+if tonumber(ARGV[1]) > current then
+    redis.call('HSET', KEYS[1], 'max_wait_ms', ARGV[1])
+end
+return 1
+"""
+
+
+def _get_redis():
+    """اتصال خام Redis یا None اگر cache پیش‌فرض Redis نباشد"""
+    from django_redis import get_redis_connection
+    try:
+        return get_redis_connection('default')
+    except NotImplementedError:
+        return None
+
+
+def _stats_key(wallet_id):
+    return f"wallet_lock_stats:{wallet_id}"
+
+
+def _contention_key(day=None):
+    return f"wallet_lock_contention:{(day or timezone.now()).strftime('%Y%m%d')}"
+
+
+def record(wallet_ids, waited_ms):
+    """ثبت یک انتظار برای قفل ردیف کیف پول‌های wallet_ids"""
+    waited_ms = int(waited_ms)
+    if waited_ms >= SLOW_WAIT_MS:
+        logger.warning('waited %d ms for wallet row lock (wallets %s)', waited_ms, sorted(wallet_ids))
+    client = _get_redis()
+    if client is None:
+        return
+
+    contention_key = _contention_key()
+    pipe = client.pipeline(transaction=False)
+    for wallet_id in wallet_ids:
+        stats_key = _stats_key(wallet_id)
+        pipe.hincrby(stats_key, 'contended', 1)
+        pipe.hincrby(stats_key, 'wait_ms', waited_ms)
+        pipe.eval(_MAX_SCRIPT, 1, stats_key, waited_ms)
+        pipe.expire(stats_key, STATS_TTL)
+        pipe.zincrby(contention_key, 1, wallet_id)
+    pipe.expire(contention_key, STATS_TTL)
+    pipe.execute()
+
+
+@contextmanager
+def measure(wallet_ids):
+    """اندازه‌گیری زمان یک دستور قفل‌گیر و ثبت آن در صورت رقابت"""
+    started = time.monotonic()
+    yield
+    waited_ms = (time.monotonic() - started) * 1000
+    if waited_ms >= settings.WALLET_LOCK_CONTENTION_MS:
+        try:
+            record(wallet_ids, waited_ms)
+        except Exception:
+            # متریک نباید مسیر پول را از کار بیندازد
+            logger.warning('Error recording wallet lock wait', exc_info=True)
+
+
+def get_lock_stats(wallet_id):
+    """
+    متریک‌های قفل یک کیف پول در STATS_TTL اخیر:
+    contended، wait_ms (مجموع)، max_wait_ms و avg_wait_ms
+    """
+    stats = {'contended': 0, 'wait_ms': 0, 'max_wait_ms': 0}
+    client = _get_redis()
+    if client is not None:
+        for field, value in client.hgetall(_stats_key(wallet_id)).items():
+            stats[field.decode() if isinstance(field, bytes) else field] = int(value)
+    stats['avg_wait_ms'] = stats['wait_ms'] / stats['contended'] if stats['contended'] else 0
+    return stats
+
+
+def top_contended_wallets(limit=10, day=None):
+    """کیف پول‌های دارای بیشترین رقابت در یک روز: لیست (wallet_id, تعداد)"""
+    client = _get_redis()
+    if client is None:
+        return []
+    return [
+        (int(wallet_id), int(score))
+        for wallet_id, score in client.zrevrange(_contention_key(day), 0, limit - 1, withscores=True)
+    ]
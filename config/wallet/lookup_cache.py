@@ -0,0 +1,172 @@
+"""
+cache خواندنی (read-through) اطلاعات QR و لینک پرداخت
+
+QR و لینک پرداخت تا زمان استفاده یا لغو تغییر نمی‌کنند، بنابراین qr/lookup،
+qr/image و شاخه‌های qr و link در transfer به‌جای query با
+select_related('wallet__user') یک projection کوچک (وضعیت، مبلغ، کیف پول و
+مشخصات صاحب) را از cache می‌خوانند. TTL برابر زمان باقی‌مانده تا expires_at
+(حداکثر LOOKUP_CACHE_MAX_TTL؛ QR ثابت انقضا ندارد) است و mark_used، cancel،
+claim و تسک انقضا کلید را حذف می‌کنند.
+
+projection فقط برای نمایش و رد سریع درخواست است. هنگام جابه‌جایی پول وضعیت و shard_count کیف پول
+صاحب از پایگاه داده خوانده می‌شود (owner_wallet) و QR/لینک با UPDATE شرطی در
+همان تراکنش انتقال مصرف می‌شود (claim)، بنابراین ورودی کهنه cache نمی‌تواند
+پرداخت دوباره یا واریز با shard_count قدیمی ایجاد کند.
+"""
+import math
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from users.core.models import User
+
+from .models import PaymentLink, Wallet, WalletQRCode
+
+# QR/لینک غیرفعال (استفاده‌شده، لغوشده، منقضی) دیگر تغییر نمی‌کند
+TERMINAL_TTL = 300
+
+
+def _qr_key(qr_payload):
+    return f"qr_lookup:{qr_payload}"
+
+
+def _link_key(link_id):
+    return f"link_lookup:{link_id}"
+
+
+def max_age(projection):
+    """ثانیه‌های باقی‌مانده تا انقضا، حداکثر LOOKUP_CACHE_MAX_TTL"""
+    if projection['expires_at'] is None:
+        return settings.LOOKUP_CACHE_MAX_TTL
+    remaining = (projection['expires_at'] - timezone.now()).total_seconds()
+    return max(min(math.ceil(remaining), settings.LOOKUP_CACHE_MAX_TTL), 0)
+
+
+def _ttl(projection):
+    if projection['status'] != 'active' or is_expired(projection):
+        return TERMINAL_TTL
+    return max_age(projection)
+
+
+def _owner(wallet):
+    return {
+        'wallet_id': wallet.id,
+        'wallet_status': wallet.status,
+        'shard_count': wallet.shard_count,
+        'user_id': wallet.user_id,
+        'phone': str(wallet.user.phone),
+        'fullname': wallet.user.fullname or '',
+    }
+
+
+def _qr_projection(qr):
+    projection = {
+        'id': qr.id,
+        'qr_payload': qr.qr_payload,
+        'status': qr.status,
+        'amount': qr.amount,
+        'description': qr.description,
+        'metadata': qr.metadata,
+        'is_static': qr.is_static,
+        'expires_at': qr.expires_at,
+    }
+    projection.update(_owner(qr.wallet))
+    return projection
+
+
+def _link_projection(link):
+    projection = {
+        'id': link.id,
+        'link_id': link.link_id,
+        'status': link.status,
+        'amount': link.amount,
+        'description': link.description,
+        'expires_at': link.expires_at,
+    }
+    projection.update(_owner(link.wallet))
+    return projection
+
+
+def _read_through(key, load, project):
+    projection = cache.get(key)
+    if projection is None:
+        instance = load()
+        if instance is None:
+            return None
+        projection = project(instance)
+        cache.set(key, projection, _ttl(projection))
+    return projection
+
+
+def get_qr(qr_payload):
+    """projection QR یا None"""
+    return _read_through(
+        _qr_key(qr_payload),
+        lambda: WalletQRCode.objects.select_related('wallet__user').filter(qr_payload=qr_payload).first(),
+        _qr_projection,
+    )
+
+
+def get_link(link_id):
+    """projection لینک پرداخت یا None"""
+    return _read_through(
+        _link_key(link_id),
+        lambda: PaymentLink.objects.select_related('wallet__user').filter(link_id=link_id).first(),
+        _link_projection,
+    )
+
+
+def is_expired(projection):
+    return projection['expires_at'] is not None and timezone.now() >= projection['expires_at']
+
+
+def owner_user(projection):
+    user = User(id=projection['user_id'], phone=projection['phone'], fullname=projection['fullname'])
+    user._state.adding = False
+    user._state.db = 'default'
+    return user
+
+
+def owner_wallet(projection):
+    """
+    کیف پول صاحب QR/لینک برای انتقال
+
+    status و shard_count (که بدون باطل شدن این cache تغییر می‌کنند) با یک query
+    بدون join از پایگاه داده خوانده می‌شوند؛ None اگر کیف پول حذف شده باشد.
+    """
+    state = Wallet.objects.filter(id=projection['wallet_id']).values('status', 'shard_count').first()
+    if state is None:
+        return None
+    wallet = Wallet(
+        id=projection['wallet_id'],
+        user=owner_user(projection),
+        status=state['status'],
+        shard_count=state['shard_count'],
+    )
+    wallet._state.adding = False
+    wallet._state.db = 'default'
+    return wallet
+
+
+def _invalidate(key):
+    # حذف فوری و دوباره پس از commit (درخواست هم‌زمان ممکن است وضعیت قبلی را دوباره خوانده باشد)
+    cache.delete(key)
+    transaction.on_commit(lambda: cache.delete(key))
+
+
+def invalidate_qr(qr_payload):
+    _invalidate(_qr_key(qr_payload))
+
+
+def invalidate_link(link_id):
+    _invalidate(_link_key(link_id))
+
+
+def invalidate_qrs(qr_payloads):
+    cache.delete_many([_qr_key(qr_payload) for qr_payload in qr_payloads])
+
+
+def invalidate_links(link_ids):
+    cache.delete_many([_link_key(link_id) for link_id in link_ids])
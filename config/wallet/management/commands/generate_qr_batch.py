@@ -0,0 +1,83 @@
+"""
+تولید دسته‌ای QR ثابت برای چاپ
+
+QRها با یک bulk_create برای کیف پول کاربر ایجاد، تصاویرشان در process pool
+رندر و به‌صورت فایل از پیش رندرشده ذخیره می‌شوند و خروجی یک PDF چندصفحه‌ای یا
+ZIP است (wallet.qr_batch).
+
+نمونه:
+    python manage.py generate_qr_batch --phone +989121234567 --count 200 \
+        --format pdf --output fleet.pdf
+"""
+import json
+import os
+import time
+from decimal import Decimal, InvalidOperation
+
+from django.core.management.base import BaseCommand, CommandError
+
+from users.core.models import User
+from wallet import qr_batch
+from wallet.models import Wallet
+
+
+class Command(BaseCommand):
+    help = 'Create a batch of static wallet QR codes and write them as a printable PDF or ZIP'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--phone', required=True, help='Phone number of the wallet owner')
+        parser.add_argument('--count', type=int, required=True, help='Number of QR codes')
+        parser.add_argument('--amount', help='Fixed amount of every QR code')
+        parser.add_argument('--description', default='', help='Description of every QR code')
+        parser.add_argument(
+            '--expires-in', type=int,
+            help='Lifetime of the QR codes in seconds (default: no expiry)'
+        )
+        parser.add_argument('--format', choices=sorted(qr_batch.OUTPUT_FORMATS), default='pdf')
+        parser.add_argument('--size', type=int, help='Image size in pixels (128-1024)')
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1,
+            help='Number of render processes (1 renders in-process)'
+        )
+        parser.add_argument('--output', required=True, help='Path of the PDF/ZIP file')
+
+    def handle(self, *args, **options):
+        expires_in = options['expires_in']
+        if options['count'] < 1 or options['workers'] < 1 or (expires_in is not None and expires_in < 60):
+            raise CommandError('--count and --workers must be positive and --expires-in at least 60')
+
+        amount = None
+        if options['amount']:
+            try:
+                amount = Decimal(options['amount'])
+            except InvalidOperation:
+                raise CommandError('--amount must be a number')
+
+        try:
+            wallet = Wallet.objects.get(user__phone=options['phone'])
+        except (Wallet.DoesNotExist, User.DoesNotExist):
+            raise CommandError(f"Wallet not found for {options['phone']}")
+        if wallet.status != 'active':
+            raise CommandError('Wallet is not active')
+
+        started = time.monotonic()
+        batch_id, qr_codes, content = qr_batch.generate_batch(
+            wallet,
+            options['count'],
+            amount=amount,
+            description=options['description'],
+            expires_in=expires_in,
+            output_format=options['format'],
+            size=options['size'],
+            workers=options['workers'],
+        )
+        with open(options['output'], 'wb') as output:
+            output.write(content)
+
+        self.stderr.write(json.dumps({
+            'batch_id': batch_id,
+            'count': len(qr_codes),
+            'output': options['output'],
+            'bytes': len(content),
+            'elapsed_seconds': round(time.monotonic() - started, 3),
+        }, ensure_ascii=False))
@@ -0,0 +1,205 @@
+"""
+تطبیق دفتر کل کیف پول‌ها
+
+بررسی‌ها برای هر کیف پول:
+- balance_mismatch: موجودی کیف پول (اصلی + شاردها) با مجموع تراکنش‌های تکمیل‌شده برابر نیست
+- chain_gap: balance_before یک تراکنش با balance_after تراکنش قبلی همان کیف پول برابر نیست
+- unpaired_transfer: transfer_out/transfer_in بدون طرف مقابل از طریق related_transaction
+- transfer_amount_mismatch: مبلغ دو طرف انتقال برابر نیست
+
+کیف پول‌ها به بازه‌های ID تقسیم و بین یک process pool پخش می‌شوند. هر worker
+تراکنش‌های بازه خود را به ترتیب (wallet_id, id) با iterator (cursor سمت سرور در
+PostgreSQL) می‌خواند و فقط وضعیت کیف پول جاری را در حافظه نگه می‌دارد.
+گزارش به‌صورت NDJSON (هر خط یک مغایرت) نوشته می‌شود و خلاصه در انتها چاپ می‌شود.
+
+نمونه:
+    python manage.py reconcile_ledger --workers 8 --output reconcile.ndjson
+"""
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Max, Min, Sum
+
+from wallet.checkpoints import CREDIT_TYPES, DEBIT_TYPES
+from wallet.models import Transaction, Wallet, WalletBalanceShard
+
+
+def _close_connections():
+    """اتصال‌های به ارث رسیده از process والد در worker قابل استفاده نیستند"""
+    connections.close_all()
+
+
+def _issue(check, wallet_id, **details):
+    issue = {'check': check, 'wallet_id': wallet_id}
+    issue.update({key: str(value) if isinstance(value, Decimal) else value for key, value in details.items()})
+    return issue
+
+
+def _check_transfer(row, issues):
+    """بررسی طرف مقابل یک تراکنش انتقال"""
+    expected_type = 'transfer_in' if row['type'] == 'transfer_out' else 'transfer_out'
+    if row['related_transaction_id'] is None or row['related_transaction__type'] != expected_type:
+        issues.append(_issue(
+            'unpaired_transfer', row['wallet_id'],
+            transaction_id=row['transaction_id'], type=row['type']
+        ))
+    elif row['related_transaction__amount'] != row['amount']:
+        issues.append(_issue(
+            'transfer_amount_mismatch', row['wallet_id'],
+            transaction_id=row['transaction_id'],
+            amount=row['amount'], related_amount=row['related_transaction__amount']
+        ))
+
+
+def _finish_wallet(wallet_id, total, balances, issues):
+    actual = balances.pop(wallet_id, None)
+    if actual is not None and actual != total:
+        issues.append(_issue(
+            'balance_mismatch', wallet_id,
+            expected=total, actual=actual, difference=actual - total
+        ))
+
+
+def reconcile_range(start_id, end_id, chunk_size):
+    """
+    تطبیق کیف پول‌های با start_id <= id < end_id
+
+    خروجی: (تعداد کیف پول، تعداد تراکنش، لیست مغایرت‌ها)
+    """
+    wallets = Wallet.objects.filter(id__gte=start_id, id__lt=end_id)
+    balances = dict(wallets.values_list('id', 'balance'))
+    sharded = set(wallets.filter(shard_count__gt=0).values_list('id', flat=True))
+    shard_totals = (
+        WalletBalanceShard.objects.filter(wallet_id__in=sharded)
+        .values('wallet_id').annotate(total=Sum('balance')).values_list('wallet_id', 'total')
+    ) if sharded else []
+    for wallet_id, total in shard_totals:
+        balances[wallet_id] += total or Decimal('0')
+    wallet_count = len(balances)
+
+    rows = (
+        Transaction.objects.filter(wallet_id__gte=start_id, wallet_id__lt=end_id, status='completed')
+        .order_by('wallet_id', 'id')
+        .values(
+            'id', 'transaction_id', 'wallet_id', 'type', 'amount',
+            'balance_before', 'balance_after', 'related_transaction_id',
+            'related_transaction__type', 'related_transaction__amount'
+        )
+        .iterator(chunk_size=chunk_size)
+    )
+
+    issues = []
+    transaction_count = 0
+    current_wallet = None
+    total = Decimal('0')
+    previous_after = None
+    for row in rows:
+        transaction_count += 1
+        if row['wallet_id'] != current_wallet:
+            if current_wallet is not None:
+                _finish_wallet(current_wallet, total, balances, issues)
+            current_wallet = row['wallet_id']
+            total = Decimal('0')
+            previous_after = None
+
+        if row['type'] in CREDIT_TYPES:
+            total += row['amount']
+        elif row['type'] in DEBIT_TYPES:
+            total -= row['amount']
+
+        # واریز روی شارد بدون قفل ردیف اصلی و بدون موجودی کل (NULL) ثبت می‌شود، پس
+        # زنجیره کیف پول‌های شارد‌شده و تراکنش‌های مجاور چنین واریزی بررسی نمی‌شود
+        if previous_after is not None and row['balance_before'] is not None \
+                and row['wallet_id'] not in sharded and row['balance_before'] != previous_after:
+            issues.append(_issue(
+                'chain_gap', row['wallet_id'],
+                transaction_id=row['transaction_id'],
+                balance_before=row['balance_before'], previous_balance_after=previous_after
+            ))
+        previous_after = row['balance_after']
+
+        if row['type'] in ('transfer_out', 'transfer_in'):
+            _check_transfer(row, issues)
+
+    if current_wallet is not None:
+        _finish_wallet(current_wallet, total, balances, issues)
+    # کیف پول‌های بدون تراکنش باید موجودی صفر داشته باشند
+    for wallet_id in list(balances):
+        _finish_wallet(wallet_id, Decimal('0'), balances, issues)
+
+    return wallet_count, transaction_count, issues
+
+
+class Command(BaseCommand):
+    help = 'Reconcile wallet balances, transfer pairs and balance chains against the transaction ledger'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1,
+            help='Number of worker processes (1 runs in-process)'
+        )
+        parser.add_argument(
+            '--partition-size', type=int, default=10000,
+            help='Number of wallet ids per partition'
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=5000,
+            help='Rows fetched per cursor round trip'
+        )
+        parser.add_argument(
+            '--output', default='-',
+            help='Path of the NDJSON discrepancy report ("-" for stdout)'
+        )
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        partition_size = options['partition_size']
+        chunk_size = options['chunk_size']
+        if workers < 1 or partition_size < 1 or chunk_size < 1:
+            raise CommandError('--workers, --partition-size and --chunk-size must be positive')
+
+        bounds = Wallet.objects.aggregate(first=Min('id'), last=Max('id'))
+        partitions = []
+        if bounds['first'] is not None:
+            partitions = [
+                (start, start + partition_size, chunk_size)
+                for start in range(bounds['first'], bounds['last'] + 1, partition_size)
+            ]
+
+        started = time.monotonic()
+        report = sys.stdout if options['output'] == '-' else open(options['output'], 'w', encoding='utf-8')
+        summary = {'wallets': 0, 'transactions': 0, 'discrepancies': 0, 'by_check': {}}
+        try:
+            if workers == 1:
+                results = (reconcile_range(*partition) for partition in partitions)
+                self._collect(results, report, summary)
+            else:
+                _close_connections()
+                with ProcessPoolExecutor(max_workers=workers, initializer=_close_connections) as pool:
+                    results = pool.map(reconcile_range, *zip(*partitions)) if partitions else []
+                    self._collect(results, report, summary)
+        finally:
+            if report is not sys.stdout:
+                report.close()
+
+        summary['partitions'] = len(partitions)
+        summary['elapsed_seconds'] = round(time.monotonic() - started, 3)
+        self.stderr.write(json.dumps(summary, ensure_ascii=False))
+        if summary['discrepancies']:
+            raise CommandError(f"{summary['discrepancies']} ledger discrepancies found")
+
+    def _collect(self, results, report, summary):
+        for wallet_count, transaction_count, issues in results:
+            summary['wallets'] += wallet_count
+            summary['transactions'] += transaction_count
+            for issue in issues:
+                report.write(json.dumps(issue, ensure_ascii=False) + '\n')
+                summary['discrepancies'] += 1
+                summary['by_check'][issue['check']] = summary['by_check'].get(issue['check'], 0) + 1
+            report.flush()
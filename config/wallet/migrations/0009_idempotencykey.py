@@ -0,0 +1,43 @@
+# Generated by Django 4.2 on 2026-10-16 22:38
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('wallet', '0008_transaction_ip_address_transaction_request_id_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdempotencyKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=255, verbose_name='کلید')),
+                ('request_path', models.CharField(max_length=255, verbose_name='مسیر درخواست')),
+                ('request_hash', models.CharField(max_length=64, verbose_name='Hash درخواست')),
+                ('response_status', models.PositiveSmallIntegerField(verbose_name='کد وضعیت پاسخ')),
+                ('response_body', models.JSONField(blank=True, default=dict, verbose_name='بدنه پاسخ')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='تاریخ ایجاد')),
+                ('expires_at', models.DateTimeField(verbose_name='تاریخ انقضا')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='idempotency_keys', to=settings.AUTH_USER_MODEL, verbose_name='کاربر')),
+            ],
+            options={
+                'verbose_name': 'کلید Idempotency',
+                'verbose_name_plural': 'کلیدهای Idempotency',
+                'db_table': 'idempotency_keys',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='idempotencykey',
+            index=models.Index(fields=['expires_at'], name='idempotency_expires_6c9d28_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='idempotencykey',
+            unique_together={('user', 'key')},
+        ),
+    ]
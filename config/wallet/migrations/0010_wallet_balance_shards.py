@@ -0,0 +1,36 @@
+# Generated by Django 4.2 on 2026-10-16 22:45
+
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallet', '0009_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='wallet',
+            name='shard_count',
+            field=models.PositiveSmallIntegerField(default=0, help_text='0 یعنی بدون شارد؛ برای کیف پول\u200cهای پردریافت (راننده/فروشگاه) فعال می\u200cشود', verbose_name='تعداد شارد موجودی ورودی'),
+        ),
+        migrations.CreateModel(
+            name='WalletBalanceShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard_index', models.PositiveSmallIntegerField(verbose_name='شماره شارد')),
+                ('balance', models.DecimalField(decimal_places=2, default=0, max_digits=15, validators=[django.core.validators.MinValueValidator(0)], verbose_name='موجودی')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='تاریخ به\u200cروزرسانی')),
+                ('wallet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='balance_shards', to='wallet.wallet', verbose_name='کیف پول')),
+            ],
+            options={
+                'verbose_name': 'شارد موجودی',
+                'verbose_name_plural': 'شاردهای موجودی',
+                'db_table': 'wallet_balance_shards',
+                'unique_together': {('wallet', 'shard_index')},
+            },
+        ),
+    ]
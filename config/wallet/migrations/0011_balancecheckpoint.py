@@ -0,0 +1,34 @@
+# Generated by Django 4.2 on 2026-10-16 22:47
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallet', '0010_wallet_balance_shards'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BalanceCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('as_of', models.DateTimeField(verbose_name='زمان ثبت')),
+                ('balance', models.DecimalField(decimal_places=2, max_digits=15, verbose_name='موجودی')),
+                ('last_transaction_id', models.BigIntegerField(default=0, verbose_name='شناسه آخرین تراکنش اعمال\u200cشده')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='تاریخ ایجاد')),
+                ('wallet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='balance_checkpoints', to='wallet.wallet', verbose_name='کیف پول')),
+            ],
+            options={
+                'verbose_name': 'نقطه ثبت موجودی',
+                'verbose_name_plural': 'نقاط ثبت موجودی',
+                'db_table': 'balance_checkpoints',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='balancecheckpoint',
+            index=models.Index(fields=['wallet', '-as_of'], name='balance_che_wallet__428071_idx'),
+        ),
+    ]
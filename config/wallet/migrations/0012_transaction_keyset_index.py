@@ -0,0 +1,21 @@
+# Generated by Django 4.2 on 2026-10-16 23:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallet', '0011_balancecheckpoint'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='transaction',
+            name='transaction_wallet__efd4a5_idx',
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['wallet', '-created_at', '-id'], name='transaction_wallet__72eec8_idx'),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 4.2 on 2026-10-16 23:18
+
+from django.db import migrations, models
+from django.db.models import Count, Sum, Value
+from django.db.models.functions import Coalesce, TruncDate
+import django.db.models.deletion
+
+
+def backfill_daily_stats(apps, schema_editor):
+    Transaction = apps.get_model('wallet', 'Transaction')
+    WalletDailyStat = apps.get_model('wallet', 'WalletDailyStat')
+    rows = (
+        Transaction.objects.order_by()
+        .annotate(day=TruncDate('created_at'), method=Coalesce('transfer_method', Value('')))
+        .values('wallet_id', 'day', 'type', 'method')
+        .annotate(count=Count('id'), amount=Sum('amount'))
+    )
+    WalletDailyStat.objects.bulk_create(
+        (
+            WalletDailyStat(
+                wallet_id=row['wallet_id'], day=row['day'], type=row['type'],
+                transfer_method=row['method'], count=row['count'], amount=row['amount']
+            )
+            for row in rows.iterator()
+        ),
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallet', '0012_transaction_keyset_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WalletDailyStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='روز')),
+                ('type', models.CharField(choices=[('charge', 'شارژ'), ('debit', 'برداشت'), ('transfer_in', 'دریافت انتقال'), ('transfer_out', 'ارسال انتقال'), ('refund', 'بازگشت وجه')], max_length=20, verbose_name='نوع تراکنش')),
+                ('transfer_method', models.CharField(blank=True, default='', max_length=30, verbose_name='روش انتقال')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='تعداد')),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=18, verbose_name='مجموع مبلغ')),
+                ('wallet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='wallet.wallet', verbose_name='کیف پول')),
+            ],
+            options={
+                'verbose_name': 'آمار روزانه کیف پول',
+                'verbose_name_plural': 'آمار روزانه کیف پول\u200cها',
+                'db_table': 'wallet_daily_stats',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='walletdailystat',
+            constraint=models.UniqueConstraint(fields=('wallet', 'day', 'type', 'transfer_method'), name='wallet_daily_stats_unique'),
+        ),
+        migrations.RunPython(backfill_daily_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2 on 2026-10-16 23:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallet', '0013_walletdailystat'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='transaction',
+            name='balance_after',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=15, null=True, verbose_name='موجودی بعد'),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='balance_before',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=15, null=True, verbose_name='موجودی قبل'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2 on 2026-10-16 23:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallet', '0014_transaction_nullable_balances'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WalletCommand',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('command_id', models.CharField(max_length=64, unique=True, verbose_name='شناسه فرمان')),
+                ('command', models.CharField(max_length=20, verbose_name='نوع فرمان')),
+                ('transaction_ids', models.JSONField(blank=True, default=list, verbose_name='شناسه تراکنش\u200cها')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='تاریخ ایجاد')),
+            ],
+            options={
+                'verbose_name': 'فرمان کیف پول',
+                'verbose_name_plural': 'فرمان\u200cهای کیف پول',
+                'db_table': 'wallet_commands',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='walletcommand',
+            index=models.Index(fields=['created_at'], name='wallet_comm_created_d2cb61_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2 on 2026-10-16 23:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallet', '0015_walletcommand'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='walletqrcode',
+            name='is_static',
+            field=models.BooleanField(default=False, verbose_name='QR ثابت'),
+        ),
+        migrations.AlterField(
+            model_name='walletqrcode',
+            name='expires_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='تاریخ انقضا'),
+        ),
+    ]
@@ -1,9 +1,8 @@
-from django.db import models
-from django.db import transaction as db_transaction
+from django.db import connection, models
 from django.core.validators import MinValueValidator
 from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
-from django.db.models import F, Q
+from django.db.models import Q
 import uuid
 import time
 from datetime import timedelta
@@ -50,6 +49,11 @@ class Wallet(models.Model):
         blank=True,
         verbose_name=_('آدرس کیف پول (24 رقمی)')
     )
+    shard_count = models.PositiveSmallIntegerField(
+        default=0,
+        verbose_name=_('تعداد شارد موجودی ورودی'),
+        help_text=_('0 یعنی بدون شارد؛ برای کیف پول‌های پردریافت (راننده/فروشگاه) فعال می‌شود')
+    )
     created_at = models.DateTimeField(auto_now_add=True, verbose_name=_('تاریخ ایجاد'))
     updated_at = models.DateTimeField(auto_now=True, verbose_name=_('تاریخ به‌روزرسانی'))
     
@@ -68,6 +72,11 @@ class Wallet(models.Model):
     @classmethod
     def generate_wallet_address(cls):
         """تولید آدرس 24 رقمی کیف پول (PAYA + 20 رقم)"""
+        from .id_pool import allocate
+        wallet_address = allocate('wallet_address')
+        if wallet_address:
+            return wallet_address
+
         prefix = "PAYA"
         # تولید 20 رقم تصادفی
         random_part = uuid.uuid4().hex[:20].upper()
@@ -85,13 +94,59 @@ class Wallet(models.Model):
         
         return wallet_address
     
+    @property
+    def total_balance(self):
+        """
+        موجودی کل کیف پول (موجودی اصلی + مجموع شاردهای ورودی)
+
+        برای کیف پول‌های بدون شارد همان balance است و کوئری اضافه ندارد.
+        """
+        if not self.shard_count:
+            return self.balance
+        shards_total = self.balance_shards.aggregate(total=models.Sum('balance'))['total']
+        return self.balance + (shards_total or 0)
+
     def can_transfer(self, amount):
         """بررسی امکان انتقال مبلغ"""
-        return self.status == 'active' and self.balance >= amount
+        return self.status == 'active' and self.total_balance >= amount
     
     def get_formatted_balance(self):
         """دریافت موجودی فرمت شده"""
-        return f"{self.balance:,.0f} تومان"
+        return f"{self.total_balance:,.0f} تومان"
+
+
+class WalletBalanceShard(models.Model):
+    """
+    شارد موجودی ورودی کیف پول‌های پردریافت
+
+    واریزهای ورودی به جای ردیف wallets روی یکی از K شارد ثبت می‌شوند تا
+    انتقال‌های هم‌زمان به یک کیف پول پشت یک ردیف صف نکشند. برداشت‌ها و تسک
+    merge_wallet_shards_task موجودی شاردها را به موجودی اصلی منتقل می‌کنند.
+    """
+    wallet = models.ForeignKey(
+        Wallet,
+        on_delete=models.CASCADE,
+        related_name='balance_shards',
+        verbose_name=_('کیف پول')
+    )
+    shard_index = models.PositiveSmallIntegerField(verbose_name=_('شماره شارد'))
+    balance = models.DecimalField(
+        max_digits=15,
+        decimal_places=2,
+        default=0,
+        validators=[MinValueValidator(0)],
+        verbose_name=_('موجودی')
+    )
+    updated_at = models.DateTimeField(auto_now=True, verbose_name=_('تاریخ به‌روزرسانی'))
+
+    class Meta:
+        db_table = 'wallet_balance_shards'
+        unique_together = ['wallet', 'shard_index']
+        verbose_name = _('شارد موجودی')
+        verbose_name_plural = _('شاردهای موجودی')
+
+    def __str__(self):
+        return f"Wallet {self.wallet_id} shard {self.shard_index} - {self.balance}"
 
 
 class Transaction(models.Model):
@@ -149,14 +204,19 @@ class Transaction(models.Model):
         validators=[MinValueValidator(0)],
         verbose_name=_('مبلغ')
     )
+    # برای واریز روی شارد کیف پول‌های پردریافت خالی است (wallet.ledger.BalanceChange)
     balance_before = models.DecimalField(
         max_digits=15, 
         decimal_places=2,
+        null=True,
+        blank=True,
         verbose_name=_('موجودی قبل')
     )
     balance_after = models.DecimalField(
         max_digits=15, 
         decimal_places=2,
+        null=True,
+        blank=True,
         verbose_name=_('موجودی بعد')
     )
     description = models.TextField(
@@ -236,7 +296,7 @@ class Transaction(models.Model):
         verbose_name = _('تراکنش')
         verbose_name_plural = _('تراکنش‌ها')
         indexes = [
-            models.Index(fields=['wallet', '-created_at']),
+            models.Index(fields=['wallet', '-created_at', '-id']),
             models.Index(fields=['transaction_id']),
             models.Index(fields=['status']),
             models.Index(fields=['type']),
@@ -255,6 +315,33 @@ class Transaction(models.Model):
         """تولید شناسه یکتا برای تراکنش"""
         return f"txn_{uuid.uuid4().hex[:12]}"
 
+    @classmethod
+    def reserve_ids(cls, count):
+        """
+        رزرو کلید اصلی (id) برای count تراکنش قبل از درج
+
+        با داشتن idها می‌توان دو طرف انتقال را همراه با related_transaction در یک
+        bulk_create ثبت کرد. در SQLite فقط داخل یک تراکنش نوشتنی (که قفل نوشتن را
+        گرفته) امن است. برای پایگاه داده‌های دیگر None برمی‌گرداند.
+        """
+        table = cls._meta.db_table
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute(
+                    "SELECT nextval(pg_get_serial_sequence(%s, 'id')) FROM generate_series(1, %s)",
+                    [table, count]
+                )
+                return [row[0] for row in cursor.fetchall()]
+            if connection.vendor == 'sqlite':
+                cursor.execute(
+                    "SELECT MAX(seq) FROM (SELECT seq FROM sqlite_sequence WHERE name = %s "
+                    f"UNION ALL SELECT MAX(id) FROM {connection.ops.quote_name(table)})",
+                    [table]
+                )
+                last_id = cursor.fetchone()[0] or 0
+                return list(range(last_id + 1, last_id + count + 1))
+        return None
+
 
 class WalletLimit(models.Model):
     """مدل برای ذخیره محدودیت‌های روزانه کاربر"""
@@ -292,6 +379,95 @@ class WalletLimit(models.Model):
         return f"{self.wallet.user.phone} - {self.date}"
 
 
+
+class BalanceCheckpoint(models.Model):
+    """
+    نقطه ثبت موجودی کیف پول
+
+    موجودی کیف پول پس از اعمال همه تراکنش‌های تکمیل‌شده با created_at <= as_of.
+    last_transaction_id آخرین تراکنش پوشش‌داده‌شده به ترتیب (created_at, id) است.
+    موجودی در هر لحظه از نزدیک‌ترین checkpoint قبلی و تراکنش‌های پس از آن
+    محاسبه می‌شود (wallet.checkpoints.balance_at).
+    """
+    wallet = models.ForeignKey(
+        Wallet,
+        on_delete=models.CASCADE,
+        related_name='balance_checkpoints',
+        verbose_name=_('کیف پول')
+    )
+    as_of = models.DateTimeField(verbose_name=_('زمان ثبت'))
+    balance = models.DecimalField(
+        max_digits=15,
+        decimal_places=2,
+        verbose_name=_('موجودی')
+    )
+    last_transaction_id = models.BigIntegerField(
+        default=0,
+        verbose_name=_('شناسه آخرین تراکنش اعمال‌شده')
+    )
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name=_('تاریخ ایجاد'))
+
+    class Meta:
+        db_table = 'balance_checkpoints'
+        verbose_name = _('نقطه ثبت موجودی')
+        verbose_name_plural = _('نقاط ثبت موجودی')
+        indexes = [
+            models.Index(fields=['wallet', '-as_of']),
+        ]
+
+    def __str__(self):
+        return f"Wallet {self.wallet_id} @ {self.as_of} - {self.balance}"
+
+
+class WalletDailyStat(models.Model):
+    """
+    جمع روزانه تراکنش‌های کیف پول به تفکیک نوع و روش انتقال
+
+    در همان تراکنش پایگاه داده‌ای که تراکنش‌ها درج می‌شوند با یک upsert افزایشی
+    به‌روز می‌شود (wallet.daily_stats.add_transactions) و خلاصه و نمودار گزارش
+    از این جدول خوانده می‌شود.
+    """
+    wallet = models.ForeignKey(
+        Wallet,
+        on_delete=models.CASCADE,
+        related_name='daily_stats',
+        verbose_name=_('کیف پول')
+    )
+    day = models.DateField(verbose_name=_('روز'))
+    type = models.CharField(
+        max_length=20,
+        choices=Transaction.TYPE_CHOICES,
+        verbose_name=_('نوع تراکنش')
+    )
+    transfer_method = models.CharField(
+        max_length=30,
+        blank=True,
+        default='',
+        verbose_name=_('روش انتقال')
+    )
+    count = models.PositiveIntegerField(default=0, verbose_name=_('تعداد'))
+    amount = models.DecimalField(
+        max_digits=18,
+        decimal_places=2,
+        default=0,
+        verbose_name=_('مجموع مبلغ')
+    )
+
+    class Meta:
+        db_table = 'wallet_daily_stats'
+        verbose_name = _('آمار روزانه کیف پول')
+        verbose_name_plural = _('آمار روزانه کیف پول‌ها')
+        constraints = [
+            models.UniqueConstraint(
+                fields=['wallet', 'day', 'type', 'transfer_method'],
+                name='wallet_daily_stats_unique'
+            ),
+        ]
+
+    def __str__(self):
+        return f"Wallet {self.wallet_id} @ {self.day} - {self.type}: {self.count}"
+
+
 class PaymentRequest(models.Model):
     """مدل برای ذخیره درخواست‌های پرداخت برای شارژ کیف پول"""
     STATUS_CHOICES = [
@@ -399,7 +575,9 @@ class WalletQRCode(models.Model):
     description = models.CharField(max_length=255, blank=True, verbose_name=_('توضیحات'))
     metadata = models.JSONField(default=dict, blank=True, verbose_name=_('اطلاعات اضافی'))
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='active', verbose_name=_('وضعیت'))
-    expires_at = models.DateTimeField(verbose_name=_('تاریخ انقضا'))
+    # QR ثابت (چاپی) چندبارمصرف است و به‌طور پیش‌فرض منقضی نمی‌شود (expires_at خالی)
+    is_static = models.BooleanField(default=False, verbose_name=_('QR ثابت'))
+    expires_at = models.DateTimeField(null=True, blank=True, verbose_name=_('تاریخ انقضا'))
     used_at = models.DateTimeField(null=True, blank=True, verbose_name=_('تاریخ استفاده'))
     created_at = models.DateTimeField(auto_now_add=True, verbose_name=_('تاریخ ایجاد'))
     updated_at = models.DateTimeField(auto_now=True, verbose_name=_('تاریخ به‌روزرسانی'))
@@ -421,6 +599,12 @@ class WalletQRCode(models.Model):
 
     @staticmethod
     def generate_unique_payload(prefix='qr_', length=12):
+        if (prefix, length) == ('qr_', 12):
+            from .id_pool import allocate
+            payload = allocate('qr_payload')
+            if payload:
+                return payload
+
         base = prefix + uuid.uuid4().hex[:length].upper()
         counter = 0
         payload = base
@@ -444,8 +628,62 @@ class WalletQRCode(models.Model):
         )
         return qr
 
+    @classmethod
+    def create_batch(cls, wallet, count, amount=None, description='', expires_in=None, metadata=None):
+        """
+        ایجاد count QR ثابت (چندبارمصرف) با یک bulk_create
+
+        بدون expires_in کدها منقضی نمی‌شوند.
+
+        payloadها تا حد امکان از استخر شناسه (wallet.id_pool) برداشته می‌شوند؛
+        برای بقیه تکراری نبودن به‌جای یک exists() برای هر QR با یک query در هر
+        دسته 500تایی بررسی می‌شود.
+        """
+        from .id_pool import allocate_many
+        payloads = set(allocate_many('qr_payload', count))
+        while len(payloads) < count:
+            candidates = {
+                'qr_' + uuid.uuid4().hex[:12].upper() for _ in range(count - len(payloads))
+            } - payloads
+            candidates = sorted(candidates)
+            for start in range(0, len(candidates), 500):
+                chunk = candidates[start:start + 500]
+                taken = set(cls.objects.filter(qr_payload__in=chunk).values_list('qr_payload', flat=True))
+                payloads.update(payload for payload in chunk if payload not in taken)
+        expires_at = timezone.now() + timedelta(seconds=expires_in) if expires_in else None
+        return cls.objects.bulk_create([
+            cls(
+                qr_payload=payload,
+                wallet=wallet,
+                amount=amount,
+                description=description or '',
+                metadata=dict(metadata or {}),
+                is_static=True,
+                expires_at=expires_at,
+            )
+            for payload in sorted(payloads)
+        ], batch_size=500)
+
     def is_expired(self):
-        return timezone.now() >= self.expires_at
+        return self.expires_at is not None and timezone.now() >= self.expires_at
+
+    @classmethod
+    def claim(cls, qr_payload, usage_metadata=None):
+        """
+        استفاده از QR فعال و منقضی‌نشده با قفل ردیف (بدون اتکا به cache)
+
+        باید داخل تراکنش انتقال صدا زده شود. QR ثابت فعال می‌ماند و فقط قابل
+        پرداخت بودن آن بررسی می‌شود.
+        خروجی: False اگر QR دیگر قابل پرداخت نباشد
+        """
+        qr = cls.objects.select_for_update().filter(qr_payload=qr_payload, status='active').filter(
+            Q(expires_at__isnull=True) | Q(expires_at__gt=timezone.now())
+        ).first()
+        if qr is None:
+            return False
+        if not qr.is_static:
+            qr.mark_used(usage_metadata)
+        return True
 
     def mark_used(self, usage_metadata=None):
         usage_metadata = usage_metadata or {}
@@ -456,10 +694,17 @@ class WalletQRCode(models.Model):
             merged.update(usage_metadata)
             self.usage_metadata = merged
         self.save(update_fields=['status', 'used_at', 'usage_metadata', 'updated_at'])
+        self.invalidate_lookup()
 
     def cancel(self):
         self.status = 'cancelled'
         self.save(update_fields=['status', 'updated_at'])
+        self.invalidate_lookup()
+
+    def invalidate_lookup(self):
+        """حذف projection cache‌شده (wallet.lookup_cache) پس از تغییر وضعیت"""
+        from .lookup_cache import invalidate_qr
+        invalidate_qr(self.qr_payload)
 
 
 class PaymentLink(models.Model):
@@ -527,6 +772,12 @@ class PaymentLink(models.Model):
         import string
         
         # استفاده از حروف و اعداد برای تولید شناسه
+        if (prefix, length) == ('pl_', 10):
+            from .id_pool import allocate
+            link_id = allocate('link_id')
+            if link_id:
+                return link_id
+
         chars = string.ascii_letters + string.digits  # حروف کوچک و بزرگ + اعداد
         random_part = ''.join(secrets.choice(chars) for _ in range(length))
         base = prefix + random_part
@@ -560,6 +811,21 @@ class PaymentLink(models.Model):
     def is_expired(self):
         return timezone.now() >= self.expires_at
     
+    @classmethod
+    def claim(cls, link_id, used_by_wallet, usage_metadata=None):
+        """
+        استفاده از لینک فعال و منقضی‌نشده با قفل ردیف (بدون اتکا به cache)
+
+        باید داخل تراکنش انتقال صدا زده شود.
+        خروجی: لینک مصرف‌شده یا None اگر هم‌زمان استفاده، لغو یا منقضی شده باشد
+        """
+        link = cls.objects.select_for_update().filter(
+            link_id=link_id, status='active', expires_at__gt=timezone.now()
+        ).first()
+        if link is not None:
+            link.mark_used(used_by_wallet, usage_metadata)
+        return link
+
     def mark_used(self, used_by_wallet, usage_metadata=None):
         """علامت‌گذاری لینک به عنوان استفاده شده"""
         usage_metadata = usage_metadata or {}
@@ -571,10 +837,17 @@ class PaymentLink(models.Model):
             merged.update(usage_metadata)
             self.usage_metadata = merged
         self.save(update_fields=['status', 'used_at', 'used_by_wallet', 'usage_metadata', 'updated_at'])
+        self.invalidate_lookup()
     
     def cancel(self):
         self.status = 'cancelled'
         self.save(update_fields=['status', 'updated_at'])
+        self.invalidate_lookup()
+    
+    def invalidate_lookup(self):
+        """حذف projection cache‌شده (wallet.lookup_cache) پس از تغییر وضعیت"""
+        from .lookup_cache import invalidate_link
+        invalidate_link(self.link_id)
     
     def get_payment_url(self, base_url=None):
         """دریافت URL کامل لینک پرداخت"""
@@ -621,6 +894,12 @@ class SpecialCode(models.Model):
     @staticmethod
     def generate_unique_code(length=5):
         """تولید کد اختصاصی یکتا (فقط اعداد)"""
+        from .id_pool import SPECIAL_CODE_LENGTH, allocate, claim_special_code
+        if length == SPECIAL_CODE_LENGTH:
+            code = allocate('special_code')
+            if code:
+                return code
+
         import random
         code = ''.join([str(random.randint(0, 9)) for _ in range(length)])
         
@@ -632,6 +911,8 @@ class SpecialCode(models.Model):
             if counter > 1000:  # جلوگیری از حلقه بی‌نهایت
                 raise Exception("Unable to generate unique special code")
         
+        # کد خارج از استخر تولید شده؛ بیت آن روشن می‌شود تا پرکننده آن را دوباره ندهد
+        claim_special_code(code)
         return code
     
     @classmethod
@@ -639,14 +920,78 @@ class SpecialCode(models.Model):
         """ایجاد کد اختصاصی برای کاربر"""
         if code is None:
             code = cls.generate_unique_code()
+        else:
+            from .id_pool import claim_special_code
+            claim_special_code(code)
         
         # بررسی اینکه کاربر قبلاً کد داشته باشد
         if hasattr(user, 'special_code'):
             existing = user.special_code
+            previous_code = existing.code
             existing.code = code
             existing.is_active = True
             existing.save(update_fields=['code', 'is_active', 'updated_at'])
+            if previous_code != code:
+                from .id_pool import release_special_code
+                release_special_code(previous_code)
             return existing
         
         return cls.objects.create(user=user, code=code)
 
+
+
+class IdempotencyKey(models.Model):
+    """
+    مدل برای ذخیره پاسخ درخواست‌های دارای هدر Idempotency-Key
+    (لایه پایدار؛ لایه داغ در Redis نگه داشته می‌شود)
+    """
+    key = models.CharField(max_length=255, verbose_name=_('کلید'))
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='idempotency_keys',
+        verbose_name=_('کاربر')
+    )
+    request_path = models.CharField(max_length=255, verbose_name=_('مسیر درخواست'))
+    request_hash = models.CharField(max_length=64, verbose_name=_('Hash درخواست'))
+    response_status = models.PositiveSmallIntegerField(verbose_name=_('کد وضعیت پاسخ'))
+    response_body = models.JSONField(default=dict, blank=True, verbose_name=_('بدنه پاسخ'))
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name=_('تاریخ ایجاد'))
+    expires_at = models.DateTimeField(verbose_name=_('تاریخ انقضا'))
+
+    class Meta:
+        db_table = 'idempotency_keys'
+        verbose_name = _('کلید Idempotency')
+        verbose_name_plural = _('کلیدهای Idempotency')
+        unique_together = ['user', 'key']
+        indexes = [
+            models.Index(fields=['expires_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.key} - {self.request_path} - {self.response_status}"
+
+
+class WalletCommand(models.Model):
+    """
+    فرمان‌های کیف پول اجراشده در حالت صف‌محور (wallet.command_queue)
+
+    ردیف در همان تراکنش پایگاه داده‌ای ثبت می‌شود که پول را جابه‌جا می‌کند؛
+    تحویل دوباره همان فرمان (acks_late، تکرار درخواست پس از timeout) به‌جای
+    اجرای مجدد، شناسه تراکنش‌های ثبت‌شده را برمی‌گرداند.
+    """
+    command_id = models.CharField(max_length=64, unique=True, verbose_name=_('شناسه فرمان'))
+    command = models.CharField(max_length=20, verbose_name=_('نوع فرمان'))
+    transaction_ids = models.JSONField(default=list, blank=True, verbose_name=_('شناسه تراکنش‌ها'))
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name=_('تاریخ ایجاد'))
+
+    class Meta:
+        db_table = 'wallet_commands'
+        verbose_name = _('فرمان کیف پول')
+        verbose_name_plural = _('فرمان‌های کیف پول')
+        indexes = [
+            models.Index(fields=['created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.command} - {self.command_id}"
@@ -5,9 +5,9 @@ from rest_framework import status, views
 from rest_framework.response import Response
 from django.db import transaction as db_transaction
 
-from .models import PaymentRequest, Wallet
+from .models import PaymentRequest
 from .payment_gateway import PaymentGatewayService
-from .utils import charge_wallet
+from .command_queue import WalletCommandPending, charge_wallet, get_command_id
 
 
 class PaymentCallbackView(views.APIView):
@@ -123,7 +123,8 @@ class PaymentCallbackView(views.APIView):
                     amount=payment_request.amount,
                     description=payment_request.description or 'شارژ کیف پول از درگاه',
                     payment_method=payment_request.gateway,
-                    payment_id=payment_request.request_id
+                    payment_id=payment_request.request_id,
+                    command_id=get_command_id(reference=f"payment:{payment_request.request_id}")
                 )
                 
                 # به‌روزرسانی درخواست پرداخت
@@ -146,6 +147,12 @@ class PaymentCallbackView(views.APIView):
                 'message': 'Payment completed successfully'
             }, status=status.HTTP_200_OK)
             
+        except WalletCommandPending as e:
+            # درخواست pending می‌ماند؛ callback تکراری همان فرمان را پیدا می‌کند و دوباره شارژ نمی‌کند
+            return Response(
+                {'detail': str(e), 'command_id': e.command_id},
+                status=status.HTTP_202_ACCEPTED
+            )
         except Exception as e:
             payment_request.status = 'failed'
             updated_metadata = payment_request.metadata or {}
@@ -0,0 +1,106 @@
+"""
+تولید دسته‌ای QR ثابت برای چاپ (پذیرندگان و ناوگان)
+
+ردیف‌های WalletQRCode (QR ثابت چندبارمصرف، به‌طور پیش‌فرض بدون انقضا) با یک
+bulk_create ایجاد و تصاویرشان رندر و به‌عنوان فایل‌های از پیش رندرشده ذخیره
+می‌شوند (qr_render.prerender)، بنابراین qr/image برای این QRها دیگر رندر نمی‌کند.
+درخواست API (حداکثر QR_BATCH_MAX_COUNT QR) در همان process رندر می‌کند؛ فقط
+دستور generate_qr_batch برای دسته‌های بزرگ process pool می‌سازد. خروجی یک PDF چندصفحه‌ای
+(برگه‌های A4 با 12 QR در هر صفحه) یا یک ZIP از فایل‌های PNG به‌همراه index.csv است.
+
+اندازه رندر در metadata هر QR (asset_size) ثبت می‌شود تا با حذف ردیف، فایل از پیش
+رندرشده آن هم پیدا و حذف شود (wallet.signals).
+"""
+import csv
+import io
+import uuid
+import zipfile
+
+from PIL import Image, ImageDraw
+
+from . import qr_render
+from .models import WalletQRCode
+
+OUTPUT_FORMATS = {
+    'pdf': 'application/pdf',
+    'zip': 'application/zip',
+}
+
+# برگه A4 با 150 dpi
+PAGE_SIZE = (1240, 1754)
+PAGE_MARGIN = 60
+GRID_COLUMNS = 3
+GRID_ROWS = 4
+CAPTION_HEIGHT = 40
+
+
+def _caption(qr):
+    amount = f" - {qr.amount:,.0f}" if qr.amount is not None else ''
+    return f"{qr.qr_payload}{amount}"
+
+
+def build_pdf(qr_codes, images):
+    """برگه‌های A4 با شبکه GRID_COLUMNS×GRID_ROWS از QRها و شناسه زیر هر کدام"""
+    cell_width = (PAGE_SIZE[0] - 2 * PAGE_MARGIN) // GRID_COLUMNS
+    cell_height = (PAGE_SIZE[1] - 2 * PAGE_MARGIN) // GRID_ROWS
+    qr_side = min(cell_width, cell_height - CAPTION_HEIGHT) - 20
+    per_page = GRID_COLUMNS * GRID_ROWS
+
+    pages = []
+    for start in range(0, len(qr_codes), per_page):
+        page = Image.new('RGB', PAGE_SIZE, 'white')
+        draw = ImageDraw.Draw(page)
+        for index, (qr, data) in enumerate(zip(qr_codes[start:start + per_page], images[start:start + per_page])):
+            row, column = divmod(index, GRID_COLUMNS)
+            left = PAGE_MARGIN + column * cell_width
+            top = PAGE_MARGIN + row * cell_height
+            image = Image.open(io.BytesIO(data)).convert('RGB').resize((qr_side, qr_side), Image.NEAREST)
+            page.paste(image, (left + (cell_width - qr_side) // 2, top))
+            draw.text((left + 10, top + qr_side + 8), _caption(qr), fill='black')
+        pages.append(page)
+
+    buffer = io.BytesIO()
+    pages[0].save(buffer, format='PDF', save_all=True, append_images=pages[1:], resolution=150)
+    return buffer.getvalue()
+
+
+def build_zip(qr_codes, images):
+    """فایل‌های PNG هر QR به‌همراه index.csv (شناسه، محتوا، مبلغ، تاریخ انقضا)"""
+    index = io.StringIO()
+    writer = csv.writer(index)
+    writer.writerow(['qr_payload', 'qr_content', 'amount', 'expires_at'])
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for qr, data in zip(qr_codes, images):
+            # PNG از قبل فشرده است
+            archive.writestr(f"{qr.qr_payload}.png", data, compress_type=zipfile.ZIP_STORED)
+            writer.writerow([
+                qr.qr_payload, qr_render.qr_content(qr.qr_payload),
+                '' if qr.amount is None else qr.amount,
+                '' if qr.expires_at is None else qr.expires_at.isoformat()
+            ])
+        archive.writestr('index.csv', index.getvalue())
+    return buffer.getvalue()
+
+
+def generate_batch(wallet, count, amount=None, description='', expires_in=None, metadata=None,
+                   output_format='pdf', size=None, workers=1):
+    """
+    ایجاد و رندر count QR
+
+    خروجی: (شناسه دسته، لیست WalletQRCode، بایت‌های فایل خروجی)
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unsupported output format: {output_format}")
+    batch_id = uuid.uuid4().hex
+    size = qr_render.clamp_size(size)
+    metadata = dict(metadata or {}, batch_id=batch_id, asset_size=size)
+    qr_codes = WalletQRCode.create_batch(
+        wallet, count, amount=amount, description=description, expires_in=expires_in, metadata=metadata
+    )
+
+    contents = [qr_render.qr_content(qr.qr_payload) for qr in qr_codes]
+    images = [data for _, data in qr_render.prerender(contents, size, workers=workers)]
+
+    build = build_pdf if output_format == 'pdf' else build_zip
+    return batch_id, qr_codes, build(qr_codes, images)
@@ -0,0 +1,174 @@
+"""
+رندر تصویر QR کیف پول با cache محتوا-محور
+
+تصویر فقط به محتوای QR، اندازه و قالب بستگی دارد، بنابراین کلید cache و ETag
+از hash همین ورودی‌ها ساخته می‌شوند و هیچ‌وقت نیاز به ابطال ندارند. یک LRU
+محلی (در حافظه همان process) جلوی cache مشترک (Redis) قرار دارد؛ صفحه
+صندوق‌داری که یک QR را مدام تازه می‌کند فقط یک hit در LRU هزینه دارد و کلاینت
+با If-None-Match حتی همان را هم دریافت نمی‌کند (304).
+
+QRهای دسته‌ای (wallet.qr_batch) از قبل در یک process pool رندر و به‌صورت فایل
+در QR_ASSET_DIR ذخیره می‌شوند و get_png پیش از رندر تازه از این فایل‌ها می‌خواند.
+فایل هر QR با حذف ردیف آن (پاک‌سازی wallet.expiry یا حذف کیف پول) پاک می‌شود.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from itertools import repeat
+
+import qrcode
+from django.conf import settings
+from django.core.cache import cache
+from PIL import Image
+from qrcode.constants import ERROR_CORRECT_M
+
+# با تغییر تنظیمات رندر افزایش یابد تا کلیدها و ETagهای قبلی استفاده نشوند
+RENDER_VERSION = 1
+MIN_SIZE = 128
+MAX_SIZE = 1024
+
+LOCAL_CACHE_SIZE = getattr(settings, 'QR_RENDER_LOCAL_CACHE_SIZE', 256)
+SHARED_CACHE_TTL = getattr(settings, 'QR_RENDER_CACHE_TTL', 24 * 60 * 60)  # ثانیه
+
+
+class _LRUCache:
+    """LRU ساده thread-safe برای بایت‌های تصویر"""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+_local_cache = _LRUCache(LOCAL_CACHE_SIZE)
+
+
+def qr_content(qr_payload):
+    return f"PAYAQR:{qr_payload}"
+
+
+def clamp_size(size):
+    return max(MIN_SIZE, min(size, MAX_SIZE)) if size else None
+
+
+def render_key(content, size=None, image_format='png'):
+    """کلید محتوا-محور تصویر (همان مقدار ETag)"""
+    raw = f"{RENDER_VERSION}|{content}|{size or 0}|{image_format}"
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def etag_for(key):
+    return f'"{key[:40]}"'
+
+
+def render_png(content, size=None):
+    """ساخت تصویر PNG محتوای QR"""
+    qr_factory = qrcode.QRCode(
+        version=None,
+        error_correction=ERROR_CORRECT_M,
+        box_size=10,
+        border=4,
+    )
+    qr_factory.add_data(content)
+    qr_factory.make(fit=True)
+    image = qr_factory.make_image(fill_color="black", back_color="white").convert("RGB")
+
+    if size:
+        image = image.resize((size, size), resample=Image.NEAREST)
+
+    buffer = BytesIO()
+    image.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def asset_path(key):
+    return os.path.join(settings.QR_ASSET_DIR, key[:2], f"{key}.png")
+
+
+def store_asset(key, data):
+    """ذخیره تصویر از پیش رندرشده (نوشتن اتمی با rename)"""
+    path = asset_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'wb') as asset_file:
+        asset_file.write(data)
+    os.replace(temp_path, path)
+
+
+def delete_asset(key):
+    """حذف تصویر از پیش رندرشده؛ نبودن فایل خطا نیست"""
+    try:
+        os.remove(asset_path(key))
+    except FileNotFoundError:
+        pass
+
+
+def load_asset(key):
+    try:
+        with open(asset_path(key), 'rb') as asset_file:
+            return asset_file.read()
+    except FileNotFoundError:
+        return None
+
+
+def get_png(content, size=None):
+    """
+    تصویر PNG از LRU محلی، cache مشترک، فایل از پیش رندرشده یا رندر تازه
+
+    خروجی: (بایت‌های تصویر، کلید محتوا-محور)
+    """
+    key = render_key(content, size)
+    data = _local_cache.get(key)
+    if data is not None:
+        return data, key
+
+    cache_key = f"qr_png:{key}"
+    data = cache.get(cache_key)
+    if data is None:
+        data = load_asset(key)
+        if data is None:
+            data = render_png(content, size)
+        cache.set(cache_key, data, SHARED_CACHE_TTL)
+    _local_cache.set(key, data)
+    return data, key
+
+
+def prerender(contents, size=None, workers=1):
+    """
+    رندر دسته‌ای محتواها (در صورت workers > 1 در process pool) و ذخیره به‌صورت فایل
+
+    خروجی: لیست (کلید، بایت‌های تصویر) به ترتیب contents
+    """
+    if workers > 1 and len(contents) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            images = list(pool.map(render_png, contents, repeat(size), chunksize=16))
+    else:
+        images = [render_png(content, size) for content in contents]
+
+    rendered = []
+    for content, data in zip(contents, images):
+        key = render_key(content, size)
+        store_asset(key, data)
+        rendered.append((key, data))
+    return rendered
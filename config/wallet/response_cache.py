@@ -0,0 +1,143 @@
+"""
+cache پاسخ endpointهای پرتکرار کیف پول (موجودی و گزارش) با ابطال مبتنی بر نسخه
+
+هر کیف پول یک شماره نسخه در cache دارد که پس از commit هر نوشتن در دفتر کل
+(شارژ، برداشت، انتقال) به‌صورت اتمی افزایش می‌یابد. پاسخ‌ها با کلید
+(کیف پول، نسخه، نام endpoint، پارامترهای query) ذخیره می‌شوند، بنابراین پس از
+هر تراکنش پاسخ‌های قبلی خودبه‌خود بی‌استفاده می‌شوند و نیازی به حذف تک‌تک آن‌ها
+نیست.
+
+- ETag: hash بدنه پاسخ؛ درخواست با If-None-Match برابر پاسخ 304 می‌گیرد
+- جلوگیری از stampede: پس از انقضای نرم فقط درخواستی که قفل بازسازی را
+  می‌گیرد پاسخ را دوباره می‌سازد و بقیه تا پایان بازسازی نسخه قبلی را دریافت
+  می‌کنند؛ در cache خالی بقیه کوتاه منتظر نتیجه همان درخواست می‌مانند.
+"""
+import hashlib
+import json
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+
+RESPONSE_CACHE_TTL = getattr(settings, 'WALLET_RESPONSE_CACHE_TTL', 60)  # ثانیه؛ انقضای نرم
+RESPONSE_CACHE_STALE_TTL = getattr(settings, 'WALLET_RESPONSE_CACHE_STALE_TTL', 30)  # ثانیه پس از انقضای نرم
+REBUILD_LOCK_TIMEOUT = 10
+REBUILD_WAIT_TIMEOUT = 2.0
+REBUILD_POLL_INTERVAL = 0.05
+
+
+def _version_key(wallet_id):
+    return f"wallet_cache_version:{wallet_id}"
+
+
+def _response_key(wallet_id, version, name, params):
+    query = json.dumps(sorted(params.lists()), separators=(',', ':'))
+    digest = hashlib.sha256(query.encode('utf-8')).hexdigest()[:32]
+    return f"wallet_resp:{wallet_id}:{version}:{name}:{digest}"
+
+
+def _initial_version():
+    # نسخه جدید پس از حذف کلید نسخه از cache با نسخه‌های قبلی برخورد نمی‌کند
+    return time.time_ns()
+
+
+def get_version(wallet_id):
+    key = _version_key(wallet_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _initial_version(), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(wallet_id):
+    """افزایش اتمی نسخه cache کیف پول"""
+    key = _version_key(wallet_id)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.set(key, _initial_version(), None)
+
+
+def invalidate(wallet_ids):
+    """ابطال پاسخ‌های cache‌شده کیف پول‌ها پس از commit تراکنش جاری"""
+    wallet_ids = sorted(set(wallet_ids))
+    transaction.on_commit(lambda: [bump_version(wallet_id) for wallet_id in wallet_ids])
+
+
+def _make_entry(response, ttl):
+    data = json.loads(json.dumps(response.data, cls=JSONEncoder))
+    body = json.dumps(data, sort_keys=True, separators=(',', ':'))
+    return {
+        'data': data,
+        'etag': '"%s"' % hashlib.sha256(body.encode('utf-8')).hexdigest()[:32],
+        'expires_at': time.time() + ttl,
+    }
+
+
+def _wait_for_entry(key):
+    deadline = time.monotonic() + REBUILD_WAIT_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(REBUILD_POLL_INTERVAL)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry
+    return None
+
+
+def _rebuild(key, stale, build, ttl):
+    """
+    بازسازی پاسخ فقط توسط یک درخواست
+
+    خروجی: (entry، response)؛ entry برای پاسخ‌های غیر 200 برابر None است
+    """
+    lock_key = f"{key}:lock"
+    token = uuid.uuid4().hex
+    if not cache.add(lock_key, token, REBUILD_LOCK_TIMEOUT):
+        if stale is not None:
+            return stale, None
+        entry = _wait_for_entry(key)
+        if entry is not None:
+            return entry, None
+        # بازسازی درخواست دیگر طول کشیده است: ساخت پاسخ بدون ذخیره
+        response = build()
+        return (_make_entry(response, ttl) if response.status_code == status.HTTP_200_OK else None), response
+    try:
+        response = build()
+        if response.status_code != status.HTTP_200_OK:
+            return None, response
+        entry = _make_entry(response, ttl)
+        cache.set(key, entry, ttl + RESPONSE_CACHE_STALE_TTL)
+        return entry, response
+    finally:
+        if cache.get(lock_key) == token:
+            cache.delete(lock_key)
+
+
+def cached_response(request, wallet_id, name, build, ttl=RESPONSE_CACHE_TTL):
+    """
+    پاسخ cache‌شده endpoint کیف پول
+
+    build: تابع بدون آرگومان که Response view را می‌سازد (فقط پاسخ‌های 200 ذخیره می‌شوند)
+    """
+    key = _response_key(wallet_id, get_version(wallet_id), name, request.query_params)
+    entry = cache.get(key)
+    if entry is None or entry['expires_at'] <= time.time():
+        entry, response = _rebuild(key, entry, build, ttl)
+        if entry is None:
+            return response
+
+    if_none_match = [tag.strip() for tag in request.headers.get('If-None-Match', '').split(',')]
+    if entry['etag'] in if_none_match or '*' in if_none_match:
+        response = Response(status=status.HTTP_304_NOT_MODIFIED)
+    else:
+        response = Response(entry['data'], status=status.HTTP_200_OK)
+    response['ETag'] = entry['etag']
+    response['Cache-Control'] = 'private, no-cache'
+    return response
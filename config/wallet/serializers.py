@@ -1,6 +1,7 @@
 from rest_framework import serializers
 from phonenumber_field.serializerfields import PhoneNumberField
 from decimal import Decimal
+from django.conf import settings
 
 from .models import Wallet, Transaction, WalletLimit
 from users.core.models import User
@@ -8,6 +9,9 @@ from users.core.models import User
 
 class WalletSerializer(serializers.ModelSerializer):
     """Serializer برای نمایش اطلاعات کیف پول"""
+    balance = serializers.DecimalField(
+        source='total_balance', max_digits=15, decimal_places=2, read_only=True
+    )
     formatted_balance = serializers.SerializerMethodField()
     
     class Meta:
@@ -211,6 +215,58 @@ class TransferSerializer(serializers.Serializer):
         return attrs
 
 
+class BulkTransferItemSerializer(serializers.Serializer):
+    """Serializer برای یک دریافت‌کننده در پرداخت گروهی"""
+    phone = PhoneNumberField(region='IR', required=False)
+    wallet_address = serializers.CharField(max_length=32, required=False, allow_blank=True)
+    special_code = serializers.CharField(max_length=20, required=False, allow_blank=True)
+    amount = serializers.DecimalField(
+        max_digits=15,
+        decimal_places=2,
+        min_value=Decimal('10000')
+    )
+    description = serializers.CharField(max_length=500, required=False, allow_blank=True)
+
+    def validate(self, attrs):
+        if attrs.get('phone'):
+            attrs['phone'] = str(attrs['phone'])
+        if attrs.get('wallet_address'):
+            attrs['wallet_address'] = attrs['wallet_address'].replace(' ', '').replace('-', '').upper()
+        if attrs.get('special_code'):
+            attrs['special_code'] = attrs['special_code'].replace(' ', '').replace('-', '').strip()
+
+        provided = [key for key in ('phone', 'wallet_address', 'special_code') if attrs.get(key)]
+        if len(provided) != 1:
+            raise serializers.ValidationError(
+                "Exactly one of phone, wallet_address or special_code is required"
+            )
+        return attrs
+
+
+class BulkTransferSerializer(serializers.Serializer):
+    """Serializer برای پرداخت گروهی"""
+    items = BulkTransferItemSerializer(many=True, allow_empty=False, max_length=1000)
+    description = serializers.CharField(max_length=500, required=False, allow_blank=True)
+    metadata = serializers.JSONField(required=False, default=dict)
+
+    def validate_metadata(self, value):
+        if value is None:
+            return {}
+        if not isinstance(value, dict):
+            raise serializers.ValidationError("Metadata must be a valid object")
+        return value
+
+
+class BulkTransferResponseSerializer(serializers.Serializer):
+    """Serializer برای پاسخ پرداخت گروهی"""
+    batch_id = serializers.CharField()
+    total_amount = serializers.DecimalField(max_digits=15, decimal_places=2)
+    succeeded = serializers.IntegerField()
+    failed = serializers.IntegerField()
+    balance_after = serializers.DecimalField(max_digits=15, decimal_places=2)
+    results = serializers.ListField(child=serializers.DictField())
+
+
 class TransactionSerializer(serializers.ModelSerializer):
     """Serializer برای نمایش تراکنش"""
     type_display = serializers.CharField(source='get_type_display', read_only=True)
@@ -229,6 +285,14 @@ class TransactionSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = fields
     
+    # طرف مقابل انتقال در get_recipient_info؛ بدون select_related هر سطر تا 3 query اضافه دارد
+    related_fields = ('recipient_wallet__user', 'related_transaction__wallet__user')
+    
+    @classmethod
+    def setup_eager_loading(cls, queryset):
+        """افزودن join طرف مقابل انتقال تا تعداد query مستقل از تعداد سطرها باشد"""
+        return queryset.select_related(*cls.related_fields)
+    
     def get_recipient_info(self, obj):
         """اطلاعات دریافت‌کننده برای تراکنش‌های انتقال"""
         if obj.type == 'transfer_out' and obj.recipient_wallet:
@@ -252,6 +316,8 @@ class TransactionDetailSerializer(TransactionSerializer):
     class Meta(TransactionSerializer.Meta):
         fields = TransactionSerializer.Meta.fields + ['wallet_info']
     
+    related_fields = TransactionSerializer.related_fields + ('wallet__user',)
+    
     def get_wallet_info(self, obj):
         return {
             'id': obj.wallet.id,
@@ -267,6 +333,19 @@ class BalanceSerializer(serializers.Serializer):
     formatted_balance = serializers.CharField()
 
 
+class BalanceAtQuerySerializer(serializers.Serializer):
+    """Serializer برای پارامتر زمان در موجودی لحظه‌ای"""
+    at = serializers.DateTimeField()
+
+
+class BalanceAtSerializer(serializers.Serializer):
+    """Serializer برای نمایش موجودی در یک لحظه"""
+    at = serializers.DateTimeField()
+    balance = serializers.DecimalField(max_digits=15, decimal_places=2)
+    currency = serializers.CharField(max_length=3)
+    checkpoint_as_of = serializers.DateTimeField(allow_null=True)
+
+
 class ChargeResponseSerializer(serializers.Serializer):
     """Serializer برای پاسخ شارژ"""
     transaction_id = serializers.CharField()
@@ -349,6 +428,26 @@ class QRGenerateSerializer(serializers.Serializer):
         return value
 
 
+class QRBatchGenerateSerializer(QRGenerateSerializer):
+    """Serializer برای تولید دسته‌ای QR ثابت (برگه چاپی PDF یا ZIP)"""
+    count = serializers.IntegerField(min_value=1)
+    expires_in = serializers.IntegerField(required=False, min_value=60)
+    output_format = serializers.ChoiceField(choices=['pdf', 'zip'], default='pdf')
+    size = serializers.IntegerField(required=False, min_value=128, max_value=1024)
+
+    def validate_count(self, value):
+        if value > settings.QR_BATCH_MAX_COUNT:
+            raise serializers.ValidationError(f"Count must be at most {settings.QR_BATCH_MAX_COUNT}")
+        return value
+
+    def validate_expires_in(self, value):
+        if value > settings.QR_BATCH_MAX_EXPIRES_IN:
+            raise serializers.ValidationError(
+                f"Ensure this value is less than or equal to {settings.QR_BATCH_MAX_EXPIRES_IN}."
+            )
+        return value
+
+
 class QRGenerateResponseSerializer(serializers.Serializer):
     qr_payload = serializers.CharField()
     qr_content = serializers.CharField()
@@ -367,7 +466,7 @@ class QRPayloadSerializer(serializers.Serializer):
 class QRInfoSerializer(serializers.Serializer):
     qr_payload = serializers.CharField()
     status = serializers.CharField()
-    expires_at = serializers.DateTimeField()
+    expires_at = serializers.DateTimeField(allow_null=True)
     amount = serializers.DecimalField(max_digits=15, decimal_places=2, allow_null=True, required=False)
     description = serializers.CharField(allow_blank=True, required=False)
     qr_content = serializers.CharField()
@@ -427,4 +526,5 @@ class TransactionReportSerializer(serializers.Serializer):
     transactions = serializers.ListField(child=serializers.DictField(), required=False)
     total_transactions = serializers.IntegerField()
     has_more = serializers.BooleanField()
+    next_cursor = serializers.CharField(allow_null=True, required=False)
 
@@ -0,0 +1,28 @@
+from django.db import transaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from wallet.models import SpecialCode, WalletQRCode
+
+
+@receiver(post_delete, sender=SpecialCode)
+def release_deleted_special_code(sender, instance: SpecialCode, **kwargs):
+    """
+    آزاد کردن کد اختصاصی حذف‌شده در استخر شناسه‌ها (شامل حذف آبشاری با کاربر).
+    """
+    from wallet.id_pool import release_special_code
+    release_special_code(instance.code)
+
+
+@receiver(post_delete, sender=WalletQRCode)
+def delete_batch_qr_asset(sender, instance: WalletQRCode, **kwargs):
+    """
+    حذف تصویر از پیش رندرشده QRهای دسته‌ای پس از commit حذف ردیف.
+    """
+    metadata = instance.metadata or {}
+    if 'batch_id' not in metadata:
+        return
+
+    from wallet import qr_render
+    key = qr_render.render_key(qr_render.qr_content(instance.qr_payload), metadata.get('asset_size'))
+    transaction.on_commit(lambda: qr_render.delete_asset(key))
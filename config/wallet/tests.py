@@ -1,9 +1,13 @@
 from django.test import TestCase
 from django.contrib.auth import get_user_model
+from django.conf import settings
+from django.core.cache import cache
 from decimal import Decimal
+from io import StringIO
 from unittest.mock import patch, Mock
-from .models import Wallet, Transaction, PaymentRequest
-from .utils import charge_wallet, debit_wallet, transfer_money
+from .models import Wallet, Transaction, PaymentRequest, SpecialCode
+from .utils import charge_wallet, debit_wallet, transfer_money, bulk_transfer
+from . import ledger, limits
 from .payment_gateway import PaymentGatewayService
 
 User = get_user_model()
@@ -58,6 +62,7 @@ class TransactionModelTest(TestCase):
 
 class WalletUtilsTest(TestCase):
     def setUp(self):
+        cache.clear()
         self.user1 = User.objects.create_user(phone='09123456789', password='testpass123')
         self.user2 = User.objects.create_user(phone='09123456780', password='testpass123')
         self.wallet1 = self.user1.wallet
@@ -124,6 +129,1189 @@ class WalletUtilsTest(TestCase):
         self.assertEqual(recipient_transaction.metadata.get('note'), 'friends')
 
 
+class LedgerTest(TestCase):
+    """تست موتور تغییر اتمی موجودی"""
+
+    def setUp(self):
+        cache.clear()
+        self.user1 = User.objects.create_user(phone='09123456789', password='testpass123')
+        self.user2 = User.objects.create_user(phone='09123456780', password='testpass123')
+        self.wallet1 = self.user1.wallet
+        self.wallet2 = self.user2.wallet
+        Wallet.objects.filter(id=self.wallet1.id).update(balance=Decimal('100000'))
+
+    def test_debit_returns_balances_from_update(self):
+        change = ledger.debit(self.wallet1.id, Decimal('40000'))
+        self.assertEqual(change.balance_before, Decimal('100000'))
+        self.assertEqual(change.balance_after, Decimal('60000'))
+        self.wallet1.refresh_from_db()
+        self.assertEqual(self.wallet1.balance, Decimal('60000'))
+
+    def test_debit_guard_keeps_balance(self):
+        with self.assertRaisesMessage(ValueError, 'Insufficient balance'):
+            ledger.debit(self.wallet1.id, Decimal('100001'))
+        self.wallet1.refresh_from_db()
+        self.assertEqual(self.wallet1.balance, Decimal('100000'))
+
+    def test_debit_inactive_wallet(self):
+        Wallet.objects.filter(id=self.wallet1.id).update(status='suspended')
+        with self.assertRaisesMessage(ValueError, 'Wallet is not active'):
+            debit_wallet(wallet=self.wallet1, amount=Decimal('1000'))
+
+    def test_transfer_to_inactive_recipient_rolls_back(self):
+        Wallet.objects.filter(id=self.wallet2.id).update(status='closed')
+        with self.assertRaisesMessage(ValueError, 'Recipient wallet is not active'):
+            transfer_money(self.wallet1, self.wallet2, Decimal('20000'))
+        self.wallet1.refresh_from_db()
+        self.assertEqual(self.wallet1.balance, Decimal('100000'))
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_transfer_balance_chain(self):
+        sender_tx, recipient_tx = transfer_money(self.wallet1, self.wallet2, Decimal('25000'))
+        self.assertEqual(sender_tx.balance_before, Decimal('100000'))
+        self.assertEqual(sender_tx.balance_after, Decimal('75000'))
+        self.assertEqual(recipient_tx.balance_before, Decimal('0'))
+        self.assertEqual(recipient_tx.balance_after, Decimal('25000'))
+
+
+    def test_daily_count_limit(self):
+        for _ in range(limits.MAX_DAILY_TRANSFER_COUNT):
+            ok, error = limits.reserve(self.wallet1, Decimal('1000'))
+            self.assertTrue(ok)
+        ok, error = limits.reserve(self.wallet1, Decimal('1000'))
+        self.assertFalse(ok)
+        self.assertEqual(error, limits.COUNT_EXCEEDED_MESSAGE)
+        self.assertEqual(
+            limits.get_usage(self.wallet1),
+            (Decimal('10000'), limits.MAX_DAILY_TRANSFER_COUNT)
+        )
+
+
+    def test_failed_transfer_releases_reservation(self):
+        with patch('wallet.utils.save_transfer_legs', side_effect=RuntimeError('insert failed')):
+            with self.assertRaises(RuntimeError):
+                transfer_money(self.wallet1, self.wallet2, Decimal('20000'))
+        self.assertEqual(limits.get_usage(self.wallet1), (Decimal('0'), 0))
+
+    def test_outer_rollback_releases_reservation(self):
+        import time
+        from django.db import transaction as db_transaction
+
+        with self.assertRaises(RuntimeError):
+            with db_transaction.atomic():
+                transfer_money(self.wallet1, self.wallet2, Decimal('20000'))
+                raise RuntimeError('outer rollback')
+        limits.release_abandoned(now=time.time() + limits.PENDING_TIMEOUT + 1)
+        self.assertEqual(limits.get_usage(self.wallet1), (Decimal('0'), 0))
+
+    def test_committed_reservation_is_kept(self):
+        import time
+
+        with self.captureOnCommitCallbacks(execute=True):
+            transfer_money(self.wallet1, self.wallet2, Decimal('20000'))
+        self.assertEqual(limits.release_abandoned(now=time.time() + limits.PENDING_TIMEOUT + 1), 0)
+        self.assertEqual(limits.get_usage(self.wallet1), (Decimal('20000'), 1))
+
+    @patch('wallet.utils.limits.reserve', return_value=(True, None))
+    def test_transfer_query_budget(self, mock_reserve):
+        """
+        بودجه کوئری انتقال: UPDATE هر دو کیف پول، رزرو id، یک INSERT برای هر دو
+        طرف و لینک آن‌ها، upsert آمار روزانه (+ SAVEPOINT/RELEASE در TestCase). لاگ امنیتی پس از
+        پاسخ توسط middleware ثبت می‌شود و شمارنده محدودیت روزانه در Redis است
+        (اینجا mock شده است).
+        """
+        from django.contrib.contenttypes.models import ContentType
+        from django.test import RequestFactory
+        from users.core import audit_context
+
+        request = RequestFactory().post('/api/wallet/transfer/')
+        audit_context.attach(request)
+        sender = Wallet.objects.select_related('user').get(id=self.wallet1.id)
+        recipient = Wallet.objects.select_related('user').get(id=self.wallet2.id)
+        ContentType.objects.get_for_model(Transaction)
+
+        with self.assertNumQueries(6):
+            sender_tx, recipient_tx = transfer_money(sender, recipient, Decimal('1000'), request=request)
+        sender_tx.refresh_from_db()
+        self.assertEqual(sender_tx.related_transaction_id, recipient_tx.id)
+        self.assertEqual(recipient_tx.related_transaction.id, sender_tx.id)
+
+
+class WalletLockStatsTest(TestCase):
+    """تست متریک انتظار روی قفل ردیف کیف پول"""
+
+    def setUp(self):
+        cache.clear()
+        self.sender = User.objects.create_user(phone='+989123456789', password='testpass123')
+        self.recipient = User.objects.create_user(phone='+989123456780', password='testpass123')
+        Wallet.objects.filter(id=self.sender.wallet.id).update(balance=Decimal('100000'))
+        self.sender.wallet.refresh_from_db()
+
+    def test_slow_lock_statement_is_recorded_per_wallet(self):
+        from . import lock_stats
+
+        with self.settings(WALLET_LOCK_CONTENTION_MS=0), \
+                patch.object(lock_stats, 'record', wraps=lock_stats.record) as mock_record:
+            transfer_money(self.sender.wallet, self.recipient.wallet, Decimal('20000'))
+        wallet_ids = set(mock_record.call_args_list[0][0][0])
+        self.assertEqual(wallet_ids, {self.sender.wallet.id, self.recipient.wallet.id})
+
+        if lock_stats._get_redis() is None:
+            return
+        stats = lock_stats.get_lock_stats(self.recipient.wallet.id)
+        self.assertGreaterEqual(stats['contended'], 1)
+        self.assertLessEqual(stats['max_wait_ms'], stats['wait_ms'])
+        self.assertIn(self.sender.wallet.id, dict(lock_stats.top_contended_wallets()))
+        client = lock_stats._get_redis()
+        self.assertGreater(client.ttl(lock_stats._stats_key(self.sender.wallet.id)), 0)
+        self.assertGreater(client.ttl(lock_stats._contention_key()), 0)
+
+    def test_fast_statements_write_nothing(self):
+        from . import lock_stats
+
+        with self.settings(WALLET_LOCK_CONTENTION_MS=60 * 1000), patch.object(lock_stats, 'record') as mock_record:
+            transfer_money(self.sender.wallet, self.recipient.wallet, Decimal('20000'))
+        mock_record.assert_not_called()
+
+
+class ShardedWalletTest(TestCase):
+    """تست شاردینگ موجودی ورودی کیف پول‌های پردریافت"""
+
+    def setUp(self):
+        cache.clear()
+        self.payer = User.objects.create_user(phone='09123456789', password='testpass123')
+        self.driver = User.objects.create_user(phone='09123456780', password='testpass123')
+        Wallet.objects.filter(id=self.payer.wallet.id).update(balance=Decimal('100000'))
+        self.payer_wallet = Wallet.objects.get(id=self.payer.wallet.id)
+        self.driver_wallet = ledger.set_shard_count(self.driver.wallet, 4)
+
+    def test_incoming_transfers_land_on_shards(self):
+        for _ in range(3):
+            transfer_money(self.payer_wallet, self.driver_wallet, Decimal('10000'), method='special_code')
+        self.driver_wallet.refresh_from_db()
+        self.assertEqual(self.driver_wallet.balance, Decimal('0'))
+        self.assertEqual(self.driver_wallet.total_balance, Decimal('30000'))
+        # واریز روی شارد موجودی کل ثبت نمی‌کند (ترتیب واریزهای هم‌زمان مشخص نیست)
+        last_in = Transaction.objects.filter(wallet=self.driver_wallet).latest('id')
+        self.assertIsNone(last_in.balance_before)
+        self.assertIsNone(last_in.balance_after)
+
+    def test_locked_legs_include_shards(self):
+        transfer_money(self.payer_wallet, self.driver_wallet, Decimal('20000'))
+        charge = charge_wallet(self.driver_wallet, Decimal('5000'))
+        self.assertEqual((charge.balance_before, charge.balance_after), (Decimal('20000'), Decimal('25000')))
+        debit = debit_wallet(self.driver_wallet, Decimal('2000'))
+        self.assertEqual((debit.balance_before, debit.balance_after), (Decimal('25000'), Decimal('23000')))
+
+    def test_bulk_recipient_balance_includes_shards(self):
+        transfer_money(self.payer_wallet, self.driver_wallet, Decimal('20000'))
+        bulk_transfer(self.payer_wallet, [{'phone': '09123456780', 'amount': Decimal('10000')}])
+        last_in = Transaction.objects.filter(wallet=self.driver_wallet).latest('id')
+        self.assertEqual((last_in.balance_before, last_in.balance_after), (Decimal('20000'), Decimal('30000')))
+
+    def test_debit_sweeps_shards(self):
+        transfer_money(self.payer_wallet, self.driver_wallet, Decimal('20000'))
+        debit_wallet(self.driver_wallet, Decimal('15000'))
+        self.driver_wallet.refresh_from_db()
+        self.assertEqual(self.driver_wallet.balance, Decimal('5000'))
+        self.assertEqual(self.driver_wallet.total_balance, Decimal('5000'))
+
+    def test_merge_and_disable(self):
+        transfer_money(self.payer_wallet, self.driver_wallet, Decimal('20000'))
+        self.assertEqual(ledger.merge_shards(), 1)
+        self.driver_wallet.refresh_from_db()
+        self.assertEqual(self.driver_wallet.balance, Decimal('20000'))
+
+        transfer_money(self.payer_wallet, self.driver_wallet, Decimal('5000'))
+        ledger.set_shard_count(self.driver_wallet, 0)
+        self.assertEqual(self.driver_wallet.balance, Decimal('25000'))
+        self.assertFalse(self.driver_wallet.balance_shards.exists())
+
+
+class BalanceCheckpointTest(TestCase):
+    """تست checkpoint موجودی و موجودی در یک لحظه"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(phone='+989123456789', password='testpass123')
+        self.wallet = self.user.wallet
+
+    def test_balance_at_replays_tail_after_checkpoint(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from .checkpoints import balance_at, create_checkpoints
+
+        start = timezone.now()
+        charge_wallet(self.wallet, Decimal('100000'))
+        checkpoint_time = timezone.now()
+        self.assertEqual(create_checkpoints(as_of=checkpoint_time), 1)
+        self.assertEqual(create_checkpoints(), 0)
+
+        charge_wallet(self.wallet, Decimal('50000'))
+        debit_wallet(self.wallet, Decimal('20000'))
+
+        balance, checkpoint = balance_at(self.wallet, checkpoint_time)
+        self.assertEqual(balance, Decimal('100000'))
+        self.assertIsNotNone(checkpoint)
+        balance, _ = balance_at(self.wallet, timezone.now())
+        self.assertEqual(balance, Decimal('130000'))
+        balance, checkpoint = balance_at(self.wallet, start - timedelta(seconds=1))
+        self.assertEqual(balance, Decimal('0'))
+        self.assertIsNone(checkpoint)
+
+        self.assertEqual(create_checkpoints(as_of=timezone.now()), 1)
+        self.assertEqual(self.wallet.balance_checkpoints.latest('as_of').balance, Decimal('130000'))
+
+    def test_checkpoint_tail_follows_created_at_not_id(self):
+        """تراکنشی با id کوچک‌تر که دیرتر ثبت شده در دنباله checkpoint می‌ماند"""
+        from datetime import timedelta
+        from django.utils import timezone
+        from .checkpoints import balance_at, create_checkpoints
+
+        late = charge_wallet(self.wallet, Decimal('100000'))
+        early = charge_wallet(self.wallet, Decimal('50000'))
+        checkpoint_time = timezone.now()
+        Transaction.objects.filter(id=late.id).update(created_at=checkpoint_time + timedelta(seconds=1))
+
+        self.assertEqual(create_checkpoints(as_of=checkpoint_time), 1)
+        checkpoint = self.wallet.balance_checkpoints.get()
+        self.assertEqual(checkpoint.balance, Decimal('50000'))
+        self.assertEqual(checkpoint.last_transaction_id, early.id)
+
+        balance, _ = balance_at(self.wallet, checkpoint_time + timedelta(seconds=2))
+        self.assertEqual(balance, Decimal('150000'))
+        self.assertEqual(create_checkpoints(as_of=checkpoint_time + timedelta(seconds=2)), 1)
+        self.assertEqual(self.wallet.balance_checkpoints.latest('as_of').balance, Decimal('150000'))
+
+    def test_default_checkpoint_lags_behind_recent_transactions(self):
+        from .checkpoints import create_checkpoints
+
+        charge_wallet(self.wallet, Decimal('100000'))
+        self.assertEqual(create_checkpoints(), 0)
+        with self.settings(BALANCE_CHECKPOINT_SAFETY_LAG=0):
+            self.assertEqual(create_checkpoints(), 1)
+
+    def test_balance_at_api(self):
+        from rest_framework.test import APIClient
+
+        charge_wallet(self.wallet, Decimal('100000'))
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get('/api/wallet/balance/at/', {'at': '2100-01-01T00:00:00Z'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Decimal(response.data['balance']), Decimal('100000'))
+        self.assertEqual(client.get('/api/wallet/balance/at/').status_code, 400)
+
+
+class ReconcileLedgerTest(TestCase):
+    """تست دستور reconcile_ledger"""
+
+    def setUp(self):
+        cache.clear()
+        self.user1 = User.objects.create_user(phone='09123456789', password='testpass123')
+        self.user2 = User.objects.create_user(phone='09123456780', password='testpass123')
+        self.wallet1 = self.user1.wallet
+        self.wallet2 = self.user2.wallet
+        charge_wallet(self.wallet1, Decimal('100000'))
+        transfer_money(self.wallet1, self.wallet2, Decimal('30000'))
+        debit_wallet(self.wallet2, Decimal('5000'))
+
+    def _reconcile(self):
+        import json
+        import tempfile
+        from django.core.management import call_command
+        from django.core.management.base import CommandError
+
+        with tempfile.NamedTemporaryFile('r', suffix='.ndjson') as report:
+            try:
+                call_command('reconcile_ledger', workers=1, output=report.name, stderr=StringIO())
+            except CommandError:
+                pass
+            return [json.loads(line) for line in report]
+
+    def test_consistent_ledger(self):
+        self.assertEqual(self._reconcile(), [])
+
+    def test_reports_discrepancies(self):
+        Wallet.objects.filter(id=self.wallet1.id).update(balance=Decimal('1'))
+        Transaction.objects.filter(wallet=self.wallet2, type='transfer_in').update(related_transaction=None)
+        Transaction.objects.filter(wallet=self.wallet2, type='debit').update(balance_before=Decimal('0'))
+
+        checks = {(issue['check'], issue['wallet_id']) for issue in self._reconcile()}
+        self.assertEqual(checks, {
+            ('balance_mismatch', self.wallet1.id),
+            ('unpaired_transfer', self.wallet2.id),
+            ('chain_gap', self.wallet2.id),
+        })
+
+class BulkTransferTest(TestCase):
+    """تست پرداخت گروهی"""
+
+    def setUp(self):
+        cache.clear()
+        self.sender = User.objects.create_user(phone='09123456789', password='testpass123')
+        self.driver1 = User.objects.create_user(phone='09123456780', password='testpass123')
+        self.driver2 = User.objects.create_user(phone='+989123456781', password='testpass123')
+        Wallet.objects.filter(id=self.sender.wallet.id).update(balance=Decimal('1000000'))
+        self.sender.wallet.refresh_from_db()
+        SpecialCode.create_for_user(self.driver1, code='12345')
+
+    def test_bulk_transfer_mixed_results(self):
+        items = [
+            {'special_code': '12345', 'amount': Decimal('100000')},
+            {'phone': str(self.driver2.phone), 'amount': Decimal('50000')},
+            {'wallet_address': self.driver2.wallet.wallet_address, 'amount': Decimal('20000')},
+            {'special_code': '99999', 'amount': Decimal('10000')},
+        ]
+        batch_id, results = bulk_transfer(self.sender.wallet, items, description='تسویه')
+
+        self.assertTrue(batch_id.startswith('batch_'))
+        self.assertEqual([r['success'] for r in results], [True, True, True, False])
+        self.assertEqual(results[3]['detail'], 'Recipient wallet not found')
+
+        self.sender.wallet.refresh_from_db()
+        self.driver1.wallet.refresh_from_db()
+        self.driver2.wallet.refresh_from_db()
+        self.assertEqual(self.sender.wallet.balance, Decimal('830000'))
+        self.assertEqual(self.driver1.wallet.balance, Decimal('100000'))
+        self.assertEqual(self.driver2.wallet.balance, Decimal('70000'))
+
+        incoming = Transaction.objects.filter(wallet=self.driver2.wallet).order_by('balance_after')
+        self.assertEqual([t.balance_after for t in incoming], [Decimal('50000'), Decimal('70000')])
+        outgoing = Transaction.objects.filter(wallet=self.sender.wallet, type='transfer_out')
+        self.assertEqual(outgoing.count(), 3)
+        for transaction in outgoing:
+            self.assertEqual(transaction.related_transaction.related_transaction_id, transaction.id)
+            self.assertEqual(transaction.metadata['batch_id'], batch_id)
+
+    def test_bulk_transfer_insufficient_balance_rejects_batch(self):
+        items = [
+            {'special_code': '12345', 'amount': Decimal('900000')},
+            {'phone': str(self.driver2.phone), 'amount': Decimal('200000')},
+        ]
+        with self.assertRaisesMessage(ValueError, 'Insufficient balance'):
+            bulk_transfer(self.sender.wallet, items)
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_bulk_transfer_api(self):
+        from rest_framework.test import APIClient
+        from rest_framework_simplejwt.tokens import RefreshToken
+
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.sender).access_token}')
+        response = client.post('/api/wallet/transfer/bulk/', {
+            'items': [
+                {'special_code': '12345', 'amount': '100000'},
+                {'phone': '09123456781', 'amount': '30000'},
+            ]
+        }, format='json')
+
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data['succeeded'], 2)
+        self.assertEqual(Decimal(response.data['balance_after']), Decimal('870000'))
+
+
+class IdempotencyTest(TestCase):
+    """تست هدر Idempotency-Key"""
+
+    def setUp(self):
+        from rest_framework.test import APIClient
+        from rest_framework_simplejwt.tokens import RefreshToken
+        from django.core.cache import cache
+
+        cache.clear()
+        self.sender = User.objects.create_user(phone='+989123456789', password='testpass123')
+        self.recipient = User.objects.create_user(phone='+989123456780', password='testpass123')
+        Wallet.objects.filter(id=self.sender.wallet.id).update(balance=Decimal('100000'))
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.sender).access_token}')
+
+    def _transfer(self, amount, key):
+        return self.client.post('/api/wallet/transfer/', {
+            'method': 'phone',
+            'recipient_phone': '+989123456780',
+            'amount': amount,
+        }, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_replayed_transfer_does_not_move_money_twice(self):
+        first = self._transfer('20000', 'key-1')
+        second = self._transfer('20000', 'key-1')
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(first.json()['transaction_id'], second.json()['transaction_id'])
+        self.sender.wallet.refresh_from_db()
+        self.assertEqual(self.sender.wallet.balance, Decimal('80000'))
+        self.assertEqual(Transaction.objects.filter(type='transfer_out').count(), 1)
+
+    def test_replay_survives_cache_eviction(self):
+        from django.core.cache import cache
+
+        self._transfer('20000', 'key-2')
+        cache.clear()
+        replay = self._transfer('20000', 'key-2')
+
+        self.assertEqual(replay['Idempotent-Replayed'], 'true')
+        self.assertEqual(Transaction.objects.filter(type='transfer_out').count(), 1)
+
+    def test_reused_key_with_different_body(self):
+        self._transfer('20000', 'key-3')
+        response = self._transfer('30000', 'key-3')
+        self.assertEqual(response.status_code, 422)
+
+    @patch('wallet.views.PaymentGatewayService.create_payment_request')
+    def test_replayed_gateway_charge_skips_gateway(self, mock_create):
+        mock_create.return_value = {
+            'success': True,
+            'authority': 'TOKEN',
+            'payment_url': 'https://sepehr.shaparak.ir:8080/Pay?token=TOKEN',
+            'gateway': 'sepehr',
+            'extra': {},
+        }
+        for _ in range(2):
+            response = self.client.post('/api/wallet/charge-gateway/', {
+                'amount': '100000'
+            }, format='json', HTTP_IDEMPOTENCY_KEY='gw-1')
+            self.assertEqual(response.status_code, 201)
+
+        self.assertEqual(mock_create.call_count, 1)
+        self.assertEqual(PaymentRequest.objects.count(), 1)
+
+    def test_unexpected_error_is_not_stored(self):
+        with patch('wallet.views.transfer_money', side_effect=RuntimeError('database is locked')):
+            failed = self._transfer('20000', 'key-4')
+        self.assertEqual(failed.status_code, 500)
+
+        retry = self._transfer('20000', 'key-4')
+        self.assertEqual(retry.status_code, 200)
+        self.assertNotIn('Idempotent-Replayed', retry)
+        self.assertEqual(Transaction.objects.filter(type='transfer_out').count(), 1)
+
+    def test_purge_task_removes_expired_keys(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from config.celery_tasks.ex_wallet import purge_idempotency_keys_task
+        from .models import IdempotencyKey
+
+        self._transfer('20000', 'key-5')
+        self._transfer('10000', 'key-6')
+        IdempotencyKey.objects.filter(key='key-5').update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        self.assertEqual(purge_idempotency_keys_task(), 1)
+        self.assertEqual(list(IdempotencyKey.objects.values_list('key', flat=True)), ['key-6'])
+
+
+
+class WalletCommandQueueTest(TestCase):
+    """تست حالت صف‌محور فرمان‌های کیف پول"""
+
+    def setUp(self):
+        from rest_framework.test import APIClient
+        from config.celery_config import app
+
+        cache.clear()
+        self.sender = User.objects.create_user(phone='+989123456789', password='testpass123')
+        self.recipient = User.objects.create_user(phone='+989123456780', password='testpass123')
+        Wallet.objects.filter(id=self.sender.wallet.id).update(balance=Decimal('100000'))
+        self.client = APIClient()
+        self.client.force_authenticate(self.sender)
+
+        self.addCleanup(setattr, app.conf, 'task_always_eager', app.conf.task_always_eager)
+        app.conf.task_always_eager = True
+        queue_mode = self.settings(WALLET_COMMAND_MODE='queue', WALLET_COMMAND_PARTITIONS=4)
+        queue_mode.enable()
+        self.addCleanup(queue_mode.disable)
+
+    def test_queue_name_by_partition(self):
+        from .command_queue import get_queue_name
+        self.assertEqual(get_queue_name(5), 'wallet_commands_1')
+
+    def test_transfer_through_partition_queue(self):
+        from config.celery_tasks.ex_wallet import apply_wallet_command_task
+
+        with patch.object(apply_wallet_command_task, 'apply_async', wraps=apply_wallet_command_task.apply_async) as mock_apply:
+            response = self.client.post('/api/wallet/transfer/', {
+                'method': 'phone', 'recipient_phone': '+989123456780', 'amount': '30000'
+            }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(mock_apply.call_args.kwargs['queue'], f'wallet_commands_{self.sender.wallet.id % 4}')
+        self.assertEqual(Decimal(response.data['balance_after']), Decimal('70000'))
+        self.recipient.wallet.refresh_from_db()
+        self.assertEqual(self.recipient.wallet.balance, Decimal('30000'))
+        # رویداد worker در همان رکورد لاگ درخواست ادغام می‌شود
+        from users.core.models import AuditLog
+        log = AuditLog.objects.get()
+        self.assertEqual(log.metadata['sender_transaction_id'], response.data['transaction_id'])
+
+    def test_business_error_from_worker(self):
+        response = self.client.post('/api/wallet/debit/', {'amount': '500000'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['detail'], 'Insufficient balance')
+
+    def test_qr_is_claimed_in_worker_transaction(self):
+        from config.celery_tasks.ex_wallet import apply_wallet_command_task
+        from .models import WalletQRCode
+
+        qr = WalletQRCode.create_qr(wallet=self.recipient.wallet, amount=Decimal('150000'), expires_in=120)
+        body = {'method': 'qr', 'amount': '150000', 'metadata': {'qr_payload': qr.qr_payload}}
+        # انتقال ناموفق در worker، مصرف QR را هم برمی‌گرداند
+        response = self.client.post('/api/wallet/transfer/', body, format='json')
+        self.assertEqual(response.status_code, 400)
+        qr.refresh_from_db()
+        self.assertEqual(qr.status, 'active')
+
+        Wallet.objects.filter(id=self.sender.wallet.id).update(balance=Decimal('400000'))
+        with patch.object(apply_wallet_command_task, 'apply_async', wraps=apply_wallet_command_task.apply_async) as mock_apply:
+            response = self.client.post('/api/wallet/transfer/', body, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(mock_apply.call_args.kwargs['args'][1]['claim']['qr_payload'], qr.qr_payload)
+        qr.refresh_from_db()
+        self.assertEqual(qr.status, 'used')
+        response = self.client.post('/api/wallet/transfer/', body, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Transaction.objects.filter(type='transfer_out').count(), 1)
+
+    def test_redelivered_command_is_applied_once(self):
+        from .command_queue import apply_command
+
+        payload = {
+            'wallet_id': self.sender.wallet.id, 'amount': '5000', 'command_id': 'cmd-1'
+        }
+        first = apply_command('debit', dict(payload))
+        second = apply_command('debit', dict(payload))
+        self.assertTrue(second['replayed'])
+        self.assertEqual(second['transaction_ids'], first['transaction_ids'])
+        self.assertEqual(Transaction.objects.filter(type='debit').count(), 1)
+        self.sender.wallet.refresh_from_db()
+        self.assertEqual(self.sender.wallet.balance, Decimal('95000'))
+
+    def test_timeout_revokes_and_is_not_stored(self):
+        from celery.exceptions import TimeoutError as CeleryTimeoutError
+        from config.celery_tasks.ex_wallet import apply_wallet_command_task
+
+        pending = Mock()
+        pending.get.side_effect = CeleryTimeoutError()
+        with patch.object(apply_wallet_command_task, 'apply_async', return_value=pending) as mock_apply:
+            response = self.client.post(
+                '/api/wallet/debit/', {'amount': '5000'}, format='json', HTTP_IDEMPOTENCY_KEY='slow-1'
+            )
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(mock_apply.call_args.kwargs['expires'], settings.WALLET_COMMAND_TIMEOUT)
+        pending.revoke.assert_called_once()
+        command_id = response.data['command_id']
+
+        # تکرار با همان کلید همان فرمان را می‌فرستد و نتیجه نهایی را برمی‌گرداند
+        with patch.object(apply_wallet_command_task, 'apply_async', wraps=apply_wallet_command_task.apply_async) as mock_apply:
+            retry = self.client.post(
+                '/api/wallet/debit/', {'amount': '5000'}, format='json', HTTP_IDEMPOTENCY_KEY='slow-1'
+            )
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(mock_apply.call_args.kwargs['args'][1]['command_id'], command_id)
+
+class TransactionPaginationTest(TestCase):
+    """تست صفحه‌بندی keyset تاریخچه تراکنش‌ها"""
+
+    def setUp(self):
+        from rest_framework.test import APIClient
+        from django.utils import timezone
+
+        cache.clear()
+        self.user = User.objects.create_user(phone='+989123456789', password='testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        for index in range(5):
+            charge_wallet(self.user.wallet, Decimal('1000') + index)
+        # دو تراکنش با زمان یکسان: ترتیب با id شکسته می‌شود
+        same_time = timezone.now()
+        Transaction.objects.filter(wallet=self.user.wallet, amount__in=[Decimal('1001'), Decimal('1002')]).update(
+            created_at=same_time
+        )
+
+    def _walk(self, url, key, **params):
+        ids = []
+        cursor = None
+        while True:
+            query = dict(params, page_size=2)
+            if cursor:
+                query['cursor'] = cursor
+            response = self.client.get(url, query)
+            self.assertEqual(response.status_code, 200)
+            ids += [item['transaction_id'] for item in response.data[key]]
+            cursor = response.data['next' if key == 'results' else 'next_cursor']
+            if cursor is None:
+                return ids
+
+    def test_cursor_walks_every_transaction_once(self):
+        expected = list(
+            Transaction.objects.filter(wallet=self.user.wallet)
+            .order_by('-created_at', '-id').values_list('transaction_id', flat=True)
+        )
+        self.assertEqual(self._walk('/api/wallet/transactions/', 'results'), expected)
+        self.assertEqual(self._walk('/api/wallet/report/', 'transactions'), expected)
+
+    def test_count_only_on_request(self):
+        response = self.client.get('/api/wallet/transactions/')
+        self.assertIsNone(response.data['count'])
+        response = self.client.get('/api/wallet/transactions/', {'include_count': 'true'})
+        self.assertEqual(response.data['count'], 5)
+        # صفحه‌بندی قدیمی با شماره صفحه همچنان پشتیبانی می‌شود
+        response = self.client.get('/api/wallet/transactions/', {'page': 2, 'page_size': 2})
+        self.assertEqual((response.data['count'], response.data['next']), (5, 3))
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/wallet/transactions/', {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_recipient_info_query_count_is_constant(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        other = User.objects.create_user(phone='+989123456780', password='testpass123', fullname='گیرنده')
+        for _ in range(3):
+            transfer_money(self.user.wallet, other.wallet, Decimal('1000'))
+            transfer_money(other.wallet, self.user.wallet, Decimal('500'))
+
+        counts = []
+        for page_size in (2, 11):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get('/api/wallet/transactions/', {'page_size': page_size})
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+        infos = [item['recipient_info'] for item in response.data['results'] if item['type'].startswith('transfer')]
+        self.assertEqual(len(infos), 6)
+        self.assertTrue(all(info['phone'] == '+989123456780' for info in infos))
+
+
+class WalletDailyStatTest(TestCase):
+    """تست آمار روزانه کیف پول و گزارش مبتنی بر آن"""
+
+    def setUp(self):
+        from rest_framework.test import APIClient
+        from django.utils import timezone
+
+        cache.clear()
+        self.user = User.objects.create_user(phone='+989123456789', password='testpass123')
+        self.other = User.objects.create_user(phone='+989123456780', password='testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.now = timezone.now()
+        charge_wallet(self.user.wallet, Decimal('500000'))
+        transfer_money(self.user.wallet, self.other.wallet, Decimal('20000'), method='phone')
+        transfer_money(self.other.wallet, self.user.wallet, Decimal('5000'), method='qr')
+        debit_wallet(self.user.wallet, Decimal('1000'))
+
+    def _raw_rows(self, wallet):
+        from . import daily_stats
+        return sorted(
+            (row['day'], row['type'], row['method'], row['count'], row['amount'])
+            for row in daily_stats.group_by_day(Transaction.objects.filter(wallet=wallet))
+        )
+
+    def test_rollup_matches_transactions(self):
+        from .models import WalletDailyStat
+        for wallet in (self.user.wallet, self.other.wallet):
+            stats = sorted(
+                (stat.day, stat.type, stat.transfer_method, stat.count, stat.amount)
+                for stat in WalletDailyStat.objects.filter(wallet=wallet)
+            )
+            self.assertEqual(stats, self._raw_rows(wallet))
+
+    def test_report_reads_full_days_from_rollup(self):
+        from datetime import timedelta
+        from .models import WalletDailyStat
+
+        # تراکنش‌های روزهای قبل فقط در آمار روزانه دیده می‌شوند (نه ردیف خام)
+        Transaction.objects.filter(wallet=self.user.wallet, type='charge').update(
+            created_at=self.now - timedelta(days=3)
+        )
+        WalletDailyStat.objects.filter(wallet=self.user.wallet, type='charge').update(
+            day=(self.now - timedelta(days=3)).date(), amount=Decimal('400000')
+        )
+
+        response = self.client.get('/api/wallet/report/', {'period': 'month'})
+        self.assertEqual(response.status_code, 200)
+        summary = response.data['summary']
+        self.assertEqual(Decimal(summary['total_receipts']), Decimal('405000'))
+        self.assertEqual(Decimal(summary['total_payments']), Decimal('21000'))
+        self.assertEqual(response.data['total_transactions'], 4)
+        self.assertEqual(
+            sum(Decimal(item['receipts']) for item in response.data['chart_data']), Decimal('405000')
+        )
+
+
+class WalletResponseCacheTest(TestCase):
+    """تست cache پاسخ موجودی و گزارش با ابطال مبتنی بر نسخه"""
+
+    def setUp(self):
+        from rest_framework.test import APIClient
+
+        cache.clear()
+        self.user = User.objects.create_user(phone='+989123456789', password='testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_etag_and_invalidation_on_ledger_write(self):
+        response = self.client.get('/api/wallet/balance/')
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        response = self.client.get('/api/wallet/balance/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            charge_wallet(self.user.wallet, Decimal('25000'))
+        response = self.client.get('/api/wallet/balance/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Decimal(response.data['balance']), Decimal('25000'))
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_report_is_cached_until_next_write(self):
+        from . import daily_stats
+
+        with patch.object(daily_stats, 'daily_rows', wraps=daily_stats.daily_rows) as mock_rows:
+            first = self.client.get('/api/wallet/report/')
+            second = self.client.get('/api/wallet/report/')
+            self.assertEqual(mock_rows.call_count, 1)
+            self.assertEqual(first.data, second.data)
+            # پارامترهای متفاوت کلید جداگانه دارند
+            self.client.get('/api/wallet/report/', {'period': 'month'})
+            self.assertEqual(mock_rows.call_count, 2)
+
+    def test_only_one_request_rebuilds_expired_entry(self):
+        import time
+        from django.http import QueryDict
+        from . import response_cache
+
+        self.client.get('/api/wallet/balance/')
+        wallet_id = self.user.wallet.id
+        key = response_cache._response_key(wallet_id, response_cache.get_version(wallet_id), 'balance', QueryDict())
+        entry = cache.get(key)
+        entry['expires_at'] = time.time() - 1
+        cache.set(key, entry)
+        # درخواست دیگری در حال بازسازی است: پاسخ قبلی بدون بازسازی برگردانده می‌شود
+        cache.add(f'{key}:lock', 'other', 10)
+        with patch('wallet.views.WalletViewSet._build_balance') as mock_build:
+            response = self.client.get('/api/wallet/balance/')
+        mock_build.assert_not_called()
+        self.assertEqual(response['ETag'], entry['etag'])
+
+
+class WalletQRImageTest(TestCase):
+    """تست cache تصویر QR و درخواست شرطی"""
+
+    def setUp(self):
+        from rest_framework.test import APIClient
+        from .models import WalletQRCode
+        from . import qr_render
+
+        cache.clear()
+        qr_render._local_cache.clear()
+        self.user = User.objects.create_user(phone='+989123456789', password='testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.qr = WalletQRCode.create_qr(wallet=self.user.wallet, expires_in=120)
+
+    def test_image_is_rendered_once_and_revalidated_with_etag(self):
+        from . import qr_render
+
+        params = {'qr_payload': self.qr.qr_payload, 'size': 256}
+        with patch.object(qr_render, 'render_png', wraps=qr_render.render_png) as mock_render:
+            first = self.client.get('/api/wallet/qr/image/', params)
+            second = self.client.get('/api/wallet/qr/image/', params)
+            conditional = self.client.get('/api/wallet/qr/image/', params, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(mock_render.call_count, 1)
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.content[:8], b'\x89PNG\r\n\x1a\n')
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(conditional.status_code, 304)
+        self.assertEqual(conditional['ETag'], first['ETag'])
+        max_age = int(first['Cache-Control'].split('max-age=')[1])
+        self.assertTrue(0 < max_age <= 120)
+
+    def test_size_is_part_of_the_key(self):
+        first = self.client.get('/api/wallet/qr/image/', {'qr_payload': self.qr.qr_payload, 'size': 256})
+        second = self.client.get('/api/wallet/qr/image/', {'qr_payload': self.qr.qr_payload, 'size': 512})
+        self.assertNotEqual(first['ETag'], second['ETag'])
+
+
+class WalletQRBatchTest(TestCase):
+    """تست تولید دسته‌ای QR و برگه چاپی"""
+
+    def setUp(self):
+        import tempfile
+        from rest_framework.test import APIClient
+        from . import qr_render
+
+        cache.clear()
+        qr_render._local_cache.clear()
+        asset_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(asset_dir.cleanup)
+        asset_settings = self.settings(QR_ASSET_DIR=asset_dir.name)
+        asset_settings.enable()
+        self.addCleanup(asset_settings.disable)
+
+        self.user = User.objects.create_user(phone='+989123456789', password='testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_pdf_sheet(self):
+        from .models import WalletQRCode
+
+        response = self.client.post('/api/wallet/qr/batch/', {
+            'count': 13, 'amount': '50000', 'expires_in': 30 * 24 * 3600
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertTrue(response.content.startswith(b'%PDF'))
+        # 12 QR در هر صفحه
+        self.assertIn(b'/Count 2', response.content)
+        batch_id = response['X-QR-Batch-Id']
+        self.assertEqual(WalletQRCode.objects.filter(metadata__batch_id=batch_id).count(), 13)
+
+    def test_zip_and_image_served_from_prerendered_asset(self):
+        import zipfile
+        from io import BytesIO
+        from . import qr_render
+
+        response = self.client.post('/api/wallet/qr/batch/', {
+            'count': 3, 'output_format': 'zip', 'expires_in': 3600
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        archive = zipfile.ZipFile(BytesIO(response.content))
+        names = sorted(archive.namelist())
+        self.assertEqual(len(names), 4)
+        self.assertIn('index.csv', names)
+
+        png_name = next(name for name in names if name.endswith('.png'))
+        with patch.object(qr_render, 'render_png') as mock_render:
+            image = self.client.get('/api/wallet/qr/image/', {'qr_payload': png_name[:-len('.png')]})
+        mock_render.assert_not_called()
+        self.assertEqual(image.content, archive.read(png_name))
+
+    def test_count_limit(self):
+        response = self.client.post('/api/wallet/qr/batch/', {'count': 10 ** 6}, format='json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(
+            '/api/wallet/qr/batch/', {'count': settings.QR_BATCH_MAX_COUNT + 1}, format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_pruned_batch_codes_remove_their_assets(self):
+        import os
+        from datetime import timedelta
+        from django.utils import timezone
+        from . import qr_batch, qr_render
+        from .expiry import prune_old
+        from .models import WalletQRCode
+
+        _, qr_codes, _ = qr_batch.generate_batch(self.user.wallet, 2, output_format='zip', size=256)
+        paths = [
+            qr_render.asset_path(qr_render.render_key(qr_render.qr_content(qr.qr_payload), 256))
+            for qr in qr_codes
+        ]
+        self.assertTrue(all(os.path.exists(path) for path in paths))
+
+        WalletQRCode.objects.filter(id=qr_codes[0].id).update(
+            status='expired', expires_at=timezone.now() - timedelta(days=settings.PAYMENT_CODE_RETENTION_DAYS + 1)
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(prune_old()['qr_codes'], 1)
+        self.assertFalse(os.path.exists(paths[0]))
+        self.assertTrue(os.path.exists(paths[1]))
+
+    def test_static_codes_do_not_expire_and_are_reusable(self):
+        from rest_framework.test import APIClient
+        from .models import WalletQRCode
+        from . import qr_render
+
+        with patch.object(qr_render, 'ProcessPoolExecutor') as mock_pool:
+            response = self.client.post('/api/wallet/qr/batch/', {
+                'count': 2, 'amount': '20000', 'output_format': 'zip'
+            }, format='json')
+        self.assertEqual(response.status_code, 200)
+        # درخواست API در همان process رندر می‌کند
+        mock_pool.assert_not_called()
+        qr = WalletQRCode.objects.filter(metadata__batch_id=response['X-QR-Batch-Id']).first()
+        self.assertTrue(qr.is_static)
+        self.assertIsNone(qr.expires_at)
+
+        payer = User.objects.create_user(phone='+989123456788', password='testpass123')
+        charge_wallet(payer.wallet, Decimal('100000'))
+        payer_client = APIClient()
+        payer_client.force_authenticate(payer)
+        for _ in range(2):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = payer_client.post('/api/wallet/transfer/', {
+                    'method': 'qr', 'amount': '20000', 'metadata': {'qr_payload': qr.qr_payload}
+                }, format='json')
+            self.assertEqual(response.status_code, 200)
+        qr.refresh_from_db()
+        self.assertEqual(qr.status, 'active')
+        self.user.wallet.refresh_from_db()
+        self.assertEqual(self.user.wallet.balance, Decimal('40000'))
+        lookup = payer_client.post('/api/wallet/qr/lookup/', {'qr_payload': qr.qr_payload}, format='json')
+        self.assertEqual((lookup.data['status'], lookup.data['expires_at']), ('active', None))
+
+    def test_management_command_renders_in_process_pool(self):
+        import os
+        import tempfile
+        from django.core.management import call_command
+        from .models import WalletQRCode
+
+        with tempfile.TemporaryDirectory() as output_dir:
+            output = os.path.join(output_dir, 'sheet.zip')
+            call_command(
+                'generate_qr_batch', phone='+989123456789', count=4, format='zip',
+                workers=2, output=output, stderr=StringIO()
+            )
+            self.assertTrue(os.path.getsize(output) > 0)
+        self.assertEqual(WalletQRCode.objects.filter(wallet=self.user.wallet).count(), 4)
+
+
+class WalletLookupCacheTest(TestCase):
+    """تست cache خواندنی QR و لینک پرداخت"""
+
+    def setUp(self):
+        from rest_framework.test import APIClient
+        from .models import WalletQRCode
+
+        cache.clear()
+        self.owner = User.objects.create_user(phone='+989123456789', password='testpass123')
+        self.payer = User.objects.create_user(phone='+989123456788', password='testpass123')
+        charge_wallet(self.payer.wallet, Decimal('100000'))
+        self.client = APIClient()
+        self.client.force_authenticate(self.payer)
+        self.qr = WalletQRCode.create_qr(wallet=self.owner.wallet, amount=Decimal('20000'), expires_in=120)
+
+    def test_lookup_is_served_from_cache(self):
+        first = self.client.post('/api/wallet/qr/lookup/', {'qr_payload': self.qr.qr_payload}, format='json')
+        self.assertEqual(first.status_code, 200)
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        with CaptureQueriesContext(connection) as queries:
+            second = self.client.post('/api/wallet/qr/lookup/', {'qr_payload': self.qr.qr_payload}, format='json')
+        # تنها queryها مربوط به audit log هستند
+        self.assertFalse([q for q in queries.captured_queries if 'audit_log' not in q['sql']])
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(second.data['owner']['phone'], '+989123456789')
+
+    def test_ttl_follows_expiry(self):
+        from . import lookup_cache
+
+        with patch.object(cache, 'set', wraps=cache.set) as mock_set:
+            lookup_cache.get_qr(self.qr.qr_payload)
+        ttl = mock_set.call_args[0][2]
+        self.assertTrue(0 < ttl <= 120)
+
+    def test_qr_transfer_invalidates_entry(self):
+        self.client.post('/api/wallet/qr/lookup/', {'qr_payload': self.qr.qr_payload}, format='json')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/wallet/transfer/', {
+                'method': 'qr', 'amount': '20000', 'metadata': {'qr_payload': self.qr.qr_payload}
+            }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['recipient']['phone'], '+989123456789')
+        self.owner.wallet.refresh_from_db()
+        self.assertEqual(self.owner.wallet.balance, Decimal('20000'))
+
+        response = self.client.post('/api/wallet/qr/lookup/', {'qr_payload': self.qr.qr_payload}, format='json')
+        self.assertEqual(response.data['status'], 'used')
+        response = self.client.post('/api/wallet/transfer/', {
+            'method': 'qr', 'amount': '20000', 'metadata': {'qr_payload': self.qr.qr_payload}
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_transfer_rechecks_stale_entry(self):
+        from .models import WalletQRCode
+
+        self.client.post('/api/wallet/qr/lookup/', {'qr_payload': self.qr.qr_payload}, format='json')
+        # درخواست هم‌زمان QR را مصرف کرده و ورودی cache هنوز باطل نشده است
+        WalletQRCode.objects.filter(id=self.qr.id).update(status='used')
+        response = self.client.post('/api/wallet/transfer/', {
+            'method': 'qr', 'amount': '20000', 'metadata': {'qr_payload': self.qr.qr_payload}
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['detail'], 'QR code is not active')
+        self.payer.wallet.refresh_from_db()
+        self.assertEqual(self.payer.wallet.balance, Decimal('100000'))
+
+    def test_transfer_uses_current_shard_count(self):
+        from .models import WalletBalanceShard
+
+        self.client.post('/api/wallet/qr/lookup/', {'qr_payload': self.qr.qr_payload}, format='json')
+        ledger.set_shard_count(self.owner.wallet, 4)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/wallet/transfer/', {
+                'method': 'qr', 'amount': '20000', 'metadata': {'qr_payload': self.qr.qr_payload}
+            }, format='json')
+        self.assertEqual(response.status_code, 200)
+        shards = WalletBalanceShard.objects.filter(wallet=self.owner.wallet)
+        self.assertEqual(sum(shard.balance for shard in shards), Decimal('20000'))
+        recipient_tx = Transaction.objects.get(wallet=self.owner.wallet, type='transfer_in')
+        self.assertIsNone(recipient_tx.balance_after)
+
+    def test_link_claim_merges_usage_metadata(self):
+        from .models import PaymentLink
+
+        link = PaymentLink.create_link(wallet=self.owner.wallet, amount=Decimal('15000'), expires_in=120)
+        PaymentLink.objects.filter(id=link.id).update(usage_metadata={'source': 'invoice-7'})
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/wallet/transfer/', {
+                'method': 'link', 'amount': '15000', 'metadata': {'payment_link_id': link.link_id}
+            }, format='json')
+        self.assertEqual(response.status_code, 200)
+        link.refresh_from_db()
+        self.assertEqual(link.status, 'used')
+        self.assertEqual(link.usage_metadata['source'], 'invoice-7')
+        self.assertEqual(link.usage_metadata['transaction_id'], response.data['transaction_id'])
+
+    def test_link_transfer_and_cancel(self):
+        from .models import PaymentLink
+        from . import lookup_cache
+
+        link = PaymentLink.create_link(wallet=self.owner.wallet, amount=Decimal('15000'), expires_in=120)
+        self.assertEqual(lookup_cache.get_link(link.link_id)['status'], 'active')
+        link.cancel()
+        response = self.client.post('/api/wallet/transfer/', {
+            'method': 'link', 'amount': '15000', 'metadata': {'payment_link_id': link.link_id}
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['detail'], 'Payment link is not active')
+
+
+class PaymentCodeExpiryTest(TestCase):
+    """تست منقضی کردن دوره‌ای QR و لینک پرداخت"""
+
+    def setUp(self):
+        from rest_framework.test import APIClient
+
+        cache.clear()
+        self.user = User.objects.create_user(phone='+989123456789', password='testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _create(self, expires_in):
+        from .models import PaymentLink, WalletQRCode
+
+        qr = WalletQRCode.create_qr(wallet=self.user.wallet, expires_in=expires_in)
+        link = PaymentLink.create_link(wallet=self.user.wallet, amount=Decimal('15000'), expires_in=expires_in)
+        return qr, link
+
+    def test_reads_do_not_write(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from .models import WalletQRCode
+
+        qr, _ = self._create(120)
+        WalletQRCode.objects.filter(id=qr.id).update(expires_at=timezone.now() - timedelta(seconds=1))
+        response = self.client.post('/api/wallet/qr/lookup/', {'qr_payload': qr.qr_payload}, format='json')
+        self.assertEqual(response.data['status'], 'expired')
+        response = self.client.get('/api/wallet/qr/image/', {'qr_payload': qr.qr_payload})
+        self.assertEqual(response.status_code, 400)
+        qr.refresh_from_db()
+        self.assertEqual(qr.status, 'active')
+
+    def test_expire_in_chunks_and_prune(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from . import expiry, lookup_cache
+        from .models import PaymentLink, WalletQRCode
+
+        due = [self._create(60) for _ in range(3)]
+        live_qr, live_link = self._create(3600)
+        lookup_cache.get_qr(due[0][0].qr_payload)
+
+        now = timezone.now() + timedelta(seconds=120)
+        self.assertEqual(expiry.expire_due(now=now, chunk_size=2), {'qr_codes': 3, 'payment_links': 3})
+        self.assertEqual(expiry.expire_due(now=now), {'qr_codes': 0, 'payment_links': 0})
+        self.assertEqual(WalletQRCode.objects.filter(status='expired').count(), 3)
+        self.assertEqual(PaymentLink.objects.filter(status='active').get(), live_link)
+        self.assertEqual(lookup_cache.get_qr(due[0][0].qr_payload)['status'], 'expired')
+
+        # ردیف فعال حتی پس از مدت نگهداری حذف نمی‌شود
+        later = now + timedelta(days=settings.PAYMENT_CODE_RETENTION_DAYS, seconds=1)
+        self.assertEqual(expiry.prune_old(now=later, chunk_size=2), {'qr_codes': 3, 'payment_links': 3})
+        self.assertEqual(list(WalletQRCode.objects.all()), [live_qr])
+
+
+class IDPoolTest(TestCase):
+    """تست استخر شناسه‌های یکتای از پیش تولیدشده"""
+
+    def setUp(self):
+        from . import id_pool
+
+        cache.clear()
+        if id_pool._get_redis() is None:
+            self.skipTest('ID pools need a Redis cache')
+        self.user = User.objects.create_user(phone='+989123456789', password='testpass123')
+
+    def test_allocation_makes_no_queries(self):
+        from . import id_pool
+        from .models import PaymentLink, SpecialCode, WalletQRCode
+
+        added = id_pool.refill(size=5)
+        self.assertEqual(added, {'wallet_address': 5, 'qr_payload': 5, 'link_id': 5, 'special_code': 5})
+        with self.assertNumQueries(0):
+            address = Wallet.generate_wallet_address()
+            payload = WalletQRCode.generate_unique_payload()
+            link_id = PaymentLink.generate_unique_link_id()
+            code = SpecialCode.generate_unique_code()
+        self.assertRegex(address, r'^PAYA[0-9A-F]{20}$')
+        self.assertRegex(payload, r'^qr_[0-9A-F]{12}$')
+        self.assertRegex(link_id, r'^pl_[A-Za-z0-9]{10}$')
+        self.assertRegex(code, r'^\d{5}$')
+        self.assertEqual(id_pool.refill(size=5)['qr_payload'], 1)
+
+    def test_special_code_space_is_handed_out_once(self):
+        from . import id_pool
+        from .models import SpecialCode
+
+        SpecialCode.create_for_user(self.user, code='00003')
+        with patch.object(id_pool, 'SPECIAL_CODE_SPACE', 16):
+            self.assertEqual(id_pool.refill(size=100)['special_code'], 15)
+            self.assertEqual(id_pool.refill(size=100)['special_code'], 0)
+            codes = id_pool.allocate_many('special_code', 100)
+        self.assertEqual(len(set(codes)), 15)
+        self.assertNotIn('00003', codes)
+        self.assertIsNone(id_pool.allocate('special_code'))
+
+    def test_claimed_code_leaves_the_pool(self):
+        from . import id_pool
+        from .models import SpecialCode
+
+        with patch.object(id_pool, 'SPECIAL_CODE_SPACE', 4):
+            id_pool.refill(size=4)
+        SpecialCode.create_for_user(self.user, code='00002')
+        self.assertNotIn('00002', id_pool.allocate_many('special_code', 4))
+
+    def test_replaced_and_deleted_codes_return_to_the_space(self):
+        from . import id_pool
+        from .models import SpecialCode
+
+        SpecialCode.create_for_user(self.user, code='00001')
+        with patch.object(id_pool, 'SPECIAL_CODE_SPACE', 4):
+            self.assertEqual(id_pool.refill(size=4)['special_code'], 3)
+            id_pool.allocate_many('special_code', 4)
+
+            with self.captureOnCommitCallbacks(execute=True):
+                SpecialCode.create_for_user(self.user, code='00002')
+            self.assertEqual(id_pool.refill(size=4)['special_code'], 1)
+            self.assertEqual(id_pool.allocate('special_code'), '00001')
+
+            with self.captureOnCommitCallbacks(execute=True):
+                self.user.delete()
+            self.assertEqual(id_pool.refill(size=4)['special_code'], 1)
+            self.assertEqual(id_pool.allocate('special_code'), '00002')
+
+    def test_fallback_code_is_marked_allocated(self):
+        from . import id_pool
+        from .models import SpecialCode
+
+        code = SpecialCode.generate_unique_code()
+        self.assertEqual(id_pool._get_redis().getbit(id_pool.SPECIAL_CODE_BITMAP_KEY, int(code)), 1)
+
+
 class WalletSignalTest(TestCase):
     def test_wallet_created_on_user_creation(self):
         phone = '09120001111'
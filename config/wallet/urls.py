@@ -6,14 +6,17 @@ from .payment_views import PaymentCallbackView, PaymentStatusView
 wallet_create = WalletViewSet.as_view({'post': 'create'})
 wallet_me = WalletViewSet.as_view({'get': 'retrieve'})
 wallet_balance = WalletViewSet.as_view({'get': 'balance'})
+wallet_balance_at = WalletViewSet.as_view({'get': 'balance_at'})
 wallet_charge = WalletViewSet.as_view({'post': 'charge'})
 wallet_charge_gateway = WalletViewSet.as_view({'post': 'charge_gateway'})
 wallet_debit = WalletViewSet.as_view({'post': 'debit'})
 wallet_transfer = WalletViewSet.as_view({'post': 'transfer'})
+wallet_bulk_transfer = WalletViewSet.as_view({'post': 'bulk_transfer'})
 wallet_transactions = WalletViewSet.as_view({'get': 'transactions'})
 wallet_qr_generate = WalletViewSet.as_view({'post': 'generate_qr'})
 wallet_qr_lookup = WalletViewSet.as_view({'post': 'lookup_qr'})
 wallet_qr_image = WalletViewSet.as_view({'get': 'qr_image'})
+wallet_qr_batch = WalletViewSet.as_view({'post': 'generate_qr_batch'})
 wallet_special_code_me = WalletViewSet.as_view({'get': 'get_special_code'})
 wallet_special_code_generate = WalletViewSet.as_view({'post': 'generate_special_code'})
 wallet_link_generate = WalletViewSet.as_view({'post': 'generate_link'})
@@ -24,15 +27,18 @@ urlpatterns = [
     path('create/', wallet_create, name='wallet-create'),
     path('me/', wallet_me, name='wallet-me'),
     path('balance/', wallet_balance, name='wallet-balance'),
+    path('balance/at/', wallet_balance_at, name='wallet-balance-at'),
     path('charge/', wallet_charge, name='wallet-charge'),
     path('charge-gateway/', wallet_charge_gateway, name='wallet-charge-gateway'),
     path('debit/', wallet_debit, name='wallet-debit'),
     path('transfer/', wallet_transfer, name='wallet-transfer'),
+    path('transfer/bulk/', wallet_bulk_transfer, name='wallet-bulk-transfer'),
     path('transactions/', wallet_transactions, name='wallet-transactions'),
     path('transactions/<str:pk>/', transaction_detail, name='transaction-detail'),
     path('qr/generate/', wallet_qr_generate, name='wallet-qr-generate'),
     path('qr/lookup/', wallet_qr_lookup, name='wallet-qr-lookup'),
     path('qr/image/', wallet_qr_image, name='wallet-qr-image'),
+    path('qr/batch/', wallet_qr_batch, name='wallet-qr-batch'),
     path('special-code/me/', wallet_special_code_me, name='wallet-special-code-me'),
     path('special-code/generate/', wallet_special_code_generate, name='wallet-special-code-generate'),
     path('link/generate/', wallet_link_generate, name='wallet-link-generate'),
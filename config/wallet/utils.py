@@ -2,145 +2,100 @@
 ابزارهای کمکی برای سرویس کیف پول
 """
 from django.db import transaction as db_transaction
-from django.utils import timezone
-from django.core.cache import cache
-from django.db.models import F, Q, Sum
 from decimal import Decimal
-from datetime import timedelta
 
-from .models import Wallet, Transaction, WalletLimit
+from .models import Wallet, Transaction
+from . import daily_stats, ledger, limits, response_cache
+from .limits import MAX_DAILY_TRANSFER_AMOUNT, MAX_DAILY_TRANSFER_COUNT
 
 
 # قوانین کسب‌وکار
 MIN_TRANSFER_AMOUNT = Decimal('10000')  # حداقل موجودی برای انتقال
-MAX_DAILY_TRANSFER_AMOUNT = Decimal('5000000')  # حداکثر انتقال در روز
-MAX_DAILY_TRANSFER_COUNT = 10  # حداکثر تعداد انتقال در روز
 
 
-def get_or_create_wallet_limit(wallet, date=None):
-    """دریافت یا ایجاد محدودیت روزانه"""
-    if date is None:
-        date = timezone.now().date()
-    
-    limit, created = WalletLimit.objects.get_or_create(
-        wallet=wallet,
-        date=date,
-        defaults={
-            'total_transfer_amount': Decimal('0'),
-            'transfer_count': 0
-        }
-    )
-    return limit
+def record_ledger_write(transactions):
+    """به‌روزرسانی آمار روزانه و ابطال پاسخ‌های cache‌شده کیف پول‌های تراکنش‌های درج‌شده"""
+    daily_stats.add_transactions(transactions)
+    response_cache.invalidate(txn.wallet_id for txn in transactions)
 
 
 def check_transfer_limits(wallet, amount):
-    """بررسی محدودیت‌های انتقال"""
-    today_limit = get_or_create_wallet_limit(wallet)
+    """
+    بررسی محدودیت‌های انتقال (فقط خواندنی)
+    برای ثبت مصرف از limits.reserve استفاده کنید که بررسی و افزایش را اتمی انجام می‌دهد.
+    """
+    total_amount, transfer_count = limits.get_usage(wallet)
     
     # بررسی حداکثر مبلغ روزانه
-    if today_limit.total_transfer_amount + amount > MAX_DAILY_TRANSFER_AMOUNT:
-        return False, "Daily transfer limit exceeded"
+    if total_amount + amount > MAX_DAILY_TRANSFER_AMOUNT:
+        return False, limits.AMOUNT_EXCEEDED_MESSAGE
     
     # بررسی حداکثر تعداد انتقال روزانه
-    if today_limit.transfer_count >= MAX_DAILY_TRANSFER_COUNT:
-        return False, "Daily transfer count limit exceeded"
+    if transfer_count >= MAX_DAILY_TRANSFER_COUNT:
+        return False, limits.COUNT_EXCEEDED_MESSAGE
     
     return True, None
 
 
-def update_transfer_limits(wallet, amount):
-    """به‌روزرسانی محدودیت‌های انتقال"""
-    today_limit = get_or_create_wallet_limit(wallet)
-    WalletLimit.objects.filter(id=today_limit.id).update(
-        total_transfer_amount=F('total_transfer_amount') + amount,
-        transfer_count=F('transfer_count') + 1
-    )
-
-
-def get_wallet_lock_key(wallet_id):
-    """کلید cache برای lock کردن کیف پول"""
-    return f"wallet_lock_{wallet_id}"
-
-
-def acquire_wallet_lock(wallet_id, timeout=30):
-    """قفل کردن کیف پول برای جلوگیری از race condition"""
-    lock_key = get_wallet_lock_key(wallet_id)
-    return cache.add(lock_key, True, timeout)
-
-
-def release_wallet_lock(wallet_id):
-    """آزاد کردن قفل کیف پول"""
-    lock_key = get_wallet_lock_key(wallet_id)
-    cache.delete(lock_key)
-
-
 @db_transaction.atomic
 def charge_wallet(wallet, amount, description='', payment_method=None, payment_id=None, request=None):
     """
     شارژ کیف پول
     """
-    # قفل کردن کیف پول
-    if not acquire_wallet_lock(wallet.id):
-        raise Exception("Wallet is currently being processed. Please try again.")
+    # افزایش اتمی موجودی (موجودی قبل و بعد از همان دستور UPDATE)؛ شارژ روی موجودی
+    # اصلی ثبت می‌شود تا موجودی کل کیف پول شارد‌شده هم دقیق باشد
+    change = ledger.credit(wallet.id, amount, shard_count=wallet.shard_count, use_shards=False)
+    balance_before = change.balance_before
+    balance_after = change.balance_after
+    wallet.balance = change.main_balance
     
-    try:
-        # دریافت آخرین موجودی
-        wallet.refresh_from_db()
-        balance_before = wallet.balance
-        balance_after = balance_before + amount
-        
-        # استخراج IP و user_agent از request
-        ip_address = None
-        user_agent = None
-        request_id = None
-        if request:
-            from users.core.models import AuditLog
-            ip_address = AuditLog._get_client_ip(request)
-            user_agent = request.META.get('HTTP_USER_AGENT', '')
-            request_id = getattr(request, 'request_id', None)
-        
-        # ایجاد تراکنش
-        transaction = Transaction.objects.create(
-            transaction_id=Transaction.generate_transaction_id(),
-            wallet=wallet,
-            type='charge',
-            amount=amount,
-            balance_before=balance_before,
-            balance_after=balance_after,
-            description=description or 'شارژ کیف پول',
-            status='completed',
-            payment_method=payment_method,
-            payment_id=payment_id,
-            ip_address=ip_address,
-            user_agent=user_agent,
-            request_id=request_id
+    # استخراج IP و user_agent از request
+    ip_address = None
+    user_agent = None
+    request_id = None
+    if request:
+        from users.core.models import AuditLog
+        ip_address = AuditLog._get_client_ip(request)
+        user_agent = request.META.get('HTTP_USER_AGENT', '')
+        request_id = getattr(request, 'request_id', None)
+    
+    # ایجاد تراکنش
+    transaction = Transaction.objects.create(
+        transaction_id=Transaction.generate_transaction_id(),
+        wallet=wallet,
+        type='charge',
+        amount=amount,
+        balance_before=balance_before,
+        balance_after=balance_after,
+        description=description or 'شارژ کیف پول',
+        status='completed',
+        payment_method=payment_method,
+        payment_id=payment_id,
+        ip_address=ip_address,
+        user_agent=user_agent,
+        request_id=request_id
+    )
+    record_ledger_write([transaction])
+    
+    # ثبت رویداد در لاگ امنیتی درخواست (middleware یک رکورد برای کل درخواست ثبت می‌کند)
+    if request:
+        from users.core.audit_context import record_event
+        record_event(
+            event_type='transaction_create',
+            event_description=f'شارژ کیف پول به مبلغ {amount}',
+            user=wallet.user,
+            request=request,
+            result='success',
+            metadata={
+                'transaction_id': transaction.transaction_id,
+                'amount': str(amount),
+                'balance_before': str(balance_before),
+                'balance_after': str(balance_after),
+            },
+            related_object=transaction
         )
-        
-        # به‌روزرسانی موجودی
-        wallet.balance = balance_after
-        wallet.save(update_fields=['balance', 'updated_at'])
-        
-        # ثبت لاگ امنیتی
-        if request:
-            from users.core.models import AuditLog
-            AuditLog.create_log(
-                event_type='transaction_create',
-                event_description=f'شارژ کیف پول به مبلغ {amount}',
-                user=wallet.user,
-                request=request,
-                result='success',
-                metadata={
-                    'transaction_id': transaction.transaction_id,
-                    'amount': str(amount),
-                    'balance_before': str(balance_before),
-                    'balance_after': str(balance_after),
-                },
-                related_object=transaction
-            )
-        
-        return transaction
-    finally:
-        release_wallet_lock(wallet.id)
+    
+    return transaction
 
 
 @db_transaction.atomic
@@ -148,73 +103,88 @@ def debit_wallet(wallet, amount, description='', reference_id=None, request=None
     """
     برداشت از کیف پول
     """
-    # قفل کردن کیف پول
-    if not acquire_wallet_lock(wallet.id):
-        raise Exception("Wallet is currently being processed. Please try again.")
+    # کاهش اتمی موجودی با شرط موجودی کافی و فعال بودن کیف پول
+    change = ledger.debit(wallet.id, amount, shard_count=wallet.shard_count)
+    balance_before = change.balance_before
+    balance_after = change.balance_after
+    wallet.balance = change.main_balance
     
-    try:
-        # بررسی موجودی
-        wallet.refresh_from_db()
-        if wallet.balance < amount:
-            raise ValueError("Insufficient balance")
-        
-        if wallet.status != 'active':
-            raise ValueError("Wallet is not active")
-        
-        balance_before = wallet.balance
-        balance_after = balance_before - amount
-        
-        # استخراج IP و user_agent از request
-        ip_address = None
-        user_agent = None
-        request_id = None
-        if request:
-            from users.core.models import AuditLog
-            ip_address = AuditLog._get_client_ip(request)
-            user_agent = request.META.get('HTTP_USER_AGENT', '')
-            request_id = getattr(request, 'request_id', None)
-        
-        # ایجاد تراکنش
-        transaction = Transaction.objects.create(
-            transaction_id=Transaction.generate_transaction_id(),
-            wallet=wallet,
-            type='debit',
-            amount=amount,
-            balance_before=balance_before,
-            balance_after=balance_after,
-            description=description or 'برداشت از کیف پول',
-            status='completed',
-            reference_id=reference_id,
-            ip_address=ip_address,
-            user_agent=user_agent,
-            request_id=request_id
+    # استخراج IP و user_agent از request
+    ip_address = None
+    user_agent = None
+    request_id = None
+    if request:
+        from users.core.models import AuditLog
+        ip_address = AuditLog._get_client_ip(request)
+        user_agent = request.META.get('HTTP_USER_AGENT', '')
+        request_id = getattr(request, 'request_id', None)
+    
+    # ایجاد تراکنش
+    transaction = Transaction.objects.create(
+        transaction_id=Transaction.generate_transaction_id(),
+        wallet=wallet,
+        type='debit',
+        amount=amount,
+        balance_before=balance_before,
+        balance_after=balance_after,
+        description=description or 'برداشت از کیف پول',
+        status='completed',
+        reference_id=reference_id,
+        ip_address=ip_address,
+        user_agent=user_agent,
+        request_id=request_id
+    )
+    record_ledger_write([transaction])
+    
+    # ثبت رویداد در لاگ امنیتی درخواست (middleware یک رکورد برای کل درخواست ثبت می‌کند)
+    if request:
+        from users.core.audit_context import record_event
+        record_event(
+            event_type='transaction_create',
+            event_description=f'برداشت از کیف پول به مبلغ {amount}',
+            user=wallet.user,
+            request=request,
+            result='success',
+            metadata={
+                'transaction_id': transaction.transaction_id,
+                'amount': str(amount),
+                'balance_before': str(balance_before),
+                'balance_after': str(balance_after),
+            },
+            related_object=transaction
         )
-        
-        # به‌روزرسانی موجودی
-        wallet.balance = balance_after
-        wallet.save(update_fields=['balance', 'updated_at'])
-        
-        # ثبت لاگ امنیتی
-        if request:
-            from users.core.models import AuditLog
-            AuditLog.create_log(
-                event_type='transaction_create',
-                event_description=f'برداشت از کیف پول به مبلغ {amount}',
-                user=wallet.user,
-                request=request,
-                result='success',
-                metadata={
-                    'transaction_id': transaction.transaction_id,
-                    'amount': str(amount),
-                    'balance_before': str(balance_before),
-                    'balance_after': str(balance_after),
-                },
-                related_object=transaction
-            )
-        
-        return transaction
-    finally:
-        release_wallet_lock(wallet.id)
+    
+    return transaction
+
+
+def save_transfer_legs(pairs):
+    """
+    ثبت دو طرف انتقال‌ها (transfer_out, transfer_in) همراه با related_transaction
+
+    idها از قبل رزرو می‌شوند تا همه تراکنش‌ها و لینک دوطرفه در یک bulk_create
+    ثبت شوند؛ اگر پایگاه داده رزرو id را پشتیبانی نکند، طرف دوم پس از درج لینک
+    می‌شود.
+    """
+    ids = Transaction.reserve_ids(len(pairs) * 2)
+    if ids is not None:
+        for index, (sender_transaction, recipient_transaction) in enumerate(pairs):
+            sender_transaction.id = ids[index * 2]
+            recipient_transaction.id = ids[index * 2 + 1]
+            sender_transaction.related_transaction = recipient_transaction
+            recipient_transaction.related_transaction = sender_transaction
+        Transaction.objects.bulk_create([leg for pair in pairs for leg in pair])
+        record_ledger_write([leg for pair in pairs for leg in pair])
+        return
+
+    senders = [sender_transaction for sender_transaction, _ in pairs]
+    Transaction.objects.bulk_create(senders)
+    for sender_transaction, recipient_transaction in pairs:
+        recipient_transaction.related_transaction = sender_transaction
+    Transaction.objects.bulk_create([recipient_transaction for _, recipient_transaction in pairs])
+    for sender_transaction, recipient_transaction in pairs:
+        sender_transaction.related_transaction = recipient_transaction
+    Transaction.objects.bulk_update(senders, ['related_transaction'])
+    record_ledger_write([leg for pair in pairs for leg in pair])
 
 
 @db_transaction.atomic
@@ -222,40 +192,21 @@ def transfer_money(sender_wallet, recipient_wallet, amount, description='', meth
     """
     انتقال وجه بین دو کیف پول
     """
-    # قفل کردن هر دو کیف پول (به ترتیب ID برای جلوگیری از deadlock)
-    wallet_ids = sorted([sender_wallet.id, recipient_wallet.id])
+    # بررسی و ثبت اتمی محدودیت‌های انتقال؛ با هر rollback تراکنش برگردانده می‌شود
+    with limits.reservation(sender_wallet, amount):
+        # جابه‌جایی اتمی موجودی‌ها (قفل ردیف‌ها به ترتیب ID برای جلوگیری از deadlock)
+        sender_change, recipient_change = ledger.move(
+            sender_wallet.id, recipient_wallet.id, amount,
+            sender_shard_count=sender_wallet.shard_count,
+            recipient_shard_count=recipient_wallet.shard_count
+        )
+        sender_balance_before = sender_change.balance_before
+        sender_balance_after = sender_change.balance_after
+        recipient_balance_before = recipient_change.balance_before
+        recipient_balance_after = recipient_change.balance_after
+        sender_wallet.balance = sender_change.main_balance
+        recipient_wallet.balance = recipient_change.main_balance
     
-    locks_acquired = []
-    try:
-        for wallet_id in wallet_ids:
-            if not acquire_wallet_lock(wallet_id):
-                raise Exception("Wallet is currently being processed. Please try again.")
-            locks_acquired.append(wallet_id)
-        
-        # بررسی موجودی فرستنده
-        sender_wallet.refresh_from_db()
-        if sender_wallet.balance < amount:
-            raise ValueError("Insufficient balance")
-        
-        if sender_wallet.status != 'active':
-            raise ValueError("Sender wallet is not active")
-        
-        if recipient_wallet.status != 'active':
-            raise ValueError("Recipient wallet is not active")
-        
-        # بررسی محدودیت‌های انتقال
-        can_transfer, error_msg = check_transfer_limits(sender_wallet, amount)
-        if not can_transfer:
-            raise ValueError(error_msg)
-        
-        # محاسبه موجودی‌ها
-        sender_balance_before = sender_wallet.balance
-        sender_balance_after = sender_balance_before - amount
-        
-        recipient_wallet.refresh_from_db()
-        recipient_balance_before = recipient_wallet.balance
-        recipient_balance_after = recipient_balance_before + amount
-        
         # استخراج IP و user_agent از request
         ip_address = None
         user_agent = None
@@ -265,7 +216,7 @@ def transfer_money(sender_wallet, recipient_wallet, amount, description='', meth
             ip_address = AuditLog._get_client_ip(request)
             user_agent = request.META.get('HTTP_USER_AGENT', '')
             request_id = getattr(request, 'request_id', None)
-        
+    
         transfer_metadata = metadata.copy() if metadata else {}
         sender_metadata = transfer_metadata.copy()
         sender_metadata.setdefault('direction', 'outgoing')
@@ -277,8 +228,8 @@ def transfer_money(sender_wallet, recipient_wallet, amount, description='', meth
         recipient_metadata.setdefault('sender_wallet_id', sender_wallet.id)
         recipient_metadata.setdefault('sender_user_id', sender_wallet.user_id)
 
-        # ایجاد تراکنش فرستنده
-        sender_transaction = Transaction.objects.create(
+        # تراکنش فرستنده
+        sender_transaction = Transaction(
             transaction_id=Transaction.generate_transaction_id(),
             wallet=sender_wallet,
             type='transfer_out',
@@ -294,9 +245,9 @@ def transfer_money(sender_wallet, recipient_wallet, amount, description='', meth
             user_agent=user_agent,
             request_id=request_id
         )
-        
-        # ایجاد تراکنش دریافت‌کننده
-        recipient_transaction = Transaction.objects.create(
+    
+        # تراکنش دریافت‌کننده
+        recipient_transaction = Transaction(
             transaction_id=Transaction.generate_transaction_id(),
             wallet=recipient_wallet,
             type='transfer_in',
@@ -305,32 +256,20 @@ def transfer_money(sender_wallet, recipient_wallet, amount, description='', meth
             balance_after=recipient_balance_after,
             description=description or 'دریافت انتقال وجه',
             status='completed',
-            related_transaction=sender_transaction,
             transfer_method=method,
             metadata=recipient_metadata,
             ip_address=ip_address,
             user_agent=user_agent,
             request_id=request_id
         )
-        
-        # لینک کردن تراکنش‌ها
-        sender_transaction.related_transaction = recipient_transaction
-        sender_transaction.save(update_fields=['related_transaction'])
-        
-        # به‌روزرسانی موجودی‌ها
-        sender_wallet.balance = sender_balance_after
-        sender_wallet.save(update_fields=['balance', 'updated_at'])
-        
-        recipient_wallet.balance = recipient_balance_after
-        recipient_wallet.save(update_fields=['balance', 'updated_at'])
-        
-        # به‌روزرسانی محدودیت‌های انتقال
-        update_transfer_limits(sender_wallet, amount)
-        
-        # ثبت لاگ امنیتی
+    
+        # ثبت هر دو طرف و لینک آن‌ها با یک INSERT
+        save_transfer_legs([(sender_transaction, recipient_transaction)])
+    
+        # ثبت رویداد در لاگ امنیتی درخواست (middleware یک رکورد برای کل درخواست ثبت می‌کند)
         if request:
-            from users.core.models import AuditLog
-            AuditLog.create_log(
+            from users.core.audit_context import record_event
+            record_event(
                 event_type='transaction_create',
                 event_description=f'انتقال وجه به مبلغ {amount} از {sender_wallet.user.phone} به {recipient_wallet.user.phone}',
                 user=sender_wallet.user,
@@ -343,15 +282,225 @@ def transfer_money(sender_wallet, recipient_wallet, amount, description='', meth
                     'method': method or 'unknown',
                     'sender_balance_before': str(sender_balance_before),
                     'sender_balance_after': str(sender_balance_after),
-                    'recipient_balance_before': str(recipient_balance_before),
-                    'recipient_balance_after': str(recipient_balance_after),
+                    # برای واریز روی شارد موجودی کل ثبت نمی‌شود
+                    'recipient_balance_before': None if recipient_balance_before is None else str(recipient_balance_before),
+                    'recipient_balance_after': None if recipient_balance_after is None else str(recipient_balance_after),
                 },
                 related_object=sender_transaction
             )
-        
+    
         return sender_transaction, recipient_transaction
-    finally:
-        # آزاد کردن قفل‌ها
-        for wallet_id in locks_acquired:
-            release_wallet_lock(wallet_id)
 
+
+MAX_BULK_TRANSFER_ITEMS = 1000  # حداکثر تعداد دریافت‌کننده در هر پرداخت گروهی
+
+
+def resolve_bulk_recipients(items):
+    """
+    یافتن کیف پول دریافت‌کنندگان پرداخت گروهی با حداکثر سه کوئری
+    (شماره موبایل، آدرس کیف پول، کد اختصاصی)
+
+    خروجی: دیکشنری (روش، مقدار) -> Wallet
+    """
+    from .models import SpecialCode
+    from users.core.models import User
+
+    phones = {item['phone'] for item in items if item.get('phone')}
+    addresses = {item['wallet_address'] for item in items if item.get('wallet_address')}
+    codes = {item['special_code'] for item in items if item.get('special_code')}
+
+    resolved = {}
+    if phones:
+        for user in User.objects.filter(phone__in=phones).select_related('wallet'):
+            wallet = getattr(user, 'wallet', None)
+            if wallet is not None:
+                resolved[('phone', str(user.phone))] = wallet
+    if addresses:
+        for wallet in Wallet.objects.filter(wallet_address__in=addresses).select_related('user'):
+            resolved[('wallet_address', wallet.wallet_address)] = wallet
+    if codes:
+        special_codes = SpecialCode.objects.filter(
+            code__in=codes, is_active=True
+        ).select_related('user', 'user__wallet')
+        for special_code in special_codes:
+            wallet = getattr(special_code.user, 'wallet', None)
+            if wallet is not None:
+                resolved[('special_code', special_code.code)] = wallet
+    return resolved
+
+
+def _bulk_item_key(item):
+    """تعیین روش و مقدار شناسایی دریافت‌کننده یک آیتم پرداخت گروهی"""
+    for method in ('special_code', 'wallet_address', 'phone'):
+        if item.get(method):
+            return method, item[method]
+    return None, None
+
+
+@db_transaction.atomic
+def bulk_transfer(sender_wallet, items, description='', metadata=None, request=None):
+    """
+    پرداخت گروهی از یک کیف پول به چند دریافت‌کننده
+
+    هر آیتم شامل amount و یکی از phone / wallet_address / special_code است.
+    کیف پول فرستنده یک بار قفل و یک بار کسر می‌شود، محدودیت روزانه یک بار برای
+    مجموع مبلغ بررسی می‌شود (کل دسته یک انتقال حساب می‌شود) و تمام تراکنش‌ها با
+    bulk_create ثبت می‌شوند. آیتم‌هایی که دریافت‌کننده معتبر ندارند به‌صورت جداگانه
+    ناموفق گزارش می‌شوند؛ کمبود موجودی یا عبور از محدودیت کل دسته را رد می‌کند.
+
+    خروجی: (batch_id, لیست نتیجه هر آیتم)
+    """
+    if len(items) > MAX_BULK_TRANSFER_ITEMS:
+        raise ValueError(f"A bulk transfer can contain at most {MAX_BULK_TRANSFER_ITEMS} items")
+
+    batch_id = f"batch_{Transaction.generate_transaction_id()[4:]}"
+    batch_metadata = metadata.copy() if metadata else {}
+    batch_metadata['batch_id'] = batch_id
+
+    resolved = resolve_bulk_recipients(items)
+    results = [None] * len(items)
+    accepted = []  # (index, item, method, recipient_wallet)
+    for index, item in enumerate(items):
+        method, value = _bulk_item_key(item)
+        recipient_wallet = resolved.get((method, value))
+        if recipient_wallet is None:
+            results[index] = {'index': index, 'success': False, 'detail': 'Recipient wallet not found'}
+        elif recipient_wallet.id == sender_wallet.id:
+            results[index] = {'index': index, 'success': False, 'detail': 'Cannot transfer to your own wallet'}
+        else:
+            accepted.append((index, item, method, recipient_wallet))
+
+    # قفل همه کیف پول‌ها در یک دستور (به ترتیب ID)
+    locked = ledger.lock_wallets([sender_wallet.id] + [entry[3].id for entry in accepted])
+    payable = []
+    for index, item, method, recipient_wallet in accepted:
+        state = locked.get(recipient_wallet.id)
+        if state is None or state['status'] != 'active':
+            results[index] = {'index': index, 'success': False, 'detail': 'Recipient wallet is not active'}
+        else:
+            payable.append((index, item, method, recipient_wallet))
+
+    if not payable:
+        return batch_id, results
+
+    total_amount = sum((item['amount'] for _, item, _, _ in payable), Decimal('0'))
+
+    # بررسی و ثبت اتمی محدودیت‌های انتقال برای مجموع مبلغ؛ با هر rollback تراکنش برگردانده می‌شود
+    with limits.reservation(sender_wallet, total_amount):
+        # کسر یک‌باره مجموع مبلغ از فرستنده و واریز به دریافت‌کنندگان
+        sender_change = ledger.debit(
+            sender_wallet.id, total_amount, label='Sender wallet', shard_count=sender_wallet.shard_count
+        )
+        credits = {}
+        for _, item, _, recipient_wallet in payable:
+            credits[recipient_wallet.id] = credits.get(recipient_wallet.id, Decimal('0')) + item['amount']
+        ledger.credit_many(credits)
+        sender_wallet.balance = sender_change.main_balance
+
+        # استخراج IP و user_agent از request
+        ip_address = None
+        user_agent = None
+        request_id = None
+        if request:
+            from users.core.models import AuditLog
+            ip_address = AuditLog._get_client_ip(request)
+            user_agent = request.META.get('HTTP_USER_AGENT', '')
+            request_id = getattr(request, 'request_id', None)
+
+        sender_running = sender_change.balance_before
+        # موجودی کل دریافت‌کنندگان شارد‌شده شامل شاردها (قفل‌شده تا پایان تراکنش) است
+        shard_totals = ledger.lock_shard_totals(
+            [recipient_wallet.id for _, _, _, recipient_wallet in payable if recipient_wallet.shard_count]
+        )
+        recipient_running = {
+            wallet_id: locked[wallet_id]['balance'] + shard_totals.get(wallet_id, Decimal('0'))
+            for wallet_id in credits
+        }
+        sender_transactions = []
+        recipient_transactions = []
+        for index, item, method, recipient_wallet in payable:
+            amount = item['amount']
+            item_description = item.get('description') or description
+            item_metadata = batch_metadata.copy()
+            item_metadata['batch_index'] = index
+
+            sender_metadata = item_metadata.copy()
+            sender_metadata['direction'] = 'outgoing'
+            sender_metadata['recipient_wallet_id'] = recipient_wallet.id
+            sender_metadata['recipient_user_id'] = recipient_wallet.user_id
+            sender_transactions.append(Transaction(
+                transaction_id=Transaction.generate_transaction_id(),
+                wallet=sender_wallet,
+                type='transfer_out',
+                amount=amount,
+                balance_before=sender_running,
+                balance_after=sender_running - amount,
+                description=item_description or 'پرداخت گروهی',
+                status='completed',
+                recipient_wallet=recipient_wallet,
+                transfer_method=method,
+                metadata=sender_metadata,
+                ip_address=ip_address,
+                user_agent=user_agent,
+                request_id=request_id
+            ))
+            sender_running -= amount
+
+            recipient_metadata = item_metadata.copy()
+            recipient_metadata['direction'] = 'incoming'
+            recipient_metadata['sender_wallet_id'] = sender_wallet.id
+            recipient_metadata['sender_user_id'] = sender_wallet.user_id
+            before = recipient_running[recipient_wallet.id]
+            recipient_transactions.append(Transaction(
+                transaction_id=Transaction.generate_transaction_id(),
+                wallet=recipient_wallet,
+                type='transfer_in',
+                amount=amount,
+                balance_before=before,
+                balance_after=before + amount,
+                description=item_description or 'دریافت پرداخت گروهی',
+                status='completed',
+                transfer_method=method,
+                metadata=recipient_metadata,
+                ip_address=ip_address,
+                user_agent=user_agent,
+                request_id=request_id
+            ))
+            recipient_running[recipient_wallet.id] = before + amount
+
+        # ثبت تراکنش‌ها و لینک کردن دو طرف هر انتقال
+        save_transfer_legs(list(zip(sender_transactions, recipient_transactions)))
+
+        for (index, item, method, recipient_wallet), sender_transaction in zip(payable, sender_transactions):
+            results[index] = {
+                'index': index,
+                'success': True,
+                'transaction_id': sender_transaction.transaction_id,
+                'amount': item['amount'],
+                'method': method,
+                'recipient': {
+                    'phone': str(recipient_wallet.user.phone),
+                    'fullname': recipient_wallet.user.fullname or ''
+                },
+            }
+
+        # ثبت رویداد در لاگ امنیتی درخواست (middleware یک رکورد برای کل درخواست ثبت می‌کند)
+        if request:
+            from users.core.audit_context import record_event
+            record_event(
+                event_type='transaction_create',
+                event_description=f'پرداخت گروهی به مبلغ {total_amount} به {len(payable)} دریافت‌کننده',
+                user=sender_wallet.user,
+                request=request,
+                result='success',
+                metadata={
+                    'batch_id': batch_id,
+                    'total_amount': str(total_amount),
+                    'succeeded': len(payable),
+                    'failed': len(items) - len(payable),
+                    'sender_balance_before': str(sender_change.balance_before),
+                    'sender_balance_after': str(sender_change.balance_after),
+                }
+            )
+
+    return batch_id, results
@@ -1,39 +1,36 @@
-from rest_framework import status, views, viewsets, permissions
+from rest_framework import status, viewsets, permissions
 from rest_framework.response import Response
 from rest_framework.decorators import action
 from django.utils import timezone
-from django.db import transaction as db_transaction
 from django.core.paginator import Paginator
-from django.db.models import Q, Sum, Count
-from django.db.models.functions import TruncWeek, TruncMonth, TruncDate
+from django.db.models import Q
 from django.http import HttpResponse
 from decimal import Decimal
-from io import BytesIO
-import qrcode
-from qrcode.constants import ERROR_CORRECT_M
-from PIL import Image
 
 from .models import Wallet, Transaction, PaymentRequest, WalletQRCode, PaymentLink, SpecialCode
 from .serializers import (
     WalletSerializer, WalletCreateSerializer,
     ChargeSerializer, DebitSerializer, TransferSerializer,
     TransactionSerializer, TransactionDetailSerializer,
-    BalanceSerializer, ChargeResponseSerializer,
+    BalanceSerializer, BalanceAtQuerySerializer, BalanceAtSerializer, ChargeResponseSerializer,
     DebitResponseSerializer, TransferResponseSerializer,
     GatewayChargeSerializer, GatewayChargeResponseSerializer,
-    QRGenerateSerializer, QRGenerateResponseSerializer,
+    QRGenerateSerializer, QRGenerateResponseSerializer, QRBatchGenerateSerializer,
     QRPayloadSerializer, QRInfoSerializer,
     LinkGenerateSerializer, LinkGenerateResponseSerializer,
-    TransactionReportSerializer, TransactionReportSummarySerializer,
-    TransactionReportChartDataSerializer
-)
-from .utils import (
-    charge_wallet, debit_wallet, transfer_money,
-    MIN_TRANSFER_AMOUNT
+    TransactionReportSerializer,
+    BulkTransferSerializer, BulkTransferResponseSerializer
 )
+from .utils import bulk_transfer
+from .command_queue import WalletCommandPending, charge_wallet, debit_wallet, transfer_money
 from .payment_gateway import PaymentGatewayService
+from .idempotency import idempotent
+from .checkpoints import balance_at
+from . import daily_stats, lookup_cache, qr_batch, qr_render
+from .response_cache import cached_response
 from django.conf import settings
 from users.core.models import User
+from users.core.pagination import get_page_size, keyset_page, wants_count
 
 
 class WalletViewSet(viewsets.ViewSet):
@@ -103,15 +100,48 @@ class WalletViewSet(viewsets.ViewSet):
                 status=status.HTTP_404_NOT_FOUND
             )
         
+        return cached_response(request, wallet.id, 'balance', lambda: self._build_balance(wallet))
+    
+    def _build_balance(self, wallet):
         data = {
-            'balance': wallet.balance,
+            'balance': wallet.total_balance,
             'currency': wallet.currency,
             'formatted_balance': wallet.get_formatted_balance()
         }
         serializer = BalanceSerializer(data)
         return Response(serializer.data, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['get'], url_path='balance/at')
+    def balance_at(self, request):
+        """
+        دریافت موجودی کیف پول در یک لحظه دلخواه
+        GET /api/wallet/balance/at/?at=2025-01-01T12:00:00Z
+        """
+        try:
+            wallet = request.user.wallet
+        except Wallet.DoesNotExist:
+            return Response(
+                {'detail': 'Wallet not found'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+        query = BalanceAtQuerySerializer(data=request.query_params)
+        if not query.is_valid():
+            return Response(query.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        at = query.validated_data['at']
+        balance, checkpoint = balance_at(wallet, at)
+        data = {
+            'at': at,
+            'balance': balance,
+            'currency': wallet.currency,
+            'checkpoint_as_of': checkpoint.as_of if checkpoint else None
+        }
+        serializer = BalanceAtSerializer(data)
+        return Response(serializer.data, status=status.HTTP_200_OK)
     
     @action(detail=False, methods=['post'], url_path='charge')
+    @idempotent
     def charge(self, request):
         """
         شارژ کیف پول
@@ -154,13 +184,24 @@ class WalletViewSet(viewsets.ViewSet):
             }
             response_serializer = ChargeResponseSerializer(response_data)
             return Response(response_serializer.data, status=status.HTTP_200_OK)
-        except Exception as e:
+        except WalletCommandPending as e:
+            return Response(
+                {'detail': str(e), 'command_id': e.command_id},
+                status=status.HTTP_202_ACCEPTED
+            )
+        except ValueError as e:
             return Response(
                 {'detail': str(e)},
                 status=status.HTTP_400_BAD_REQUEST
             )
+        except Exception as e:
+            return Response(
+                {'detail': str(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
     
     @action(detail=False, methods=['post'], url_path='debit')
+    @idempotent
     def debit(self, request):
         """
         برداشت از کیف پول
@@ -202,6 +243,11 @@ class WalletViewSet(viewsets.ViewSet):
             }
             response_serializer = DebitResponseSerializer(response_data)
             return Response(response_serializer.data, status=status.HTTP_200_OK)
+        except WalletCommandPending as e:
+            return Response(
+                {'detail': str(e), 'command_id': e.command_id},
+                status=status.HTTP_202_ACCEPTED
+            )
         except ValueError as e:
             return Response(
                 {'detail': str(e)},
@@ -214,6 +260,7 @@ class WalletViewSet(viewsets.ViewSet):
             )
     
     @action(detail=False, methods=['post'], url_path='transfer')
+    @idempotent
     def transfer(self, request):
         """
         انتقال وجه
@@ -249,30 +296,31 @@ class WalletViewSet(viewsets.ViewSet):
 
         if method == 'qr':
             qr_payload = metadata.get('qr_payload') or metadata.get('payload')
-            try:
-                qr_instance = WalletQRCode.objects.select_related('wallet__user').get(qr_payload=qr_payload)
-            except WalletQRCode.DoesNotExist:
+            qr_instance = lookup_cache.get_qr(qr_payload) if qr_payload else None
+            if qr_instance is None:
                 return Response(
                     {'detail': 'QR code not found'},
                     status=status.HTTP_404_NOT_FOUND
                 )
 
-            if qr_instance.status != 'active':
+            if qr_instance['status'] != 'active':
                 return Response(
                     {'detail': 'QR code is not active'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
 
-            if qr_instance.is_expired():
-                if qr_instance.status != 'expired':
-                    qr_instance.status = 'expired'
-                    qr_instance.save(update_fields=['status', 'updated_at'])
+            if lookup_cache.is_expired(qr_instance):
                 return Response(
                     {'detail': 'QR code is expired'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
 
-            recipient_wallet = qr_instance.wallet
+            recipient_wallet = lookup_cache.owner_wallet(qr_instance)
+            if recipient_wallet is None:
+                return Response(
+                    {'detail': 'Recipient wallet not found'},
+                    status=status.HTTP_404_NOT_FOUND
+                )
             recipient_user = recipient_wallet.user
 
             if sender_wallet.id == recipient_wallet.id:
@@ -288,7 +336,7 @@ class WalletViewSet(viewsets.ViewSet):
                 )
 
             if amount is None:
-                amount = qr_instance.amount
+                amount = qr_instance['amount']
             if amount is None:
                 return Response(
                     {'detail': 'Amount is required for this QR'},
@@ -301,14 +349,14 @@ class WalletViewSet(viewsets.ViewSet):
                 )
 
             if not description:
-                description = qr_instance.description or 'پرداخت با QR'
+                description = qr_instance['description'] or 'پرداخت با QR'
 
             metadata = dict(metadata or {})
-            metadata.setdefault('qr_payload', qr_instance.qr_payload)
-            metadata.setdefault('qr_id', qr_instance.id)
+            metadata.setdefault('qr_payload', qr_instance['qr_payload'])
+            metadata.setdefault('qr_id', qr_instance['id'])
             metadata.setdefault('qr_owner_wallet_id', recipient_wallet.id)
             metadata.setdefault('qr_owner_user_id', recipient_wallet.user_id)
-            metadata.setdefault('qr_fixed_amount', bool(qr_instance.amount is not None))
+            metadata.setdefault('qr_fixed_amount', bool(qr_instance['amount'] is not None))
         elif method == 'wallet_address':
             # انتقال با آدرس کیف پول (24 رقمی)
             wallet_address = metadata.get('wallet_address')
@@ -415,39 +463,40 @@ class WalletViewSet(viewsets.ViewSet):
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
-            try:
-                payment_link = PaymentLink.objects.select_related('wallet', 'wallet__user').get(link_id=payment_link_id)
-            except PaymentLink.DoesNotExist:
+            payment_link = lookup_cache.get_link(payment_link_id)
+            if payment_link is None:
                 return Response(
                     {'detail': 'Payment link not found'},
                     status=status.HTTP_404_NOT_FOUND
                 )
             
             # بررسی انقضا
-            if payment_link.is_expired():
-                if payment_link.status != 'expired':
-                    payment_link.status = 'expired'
-                    payment_link.save(update_fields=['status', 'updated_at'])
+            if lookup_cache.is_expired(payment_link):
                 return Response(
                     {'detail': 'Payment link is expired'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
             # بررسی استفاده شده
-            if payment_link.status == 'used':
+            if payment_link['status'] == 'used':
                 return Response(
                     {'detail': 'Payment link has already been used'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
-            if payment_link.status != 'active':
+            if payment_link['status'] != 'active':
                 return Response(
                     {'detail': 'Payment link is not active'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
             # یافتن کیف پول دریافت‌کننده (صاحب لینک)
-            recipient_wallet = payment_link.wallet
+            recipient_wallet = lookup_cache.owner_wallet(payment_link)
+            if recipient_wallet is None:
+                return Response(
+                    {'detail': 'Recipient wallet not found'},
+                    status=status.HTTP_404_NOT_FOUND
+                )
             recipient_user = recipient_wallet.user
             
             # بررسی اینکه کاربر به خودش پول نزند
@@ -465,10 +514,10 @@ class WalletViewSet(viewsets.ViewSet):
             
             # استفاده از مبلغ لینک (اگر amount ارسال نشده باشد)
             if amount is None:
-                amount = payment_link.amount
-            elif amount != payment_link.amount:
+                amount = payment_link['amount']
+            elif amount != payment_link['amount']:
                 return Response(
-                    {'detail': f'Amount must be exactly {payment_link.amount} as specified in the payment link'},
+                    {'detail': f"Amount must be exactly {payment_link['amount']} as specified in the payment link"},
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
@@ -565,6 +614,19 @@ class WalletViewSet(viewsets.ViewSet):
             transfer_metadata.setdefault('method', method)
             transfer_metadata.setdefault('initiator_user_id', request.user.id)
             
+            usage_metadata = {
+                'used_by_wallet_id': sender_wallet.id,
+                'used_by_user_id': request.user.id,
+                'amount': str(amount)
+            }
+            # QR/لینک در همان تراکنشی که پول را جابه‌جا می‌کند (در حالت صف‌محور در worker)
+            # مصرف می‌شود؛ ورودی cache ممکن است کهنه باشد. QR ثابت چندبارمصرف است و فعال می‌ماند.
+            claim = None
+            if qr_instance:
+                claim = {'qr_payload': qr_instance['qr_payload'], 'usage_metadata': usage_metadata}
+            elif method == 'link' and transfer_metadata.get('payment_link_id'):
+                claim = {'payment_link_id': transfer_metadata['payment_link_id'], 'usage_metadata': usage_metadata}
+
             sender_transaction, recipient_transaction = transfer_money(
                 sender_wallet=sender_wallet,
                 recipient_wallet=recipient_wallet,
@@ -572,32 +634,9 @@ class WalletViewSet(viewsets.ViewSet):
                 description=description,
                 method=method,
                 metadata=transfer_metadata,
+                claim=claim,
                 request=request
             )
-
-            if qr_instance:
-                qr_instance.mark_used({
-                    'used_by_wallet_id': sender_wallet.id,
-                    'used_by_user_id': request.user.id,
-                    'amount': str(amount)
-                })
-            
-            # اگر از لینک پرداخت استفاده شده، آن را علامت‌گذاری می‌کنیم
-            if method == 'link':
-                payment_link_id = transfer_metadata.get('payment_link_id')
-                if payment_link_id:
-                    try:
-                        payment_link = PaymentLink.objects.get(link_id=payment_link_id)
-                        payment_link.mark_used(
-                            used_by_wallet=sender_wallet,
-                            usage_metadata={
-                                'used_by_user_id': request.user.id,
-                                'amount': str(amount),
-                                'transaction_id': sender_transaction.transaction_id
-                            }
-                        )
-                    except PaymentLink.DoesNotExist:
-                        pass  # لینک پیدا نشد، اما تراکنش انجام شده است
             
             response_data = {
                 'transaction_id': sender_transaction.transaction_id,
@@ -614,6 +653,69 @@ class WalletViewSet(viewsets.ViewSet):
             }
             response_serializer = TransferResponseSerializer(response_data)
             return Response(response_serializer.data, status=status.HTTP_200_OK)
+        except WalletCommandPending as e:
+            return Response(
+                {'detail': str(e), 'command_id': e.command_id},
+                status=status.HTTP_202_ACCEPTED
+            )
+        except ValueError as e:
+            return Response(
+                {'detail': str(e)},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        except Exception as e:
+            return Response(
+                {'detail': str(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+    @action(detail=False, methods=['post'], url_path='transfer/bulk')
+    @idempotent
+    def bulk_transfer(self, request):
+        """
+        پرداخت گروهی به چند دریافت‌کننده (مثلاً پرداخت به رانندگان ناوگان)
+        POST /api/wallet/transfer/bulk/
+
+        Body:
+        {
+          "items": [
+            {"special_code": "12345", "amount": 150000},
+            {"phone": "+989121234567", "amount": 200000},
+            {"wallet_address": "PAYA...", "amount": 50000, "description": "..."}
+          ],
+          "description": "تسویه هفتگی",
+          "metadata": {}
+        }
+        """
+        try:
+            sender_wallet = request.user.wallet
+        except Wallet.DoesNotExist:
+            return Response(
+                {'detail': 'Wallet not found'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+        if sender_wallet.status != 'active':
+            return Response(
+                {'detail': 'Wallet is not active'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        serializer = BulkTransferSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        metadata = dict(serializer.validated_data.get('metadata') or {})
+        metadata.setdefault('initiator_user_id', request.user.id)
+
+        try:
+            batch_id, results = bulk_transfer(
+                sender_wallet=sender_wallet,
+                items=serializer.validated_data['items'],
+                description=serializer.validated_data.get('description', ''),
+                metadata=metadata,
+                request=request
+            )
         except ValueError as e:
             return Response(
                 {'detail': str(e)},
@@ -625,6 +727,19 @@ class WalletViewSet(viewsets.ViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+        succeeded = [result for result in results if result['success']]
+        sender_wallet.refresh_from_db(fields=['balance', 'shard_count'])
+        response_data = {
+            'batch_id': batch_id,
+            'total_amount': sum((result['amount'] for result in succeeded), Decimal('0')),
+            'succeeded': len(succeeded),
+            'failed': len(results) - len(succeeded),
+            'balance_after': sender_wallet.total_balance,
+            'results': results
+        }
+        response_serializer = BulkTransferResponseSerializer(response_data)
+        return Response(response_serializer.data, status=status.HTTP_200_OK)
+
     @action(detail=False, methods=['get'], url_path='transactions')
     def transactions(self, request):
         """
@@ -657,22 +772,46 @@ class WalletViewSet(viewsets.ViewSet):
             queryset = queryset.filter(created_at__lte=end_date)
         
         # Pagination
-        page = int(request.query_params.get('page', 1))
-        page_size = int(request.query_params.get('page_size', 20))
+        page_size = get_page_size(request)
+        if 'page' in request.query_params and 'cursor' not in request.query_params:
+            # صفحه‌بندی قدیمی با شماره صفحه برای نسخه‌های قبلی اپلیکیشن
+            page = int(request.query_params.get('page', 1))
+            paginator = Paginator(
+                TransactionSerializer.setup_eager_loading(queryset).order_by('-created_at', '-id'), page_size
+            )
+            page_obj = paginator.get_page(page)
+            
+            serializer = TransactionSerializer(page_obj.object_list, many=True)
+            
+            return Response({
+                'count': paginator.count,
+                'next': page_obj.next_page_number() if page_obj.has_next() else None,
+                'previous': page_obj.previous_page_number() if page_obj.has_previous() else None,
+                'results': serializer.data
+            }, status=status.HTTP_200_OK)
         
-        paginator = Paginator(queryset, page_size)
-        page_obj = paginator.get_page(page)
+        # صفحه‌بندی keyset: next یک cursor مبهم است و count فقط با include_count=true
+        try:
+            page_data = keyset_page(
+                TransactionSerializer.setup_eager_loading(queryset),
+                cursor=request.query_params.get('cursor'),
+                page_size=page_size,
+                include_count=wants_count(request)
+            )
+        except ValueError as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         
-        serializer = TransactionSerializer(page_obj.object_list, many=True)
+        serializer = TransactionSerializer(page_data['results'], many=True)
         
         return Response({
-            'count': paginator.count,
-            'next': page_obj.next_page_number() if page_obj.has_next() else None,
-            'previous': page_obj.previous_page_number() if page_obj.has_previous() else None,
+            'count': page_data['count'],
+            'next': page_data['next'],
+            'previous': None,
             'results': serializer.data
         }, status=status.HTTP_200_OK)
     
     @action(detail=False, methods=['post'], url_path='charge-gateway')
+    @idempotent
     def charge_gateway(self, request):
         """
         درخواست شارژ کیف پول از طریق درگاه پرداخت
@@ -901,6 +1040,51 @@ class WalletViewSet(viewsets.ViewSet):
         response_serializer = QRGenerateResponseSerializer(response_payload)
         return Response(response_serializer.data, status=status.HTTP_201_CREATED)
 
+    @action(detail=False, methods=['post'], url_path='qr/batch')
+    def generate_qr_batch(self, request):
+        """
+        تولید دسته‌ای QR ثابت برای چاپ
+        POST /api/wallet/qr/batch/
+        
+        خروجی: فایل PDF (برگه‌های A4) یا ZIP (PNG + index.csv)
+        """
+        try:
+            wallet = request.user.wallet
+        except Wallet.DoesNotExist:
+            return Response(
+                {'detail': 'Wallet not found'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+        if wallet.status != 'active':
+            return Response(
+                {'detail': 'Wallet is not active'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        serializer = QRBatchGenerateSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        data = serializer.validated_data
+        output_format = data['output_format']
+        batch_id, qr_codes, content = qr_batch.generate_batch(
+            wallet,
+            data['count'],
+            amount=data.get('amount'),
+            description=data.get('description', ''),
+            expires_in=data.get('expires_in'),
+            metadata=data.get('metadata', {}),
+            output_format=output_format,
+            size=data.get('size')
+        )
+
+        response = HttpResponse(content, content_type=qr_batch.OUTPUT_FORMATS[output_format])
+        response['Content-Disposition'] = f'attachment; filename="qr-batch-{batch_id}.{output_format}"'
+        response['X-QR-Batch-Id'] = batch_id
+        response['X-QR-Count'] = str(len(qr_codes))
+        return response
+
     @action(detail=False, methods=['post'], url_path='qr/lookup')
     def lookup_qr(self, request):
         """
@@ -912,31 +1096,31 @@ class WalletViewSet(viewsets.ViewSet):
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
         payload = serializer.validated_data['qr_payload']
-        try:
-            qr = WalletQRCode.objects.select_related('wallet__user').get(qr_payload=payload)
-        except WalletQRCode.DoesNotExist:
+        qr = lookup_cache.get_qr(payload)
+        if qr is None:
             return Response({'detail': 'QR code not found'}, status=status.HTTP_404_NOT_FOUND)
 
-        if qr.status == 'active' and qr.is_expired():
-            qr.status = 'expired'
-            qr.save(update_fields=['status', 'updated_at'])
+        # تا اجرای expire_payment_codes_task وضعیت ذخیره‌شده هنوز active است
+        qr_status = qr['status']
+        if qr_status == 'active' and lookup_cache.is_expired(qr):
+            qr_status = 'expired'
 
         owner_info = {
-            'wallet_id': qr.wallet.id,
-            'user_id': qr.wallet.user_id,
-            'phone': str(qr.wallet.user.phone),
-            'fullname': qr.wallet.user.fullname or ''
+            'wallet_id': qr['wallet_id'],
+            'user_id': qr['user_id'],
+            'phone': qr['phone'],
+            'fullname': qr['fullname']
         }
 
         info_payload = {
-            'qr_payload': qr.qr_payload,
-            'status': qr.status,
-            'expires_at': qr.expires_at,
-            'amount': qr.amount,
-            'description': qr.description,
-            'qr_content': f"PAYAQR:{qr.qr_payload}",
+            'qr_payload': qr['qr_payload'],
+            'status': qr_status,
+            'expires_at': qr['expires_at'],
+            'amount': qr['amount'],
+            'description': qr['description'],
+            'qr_content': qr_render.qr_content(qr['qr_payload']),
             'owner': owner_info,
-            'metadata': qr.metadata,
+            'metadata': qr['metadata'],
         }
 
         response_serializer = QRInfoSerializer(info_payload)
@@ -955,17 +1139,14 @@ class WalletViewSet(viewsets.ViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        try:
-            qr = WalletQRCode.objects.get(qr_payload=qr_payload)
-        except WalletQRCode.DoesNotExist:
+        qr = lookup_cache.get_qr(qr_payload)
+        if qr is None:
             return Response(
                 {'detail': 'QR code not found'},
                 status=status.HTTP_404_NOT_FOUND
             )
 
-        if qr.status == 'active' and qr.is_expired():
-            qr.status = 'expired'
-            qr.save(update_fields=['status', 'updated_at'])
+        if qr['status'] == 'active' and lookup_cache.is_expired(qr):
             return Response(
                 {'detail': 'QR code is expired'},
                 status=status.HTTP_400_BAD_REQUEST
@@ -981,33 +1162,27 @@ class WalletViewSet(viewsets.ViewSet):
                     {'detail': 'size must be an integer'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
-            target_size = max(128, min(target_size, 1024))
+            target_size = qr_render.clamp_size(target_size)
 
-        qr_content = f"PAYAQR:{qr.qr_payload}"
-
-        qr_factory = qrcode.QRCode(
-            version=None,
-            error_correction=ERROR_CORRECT_M,
-            box_size=10,
-            border=4,
-        )
-        qr_factory.add_data(qr_content)
-        qr_factory.make(fit=True)
-        image = qr_factory.make_image(fill_color="black", back_color="white").convert("RGB")
-
-        if target_size:
-            image = image.resize((target_size, target_size), resample=Image.NEAREST)
-
-        buffer = BytesIO()
-        image.save(buffer, format='PNG')
-        buffer.seek(0)
+        # ETag از hash ورودی‌های رندر است؛ برای 304 نیازی به رندر نیست
+        content = qr_render.qr_content(qr['qr_payload'])
+        etag = qr_render.etag_for(qr_render.render_key(content, target_size))
+        if_none_match = [tag.strip() for tag in request.headers.get('If-None-Match', '').split(',')]
+        if etag in if_none_match:
+            response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            image_data, _ = qr_render.get_png(content, target_size)
+            response = HttpResponse(image_data, content_type='image/png')
+            response['Content-Disposition'] = f'inline; filename="{qr_payload}.png"'
 
-        response = HttpResponse(buffer.getvalue(), content_type='image/png')
-        response['Content-Disposition'] = f'inline; filename="{qr.qr_payload}.png"'
-        response['Cache-Control'] = 'max-age=300'
-        response['X-QR-Status'] = qr.status
+        # اعتبار cache کلاینت تا زمان انقضای QR
+        if qr['status'] == 'active':
+            response['Cache-Control'] = f'private, max-age={lookup_cache.max_age(qr)}'
+        else:
+            response['Cache-Control'] = 'private, no-cache'
+        response['ETag'] = etag
+        response['X-QR-Status'] = qr['status']
         return response
-
     @action(detail=False, methods=['get'], url_path='special-code/me')
     def get_special_code(self, request):
         """
@@ -1181,8 +1356,11 @@ class WalletViewSet(viewsets.ViewSet):
         - end_date: تاریخ پایان (ISO format: YYYY-MM-DD)
         - transaction_type: نوع تراکنش ('all', 'charge', 'debit', 'transfer_in', 'transfer_out')
         - search: جستجو در توضیحات یا transaction_id
-        - page: شماره صفحه - پیش‌فرض: 1
+        - cursor: cursor صفحه بعد (next_cursor پاسخ قبلی)
+        - page: شماره صفحه (صفحه‌بندی قدیمی، فقط در صورت نبود cursor)
         - page_size: تعداد در هر صفحه - پیش‌فرض: 20
+        
+        پاسخ تا تراکنش بعدی کیف پول cache می‌شود (ETag / If-None-Match)
         """
         try:
             wallet = request.user.wallet
@@ -1192,6 +1370,10 @@ class WalletViewSet(viewsets.ViewSet):
                 status=status.HTTP_404_NOT_FOUND
             )
         
+        return cached_response(request, wallet.id, 'report', lambda: self._build_report(request, wallet))
+    
+    def _build_report(self, request, wallet):
+        """ساخت پاسخ گزارش تراکنش‌ها"""
         # دریافت پارامترهای جستجو
         period = request.query_params.get('period', 'week')  # 'week' یا 'month'
         weeks = int(request.query_params.get('weeks', 6))
@@ -1200,8 +1382,9 @@ class WalletViewSet(viewsets.ViewSet):
         end_date_param = request.query_params.get('end_date')
         transaction_type = request.query_params.get('transaction_type', 'all')
         search_query = request.query_params.get('search', '')
-        page = int(request.query_params.get('page', 1))
-        page_size = int(request.query_params.get('page_size', 20))
+        cursor = request.query_params.get('cursor')
+        page = request.query_params.get('page')
+        page_size = get_page_size(request)
         
         # محاسبه بازه زمانی
         now = timezone.now()
@@ -1224,6 +1407,11 @@ class WalletViewSet(viewsets.ViewSet):
         else:
             end_date = now
         
+        if timezone.is_naive(start_date):
+            start_date = timezone.make_aware(start_date)
+        if timezone.is_naive(end_date):
+            end_date = timezone.make_aware(end_date)
+        
         # فیلتر تراکنش‌ها
         queryset = Transaction.objects.filter(
             wallet=wallet,
@@ -1242,17 +1430,21 @@ class WalletViewSet(viewsets.ViewSet):
                 Q(transaction_id__icontains=search_query) |
                 Q(reference_id__icontains=search_query)
             )
+            # جستجو در آمار روزانه قابل محاسبه نیست: یک GROUP BY روی تراکنش‌های منطبق
+            daily_rows = daily_stats.group_by_day(queryset)
+        else:
+            # آمار روزهای کامل از wallet_daily_stats
+            daily_rows = daily_stats.daily_rows(
+                wallet, start_date, end_date,
+                transaction_type=None if transaction_type == 'all' else transaction_type
+            )
         
-        # محاسبه خلاصه (کل پرداختی و کل دریافتی)
+        # محاسبه خلاصه (کل پرداختی، کل دریافتی و تعداد)
         # پرداختی: transfer_out + debit
-        total_payments = queryset.filter(
-            type__in=['transfer_out', 'debit']
-        ).aggregate(total=Sum('amount'))['total'] or Decimal('0')
-        
         # دریافتی: transfer_in + charge + refund
-        total_receipts = queryset.filter(
-            type__in=['transfer_in', 'charge', 'refund']
-        ).aggregate(total=Sum('amount'))['total'] or Decimal('0')
+        totals = daily_stats.summarize(daily_rows)
+        total_payments = totals['payments']
+        total_receipts = totals['receipts']
         
         # فرمت کردن مبالغ
         def format_amount(amount):
@@ -1265,58 +1457,45 @@ class WalletViewSet(viewsets.ViewSet):
             'formatted_total_receipts': format_amount(total_receipts)
         }
         
-        # محاسبه داده‌های نمودار
+        # محاسبه داده‌های نمودار (گروه‌بندی بر اساس هفته یا ماه)
         chart_data = []
-        if period == 'week':
-            # گروه‌بندی بر اساس هفته
-            weekly_data = queryset.annotate(
-                week_start=TruncWeek('created_at')
-            ).values('week_start').annotate(
-                payments=Sum('amount', filter=Q(type__in=['transfer_out', 'debit'])),
-                receipts=Sum('amount', filter=Q(type__in=['transfer_in', 'charge', 'refund']))
-            ).order_by('week_start')
-            
-            week_num = 1
-            for item in weekly_data:
-                chart_data.append({
-                    'period': f"هفته {week_num}",
-                    'payments': item['payments'] or Decimal('0'),
-                    'receipts': item['receipts'] or Decimal('0'),
-                    'date': item['week_start'].date()
-                })
-                week_num += 1
-        else:  # month
-            # گروه‌بندی بر اساس ماه
-            monthly_data = queryset.annotate(
-                month_start=TruncMonth('created_at')
-            ).values('month_start').annotate(
-                payments=Sum('amount', filter=Q(type__in=['transfer_out', 'debit'])),
-                receipts=Sum('amount', filter=Q(type__in=['transfer_in', 'charge', 'refund']))
-            ).order_by('month_start')
-            
-            for item in monthly_data:
-                # فرمت تاریخ به صورت 1403/05
-                month_date = item['month_start']
-                chart_data.append({
-                    'period': f"{month_date.year}/{month_date.month:02d}",
-                    'payments': item['payments'] or Decimal('0'),
-                    'receipts': item['receipts'] or Decimal('0'),
-                    'date': month_date.date()
-                })
+        for index, (period_start, payments, receipts) in enumerate(daily_stats.chart(daily_rows, period), start=1):
+            chart_data.append({
+                # فرمت تاریخ ماه به صورت 1403/05
+                'period': f"هفته {index}" if period == 'week' else f"{period_start.year}/{period_start.month:02d}",
+                'payments': payments,
+                'receipts': receipts,
+                'date': period_start
+            })
         
         # دریافت لیست تراکنش‌ها (با pagination)
-        paginator = Paginator(queryset.order_by('-created_at'), page_size)
-        page_obj = paginator.get_page(page)
+        transactions_queryset = TransactionSerializer.setup_eager_loading(queryset)
+        if page is not None and cursor is None:
+            # صفحه‌بندی قدیمی با شماره صفحه
+            paginator = Paginator(transactions_queryset.order_by('-created_at', '-id'), page_size)
+            page_obj = paginator.get_page(int(page))
+            transactions = page_obj.object_list
+            has_more = page_obj.has_next()
+            next_cursor = None
+        else:
+            try:
+                page_data = keyset_page(transactions_queryset, cursor=cursor, page_size=page_size)
+            except ValueError as e:
+                return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            transactions = page_data['results']
+            next_cursor = page_data['next']
+            has_more = next_cursor is not None
         
-        transactions_serializer = TransactionSerializer(page_obj.object_list, many=True)
+        transactions_serializer = TransactionSerializer(transactions, many=True)
         
         # آماده‌سازی پاسخ
         report_data = {
             'summary': summary_data,
             'chart_data': chart_data,
             'transactions': transactions_serializer.data,
-            'total_transactions': paginator.count,
-            'has_more': page_obj.has_next()
+            'total_transactions': totals['count'],
+            'has_more': has_more,
+            'next_cursor': next_cursor
         }
         
         serializer = TransactionReportSerializer(report_data)
@@ -1343,7 +1522,7 @@ class TransactionViewSet(viewsets.ViewSet):
             )
         
         try:
-            transaction = Transaction.objects.get(
+            transaction = TransactionDetailSerializer.setup_eager_loading(Transaction.objects).get(
                 transaction_id=pk,
                 wallet=wallet
             )